@@ -6,6 +6,13 @@ import pytest
 from workspace.controller import Commander
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    """ Keep cache files from tests out of the user's cache dir """
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    return tmp_path / 'cache' / 'workspace-tools'
+
+
 @pytest.fixture()
 def wst(monkeypatch):
     def _run(cmd):
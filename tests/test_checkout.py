@@ -1,6 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 import os
+import re
+
+import pytest
+from utils.process import run
 
 from test_stubs import temp_dir
+from workspace.config import config
+from workspace.scm import (RepoState, SCMError, commit_logs, diff_branch, extract_commit_msgs, is_shallow,
+                           update_object_store)
 
 
 def test_checkout_with_http_git(wst):
@@ -20,3 +28,127 @@ def test_checkout_with_multiple_repos(wst):
         wst('checkout https://github.com/confluentinc/localconfig.git https://github.com/confluentinc/remoteconfig.git')
         assert os.path.exists('localconfig/README.rst')
         assert os.path.exists('remoteconfig/README.rst')
+
+
+def test_checkout_products_in_parallel(wst, monkeypatch, capsys):
+    monkeypatch.setattr(config.checkout, 'origin_user', 'me')
+
+    with temp_dir() as tmpdir:
+        remotes = tmpdir / 'remotes' / 'github.com'
+        for user, name in [('me', 'alpha'), ('someone', 'alpha'), ('me', 'beta'), ('me', 'gamma')]:
+            run(['git', 'init', '--bare', str(remotes / user / (name + '.git'))])
+        os.makedirs('workspace')
+        os.chdir('workspace')
+
+        urls = ['{}/{}/{}.git'.format(remotes, user, name) for user, name in [('someone', 'alpha'), ('me', 'beta'),
+                                                                              ('me', 'missing'), ('me', 'gamma')]]
+        capsys.readouterr()
+
+        with pytest.raises(SystemExit):
+            wst('checkout ' + ' '.join(urls))
+
+        out, _ = capsys.readouterr()
+        lines = out.split('\n')
+        assert sorted(lines[:8]) == sorted(['Checking out ' + url for url in urls] +
+                                           ['Finished ' + url for url in urls if url != urls[2]] +
+                                           ['Failed to checkout ' + urls[2]])
+        for url in urls:
+            done = ('Failed to checkout ' if url == urls[2] else 'Finished ') + url
+            assert lines.index('Checking out ' + url) < lines.index(done)
+        assert lines[8:10] == ['Failed to checkout 1 product(s):',
+                               "  {}: Failed to clone {}: repository '{}' does not exist".format(
+                                   urls[2], urls[2], urls[2])]
+
+        assert sorted(os.listdir('.')) == ['alpha', 'beta', 'gamma']
+        assert RepoState('alpha').remotes == ['origin', 'upstream']
+        assert RepoState('beta').remotes == ['origin']
+
+
+def test_checkout_shallow_partial_sparse(wst):
+    with temp_dir() as tmpdir:
+        run('git init source')
+        os.chdir('source')
+        for i in range(5):
+            for dir in ['src', 'docs']:
+                os.makedirs(dir, exist_ok=True)
+                with open(os.path.join(dir, 'file'), 'w') as fp:
+                    fp.write(str(i))
+            run('git add -A')
+            run(['git', 'commit', '-m', 'Commit {}'.format(i)])
+            if i == 1:
+                run('git branch feature')
+        run('git checkout feature')
+        run(['git', 'commit', '--allow-empty', '-m', 'Feature'])
+        run('git checkout master')
+        os.chdir('..')
+
+        run('git clone --bare source remotes/product.git')
+        run('git config uploadpack.allowFilter true', cwd='remotes/product.git')
+
+        wst('checkout --depth 1 --filter blob:none --sparse src file://{}/remotes/product.git'.format(tmpdir))
+
+        os.chdir('product')
+        assert is_shallow()
+        assert run('git rev-list --count HEAD', return_output=True).strip() == '1'
+        assert run('git config remote.origin.partialclonefilter', return_output=True).strip() == 'blob:none'
+        assert os.path.exists('src/file') and not os.path.exists('docs')
+
+        assert len(extract_commit_msgs(commit_logs(limit=3))) == 3
+
+        assert [line for line in diff_branch('origin/feature').split('\n') if line.startswith('    ')] == ['    Feature']
+        assert not is_shallow()
+
+
+def test_checkout_with_shared_objects(wst, monkeypatch, capsys):
+    monkeypatch.setattr(config.checkout, 'origin_user', 'me')
+    monkeypatch.setattr(config.checkout, 'shared_objects', True)
+
+    with temp_dir() as tmpdir:
+        remotes = tmpdir / 'remotes' / 'github.com'
+        run(['git', 'init', str(tmpdir / 'source')])
+        for i in range(3):
+            run(['git', 'commit', '--allow-empty', '-m', 'Commit {}'.format(i)], cwd='source')
+        for user in ['someone', 'me']:
+            run(['git', 'clone', '--bare', 'source', str(remotes / user / 'product.git')])
+        os.makedirs('workspace')
+        os.chdir('workspace')
+
+        wst('checkout {}/someone/product.git'.format(remotes))
+
+        store = tmpdir / 'workspace' / '.objects' / 'product.git'
+        assert os.path.isdir(store)
+        assert os.path.exists('product/.git/objects/info/alternates')
+        assert not os.listdir('product/.git/objects/pack')  # All objects are borrowed from the store
+        assert run('git log --format=%s', cwd='product', return_output=True).split() == ['Commit', '2', 'Commit', '1',
+                                                                                         'Commit', '0']
+        assert RepoState('product').remotes == ['origin', 'upstream']
+
+        run('git config remote.mirror.pushurl {}'.format(remotes / 'me' / 'product.git'), cwd='product')  # No url
+        capsys.readouterr()
+        wst('maintenance')
+
+        out, _ = capsys.readouterr()
+        assert out.startswith('Maintained product for 1 product(s): ')
+        assert run('git count-objects -v', cwd=str(store), return_output=True).startswith('count: 0\n')  # Packed
+        assert sorted(run('git remote', cwd=str(store), return_output=True).split()) == [
+            re.sub(r'[^\w.-]+', '-', str(remotes / user / 'product.git')).strip('-.') for user in ['me', 'someone']]
+
+
+def test_update_object_store_in_parallel(monkeypatch):
+    with temp_dir() as tmpdir:
+        run(['git', 'init', 'source'])
+        run(['git', 'commit', '--allow-empty', '-m', 'Commit'], cwd='source')
+        store = str(tmpdir / '.objects' / 'product.git')
+
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda _: update_object_store(store, [str(tmpdir / 'source')]), range(4)))
+
+        assert run('git remote', cwd=store, return_output=True).split() == [
+            re.sub(r'[^\w.-]+', '-', str(tmpdir / 'source')).strip('-.')]
+        assert not os.path.exists(store + '.lock')
+
+        monkeypatch.setattr('workspace.scm.OBJECT_STORE_LOCK_TIMEOUT', 0)
+        os.mkdir(store + '.lock')  # Left behind by an update that was killed
+
+        with pytest.raises(SCMError, match='Timed out waiting for another update'):
+            update_object_store(store)
@@ -1,11 +1,14 @@
 import logging
 import os
+import shutil
 
 import pytest
 from bumper.utils import PyPI
 from mock import Mock
 from test_stubs import temp_dir, temp_git_repo, temp_remote_git_repo
 from utils.process import run
+from workspace.commands.helpers import ToxIni
+from workspace.commands.test import Test
 from workspace.config import config
 from workspace.scm import stat_repo, all_branches
 
@@ -177,6 +180,105 @@ def test_test(wst, monkeypatch):
             assert os.path.exists('htmlcov/index.html')
 
 
+def test_test_parallel(wst, capsys):
+    with temp_git_repo() as cwd:
+        with open('setup.py', 'w') as fp:
+            fp.write('from setuptools import setup\n\nsetup(name="foo")\n')
+        with open('tox.ini', 'w') as fp:
+            fp.write('[tox]\nenvlist = one, two, three\n\n[testenv]\nenvdir = {toxinidir}/venv-{envname}\n\n'
+                     '[testenv:one]\ncommands = check one\n\n'
+                     '[testenv:two]\ncommands = check two\n\n'
+                     '[testenv:three]\nenvdir = {toxinidir}/venv-two\ncommands = check three\n')
+
+        for venv in ['venv-one', 'venv-two']:
+            os.makedirs(os.path.join(venv, 'bin'))
+            open(os.path.join(venv, 'bin', 'activate'), 'w').close()
+            with open(os.path.join(venv, 'bin', 'check'), 'w') as fp:
+                fp.write('#!/bin/sh\necho "start $1" >> {0}/checks.log\nsleep 0.5\necho "end $1" >> {0}/checks.log\n'
+                         'echo "=== test session starts ==="\n'
+                         'if [ "$1" = one ]; then echo "=== 1 failed in 0.50 seconds ==="; exit 1; fi\n'
+                         'echo "=== 1 passed in 0.50 seconds ==="\n'.format(cwd))
+            os.chmod(os.path.join(venv, 'bin', 'check'), 0o755)
+
+        capsys.readouterr()
+        with pytest.raises(SystemExit):
+            wst('test --parallel')
+
+        out = capsys.readouterr().out
+        assert 'one | === 1 failed in 0.50 seconds ===' in out
+        assert 'two | === 1 passed in 0.50 seconds ===' in out
+        assert out.endswith('one: 1 failed in 0.50 seconds\ntwo: 1 passed in 0.50 seconds\n'
+                            'three: 1 passed in 0.50 seconds\n')
+
+        with open('checks.log') as fp:
+            checks = fp.read().split('\n')
+        assert checks.index('start one') < checks.index('end two')  # Ran at the same time
+        assert abs(checks.index('start three') - checks.index('start two')) > 1  # Shares venv-two, so one at a time
+
+
+def test_test_result_cache(wst, capsys):
+    with temp_dir() as tmpdir:
+        run('git init upstream')
+        with open('upstream/upstream.py', 'w') as fp:
+            fp.write('version = 1\n')
+
+        run('git init foo')
+        os.chdir('foo')
+        with open('setup.py', 'w') as fp:
+            fp.write('from setuptools import setup\n\nsetup(name="foo")\n')
+        with open('.gitignore', 'w') as fp:
+            fp.write('venv/\n')
+        with open('tox.ini', 'w') as fp:
+            fp.write('[tox]\nenvlist = one\n\n[testenv]\nenvdir = {toxinidir}/venv\ncommands = check\n')
+
+        site_packages = os.path.join('venv', 'lib', 'python3.7', 'site-packages')
+        os.makedirs(site_packages)
+        os.makedirs(os.path.join('venv', 'bin'))
+        open(os.path.join('venv', 'bin', 'activate'), 'w').close()
+        with open(os.path.join('venv', 'bin', 'check'), 'w') as fp:
+            fp.write('#!/bin/sh\necho run >> {}/checks.log\n'.format(tmpdir))
+        os.chmod(os.path.join('venv', 'bin', 'check'), 0o755)
+        with open(os.path.join(site_packages, 'upstream.egg-link'), 'w') as fp:
+            fp.write(str(tmpdir / 'upstream') + '\n.')
+
+        def runs():
+            with open(str(tmpdir / 'checks.log')) as fp:
+                return len(fp.read().split())
+
+        wst('test')
+        wst('test')
+        assert runs() == 1
+        assert 'one: OK (cached, use --no-cache to run again)' in capsys.readouterr().out
+
+        with open(str(tmpdir / 'upstream' / 'upstream.py'), 'w') as fp:
+            fp.write('version = 2\n')
+        wst('test')
+        assert runs() == 2  # Editable upstream product changed
+
+        os.makedirs(os.path.join(site_packages, 'six-1.0.dist-info'))
+        with open(os.path.join(site_packages, 'six-1.0.dist-info', 'METADATA'), 'w') as fp:
+            fp.write('Name: six\nVersion: 1.0\n')
+        wst('test')
+        wst('test')
+        assert runs() == 3  # Installed distributions changed
+
+
+def test_supports_cov_context():
+    with temp_dir():
+        with open('tox.ini', 'w') as fp:
+            fp.write('[tox]\nenvlist = py37\n')
+        tox = ToxIni(os.getcwd())
+        assert not Test().supports_cov_context(tox, 'py37')
+
+        site_packages = os.path.join(tox.envdir('py37'), 'lib', 'python3.7', 'site-packages')
+        for version, supported in [('2.7.1', False), ('2.8.0', True), ('2.10.1', True), ('3.0rc1', True)]:
+            shutil.rmtree(site_packages, ignore_errors=True)
+            os.makedirs(os.path.join(site_packages, 'pytest_cov-{}.dist-info'.format(version)))
+            with open(os.path.join(site_packages, 'pytest_cov-{}.dist-info'.format(version), 'METADATA'), 'w') as fp:
+                fp.write('Name: pytest-cov\nVersion: {}\n'.format(version))
+            assert Test().supports_cov_context(tox, 'py37') == supported
+
+
 def test_push_without_repo(wst):
     with temp_dir():
         with pytest.raises(SystemExit):
@@ -241,4 +343,5 @@ def test_setup(wst, monkeypatch):
         assert bashrc[1] == ''
         assert bashrc[2].startswith('source ') and bashrc[2].endswith('.wstrc')
 
-        assert 'function ws()' in wstrc
\ No newline at end of file
+        assert 'function ws()' in wstrc
+        assert '-m workspace.client "$@"' in wstrc
\ No newline at end of file
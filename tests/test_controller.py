@@ -0,0 +1,61 @@
+import pytest
+
+from workspace.commands.status import Status
+from workspace.controller import COMMAND_ALIASES, Commander
+
+
+def test_command_aliases():
+    for alias, name in Commander.aliases().items():
+        assert Commander.command(alias) is Commander.command(name)
+        assert Commander.command(name).alias == alias
+
+    assert Commander.command('st') is Status
+    assert Commander.command('unknown') is None
+
+
+def test_command_override():
+    class CustomStatus(Status):
+        alias = 'stat'
+
+    class CustomCommander(Commander):
+        @classmethod
+        def commands(cls):
+            commands = super(CustomCommander, cls).commands()
+            commands['status'] = CustomStatus
+            return commands
+
+    assert CustomCommander.command('status') is CustomStatus
+    assert CustomCommander.command('stat') is CustomStatus
+    assert CustomCommander.command('st') is CustomStatus
+    assert CustomCommander.command('update').name() == 'update'
+
+
+def test_command_from_argv():
+    commander = Commander()
+
+    assert commander._command_from_argv(['st']) == 'status'
+    assert commander._command_from_argv(['--debug', 'status', '-h']) == 'status'
+    assert commander._command_from_argv(['-h', 'status']) is None
+    assert commander._command_from_argv(['--version']) is None
+    assert commander._command_from_argv(['unknown']) is None
+    assert commander._command_from_argv([]) is None
+
+
+def test_commands_metadata(cache_dir, monkeypatch):
+    metadata = Commander().commands_metadata()
+
+    assert metadata['status'] == {'help': 'Show status on current product or all products in workspace', 'aliases': ['st']}
+    assert len(list(cache_dir.glob('commands-*.json'))) == 1
+
+    monkeypatch.setattr(Commander, 'command', None)  # Cached metadata should not need the commands
+    assert Commander().commands_metadata() == metadata
+
+
+def test_command_aliases_match_command_classes(cache_dir, monkeypatch):
+    class_aliases = dict((Commander.command(name).alias, name) for name in Commander.commands()
+                         if Commander.command(name).alias)
+    assert COMMAND_ALIASES == class_aliases
+
+    monkeypatch.setitem(COMMAND_ALIASES, 'stat', 'status')
+    with pytest.raises(AssertionError):
+        Commander().commands_metadata()
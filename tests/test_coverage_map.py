@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from utils.process import run
+
+from test_stubs import temp_git_repo
+from workspace.coverage_map import CoverageMap, numbits_to_lines, parse_diff
+
+
+def write_coverage_data(path, file_lines):
+    """ Write coverage data with test contexts like pytest --cov-context=test, from a dict of path to line to contexts """
+    con = sqlite3.connect(path)
+    con.executescript('CREATE TABLE file (id INTEGER PRIMARY KEY, path TEXT);'
+                      'CREATE TABLE context (id INTEGER PRIMARY KEY, context TEXT);'
+                      'CREATE TABLE line_bits (file_id INTEGER, context_id INTEGER, numbits BLOB);'
+                      'CREATE TABLE arc (file_id INTEGER, context_id INTEGER, fromno INTEGER, tono INTEGER);')
+    contexts = {}
+    for file_id, (file_path, lines) in enumerate(sorted(file_lines.items())):
+        con.execute('INSERT INTO file VALUES (?, ?)', (file_id, os.path.abspath(file_path)))
+        context_lines = {}
+        for line, line_contexts in lines.items():
+            for context in line_contexts:
+                context_lines.setdefault(context, []).append(line)
+        for context, context_line_nums in context_lines.items():
+            if context not in contexts:
+                contexts[context] = len(contexts)
+                con.execute('INSERT INTO context VALUES (?, ?)', (contexts[context], context))
+            numbits = bytearray(max(context_line_nums) // 8 + 1)
+            for num in context_line_nums:
+                numbits[num // 8] |= 1 << (num % 8)
+            con.execute('INSERT INTO line_bits VALUES (?, ?, ?)', (file_id, contexts[context], bytes(numbits)))
+    con.commit()
+    con.close()
+
+
+def test_coverage_map():
+    with temp_git_repo() as repo:
+        os.makedirs('tests')
+        with open('foo.py', 'w') as fp:
+            fp.write('def one():\n    return 1\n\n\ndef two():\n    return 2\n')
+        with open('tests/test_foo.py', 'w') as fp:
+            fp.write('from foo import one, two\n\n\ndef test_one():\n    assert one() == 1\n\n\n'
+                     'def test_two():\n    assert two() == 2\n')
+        run('git add -A')
+        run('git commit -m Add')
+
+        cov_map = CoverageMap(str(repo))
+        assert cov_map.affected_tests() == (None, 'there is no coverage map from a full test run with coverage')
+        assert not cov_map.record()  # No .coverage
+
+        write_coverage_data('.coverage', {
+            'foo.py': {1: [''], 2: ['tests/test_foo.py::test_one|run'], 5: [''], 6: ['tests/test_foo.py::test_two|run']},
+            'tests/test_foo.py': {1: [''], 4: [''], 5: ['tests/test_foo.py::test_one|run'], 8: [''],
+                                  9: ['tests/test_foo.py::test_two|run']},
+            '/elsewhere/bar.py': {1: ['tests/test_foo.py::test_one|run']},
+        })
+        with open('.gitignore', 'w') as fp:
+            fp.write('.coverage\n')
+        objects = run('git count-objects', return_output=True)
+        assert cov_map.record()
+        assert cov_map.affected_tests() == ([], '0 tests affected by changes in 0 files')
+
+        with open('foo.py', 'w') as fp:
+            fp.write('def one():\n    return 1\n\n\ndef two():\n    return 1 + 1\n')
+        assert cov_map.affected_tests() == (['tests/test_foo.py::test_two'], '1 tests affected by changes in 1 files')
+
+        with open('foo.py', 'w') as fp:
+            fp.write('import os\n\n\ndef one():\n    return 1\n\n\ndef two():\n    return 2\n')
+        assert cov_map.affected_tests()[0] == ['tests/test_foo.py::test_one', 'tests/test_foo.py::test_two']
+
+        with open('README.rst', 'w') as fp:
+            fp.write('Docs')
+        with open('tests/test_bar.py', 'w') as fp:
+            fp.write('def test_bar():\n    pass\n')
+        assert cov_map.affected_tests()[0] == ['tests/test_bar.py', 'tests/test_foo.py::test_one',
+                                               'tests/test_foo.py::test_two']
+
+        with open('bar.py', 'w') as fp:
+            fp.write('')
+        assert cov_map.affected_tests() == (None, 'bar.py is not in the coverage map')
+
+        os.unlink('bar.py')
+        with open('requirements.txt', 'w') as fp:
+            fp.write('six')
+        assert cov_map.affected_tests() == (None, 'requirements.txt changed')
+        assert run('git count-objects', return_output=True) == objects  # Trees are not written to the repo
+
+        os.unlink('requirements.txt')
+        run('git checkout -b feature@master')
+        run('git commit --allow-empty -m Empty')
+        assert cov_map.affected_tests()[0] == ['tests/test_bar.py', 'tests/test_foo.py::test_one',
+                                               'tests/test_foo.py::test_two']
+
+        run('git checkout -b feature')
+        assert cov_map.affected_tests() == (None, 'coverage map was recorded at a commit other than HEAD')
+
+
+def test_coverage_map_from_coverage_data():
+    pytest.importorskip('coverage')
+
+    with temp_git_repo():
+        os.makedirs('tests')
+        with open('foo.py', 'w') as fp:
+            fp.write('def one():\n    return 1\n\n\ndef two():\n    return 2\n')
+        with open('tests/test_foo.py', 'w') as fp:
+            fp.write('from foo import one, two\n\n\ndef test_one():\n    assert one() == 1\n\n\n'
+                     'def test_two():\n    assert two() == 2\n')
+        with open('.gitignore', 'w') as fp:
+            fp.write('.coverage\n__pycache__/\n')
+
+        # Record like pytest --cov --cov-context=test, which switches the context to the test id for each test
+        subprocess.run([sys.executable, '-c', 'import coverage\n'
+                        'cov = coverage.Coverage()\n'
+                        'cov.start()\n'
+                        'import foo\n'
+                        'cov.switch_context("tests/test_foo.py::test_one|run")\n'
+                        'foo.one()\n'
+                        'cov.switch_context("tests/test_foo.py::test_two|run")\n'
+                        'foo.two()\n'
+                        'cov.stop()\n'
+                        'cov.save()\n'], check=True)
+
+        cov_map = CoverageMap(os.getcwd())
+        assert cov_map.record()
+        assert cov_map.affected_tests() == ([], '0 tests affected by changes in 0 files')
+
+        with open('foo.py', 'w') as fp:
+            fp.write('def one():\n    return 1\n\n\ndef two():\n    return 1 + 1\n')
+        assert cov_map.affected_tests() == (['tests/test_foo.py::test_two'], '1 tests affected by changes in 1 files')
+
+        with open('foo.py', 'w') as fp:
+            fp.write('def one():\n    return 0 + 1\n\n\ndef two():\n    return 2\n')
+        assert cov_map.affected_tests()[0] == ['tests/test_foo.py::test_one']
+
+
+def test_parse_diff():
+    diff = ('diff --git a/foo.py b/foo.py\nindex 1..2 100644\n--- a/foo.py\n+++ b/foo.py\n'
+            '@@ -2 +2 @@ def one():\n-    return 1\n+    return 2\n@@ -6,0 +7,2 @@\n+\n+x = 1\n'
+            'diff --git a/new file.py b/new file.py\nnew file mode 100644\n--- /dev/null\n+++ b/new file.py\n'
+            '@@ -0,0 +1 @@\n+y = 2\n')
+    assert parse_diff(diff) == {'foo.py': {2, 6, 7}, 'new file.py': {0, 1}}
+
+    assert numbits_to_lines(b'\x06\x01') == [1, 2, 8]
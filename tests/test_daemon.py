@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+import time
+
+from utils.process import run
+
+from test_stubs import temp_dir, temp_git_repo
+from workspace.client import socket_file
+from workspace.commands.daemon import Daemon
+from workspace.config import USER_CONFIG_FILE, WorkspaceConfig
+from workspace.scm import RepoState, repo_stamp
+
+
+def client(cmd, **kwargs):
+    return run([sys.executable, '-m', 'workspace.client'] + cmd.split(), **kwargs)
+
+
+def test_daemon():
+    daemon = subprocess.Popen(['wst', 'daemon', '--foreground'])
+
+    try:
+        for _ in range(100):
+            if os.path.exists(socket_file()):
+                break
+            time.sleep(0.1)
+
+        assert run('wst daemon --status', return_output=True).startswith('Daemon is running')
+
+        with temp_git_repo():
+            run('git commit --allow-empty -m Dummy')
+            assert client('status', return_output=True) == '# Branches: master\n'
+
+        with temp_dir():
+            output, success = client('log', return_output=2)
+            assert not success
+            assert 'This should be run from within a product checkout' in output
+
+    finally:
+        run('wst daemon --stop')
+        daemon.wait(10)
+
+    assert not os.path.exists(socket_file())
+
+    with temp_git_repo():  # Runs in-process without daemon
+        run('git commit --allow-empty -m Dummy')
+        assert client('status', return_output=True) == '# Branches: master\n'
+
+
+def test_daemon_keeps_repo_states(cache_dir, monkeypatch):
+    with temp_git_repo() as repo:
+        run('git commit --allow-empty -m Dummy')
+
+        daemon = Daemon()
+        daemon.repo_states = {}
+        monkeypatch.setattr('workspace.scm._warm_repo_states', daemon.repo_states)
+
+        worker = Daemon()
+        worker.repo_states = dict(daemon.repo_states)
+        state = RepoState(str(repo))
+        assert state.branches() == ['master'] and not state.dirty
+        worker.repo_states[str(repo)] = (repo_stamp(str(repo)), state)
+        worker.save_repo_states(daemon.repo_states)
+
+        daemon.load_repo_states()
+        assert list(daemon.repo_states) == [str(repo)]
+        stamp, kept_state = daemon.repo_states[str(repo)]
+        assert stamp == repo_stamp(str(repo))
+        assert kept_state.branches() == ['master']
+        assert kept_state._status is None
+        assert not list((cache_dir / 'daemon-repo-states').iterdir())
+
+
+def test_daemon_reloads_user_config(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    config = WorkspaceConfig(USER_CONFIG_FILE)
+    config.reload()
+    monkeypatch.setattr('workspace.commands.daemon.config', config)
+
+    config_file = tmp_path / '.config' / 'workspace.cfg'
+    config_file.parent.mkdir()
+    config_file.write_text('[test]\nresult_cache_days = 1\n')
+
+    daemon = Daemon()
+    assert config.test.result_cache_days == 1
+
+    config_file.write_text('[test]\n')
+    os.utime(str(config_file), (0, 0))
+    daemon.refresh()
+    assert config.test.result_cache_days == 7  # Removed key reverts to the default
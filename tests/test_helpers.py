@@ -1,4 +1,8 @@
-from workspace.commands.helpers import expand_product_groups
+import os
+import time
+
+from test_stubs import temp_dir
+from workspace.commands.helpers import expand_product_groups, ToxIni
 
 
 def test_expand_product_groups(monkeypatch):
@@ -10,3 +14,97 @@ def test_expand_product_groups(monkeypatch):
     assert expand_product_groups(['ws', 'name2']) == sorted(['workspace-tools', 'clicast', 'localconfig', 'remoteconfig', 'name2'])
     assert expand_product_groups(['ws', '-localconfig']) == sorted(['workspace-tools', 'clicast', 'remoteconfig'])
     assert expand_product_groups(['ws', '-config']) == sorted(['workspace-tools', 'clicast'])
+
+
+def test_stale_env_reasons():
+    with temp_dir():
+        with open('tox.ini', 'w') as fp:
+            fp.write('[tox]\nenvlist = py37\n\n[testenv]\ndeps = -rrequirements.txt\ncommands = pytest\n')
+        with open('requirements.txt', 'w') as fp:
+            fp.write('requests==2.0  # HTTP\nclick\n')
+        with open('setup.py', 'w') as fp:
+            fp.write('from setuptools import setup\n\nsetup(name="foo", install_requires=["requests"])\n')
+
+        tox = ToxIni(os.getcwd())
+        assert tox.stale_env_reasons('py37') == ['env does not exist']
+
+        os.makedirs(tox.envdir('py37'))
+        assert tox.stale_env_reasons('py37') == []  # Fingerprinted as envdir is newer
+
+        os.utime('requirements.txt', (time.time() + 10, time.time() + 10))
+        with open('requirements.txt', 'w') as fp:
+            fp.write('# Pinned\nclick\n\nrequests==2.0\n')
+        with open('tox.ini', 'a') as fp:
+            fp.write('    --cov\n')
+        assert tox.stale_env_reasons('py37') == []
+
+        with open('requirements.txt', 'a') as fp:
+            fp.write('six\n')
+        with open('tox.ini', 'a') as fp:
+            fp.write('\n[testenv:py37]\nbasepython = python3\n')
+        with open('setup.py', 'w') as fp:
+            fp.write('from setuptools import setup\n\nsetup(name="foo", install_requires=["requests", "six"])\n')
+        tox = ToxIni(os.getcwd())
+        assert tox.stale_env_reasons('py37') == ['python changed', 'requirements.txt changed',
+                                                 'setup.py install_requires changed', 'tox.ini [testenv] changed']
+
+        tox.save_env_fingerprint('py37')
+        assert tox.stale_env_reasons('py37') == []
+
+        with open('tox.ini', 'a') as fp:
+            fp.write('passenv = HOME\ndeps = -r {toxinidir}/requirements-test.txt\n')
+        with open('requirements-test.txt', 'w') as fp:
+            fp.write('pytest\n')
+        tox = ToxIni(os.getcwd())
+        assert tox.stale_env_reasons('py37') == ['requirements-test.txt changed', 'tox.ini [testenv] changed']
+
+        tox.save_env_fingerprint('py37')
+        with open('tox.ini', 'a') as fp:
+            fp.write('changedir = tests\n')  # Does not affect what is installed
+        with open('requirements-test.txt', 'w') as fp:
+            fp.write('pytest\nmock\n')
+        tox = ToxIni(os.getcwd())
+        assert tox.stale_env_reasons('py37') == ['requirements-test.txt changed']
+
+
+def test_requirements_delta():
+    with temp_dir():
+        with open('tox.ini', 'w') as fp:
+            fp.write('[tox]\nenvlist = py37\n\n[testenv]\ninstall_command = pip install -U {packages}\n')
+        with open('requirements.txt', 'w') as fp:
+            fp.write('requests>=2.0\nclick\nsix\n')
+
+        tox = ToxIni(os.getcwd())
+        site_packages = os.path.join(tox.envdir('py37'), 'lib', 'python3.7', 'site-packages')
+        for name, version in [('requests', '2.1'), ('Click', '7.0'), ('six', '1.0')]:
+            os.makedirs(os.path.join(site_packages, '{}-{}.dist-info'.format(name, version)))
+            with open(os.path.join(site_packages, '{}-{}.dist-info'.format(name, version), 'METADATA'), 'w') as fp:
+                fp.write('Metadata-Version: 2.1\nName: {}\nVersion: {}\n\nName: Not a header\n'.format(name, version))
+
+        assert tox.installed_distributions('py37') == {'requests': '2.1', 'click': '7.0', 'six': '1.0'}
+        assert tox.editable_paths('py37') == {}
+
+        with open(os.path.join(site_packages, 'six-1.0.dist-info', 'direct_url.json'), 'w') as fp:
+            fp.write('{"url": "file:///src/my%20six", "dir_info": {"editable": true}}')
+        with open(os.path.join(site_packages, 'other.egg-link'), 'w') as fp:
+            fp.write('/src/other\n.')
+        assert tox.editable_paths('py37') == {'six': '/src/my six', 'other': '/src/other'}
+        os.unlink(os.path.join(site_packages, 'other.egg-link'))
+        assert tox.requirements_delta('py37') is None  # Not developed by wst yet
+
+        tox.save_env_fingerprint('py37')
+        assert tox.requirements_delta('py37') == ([], [])
+
+        with open('requirements.txt', 'w') as fp:
+            fp.write('requests>=2.2\nclick\nsimplejson\n')
+        assert tox.stale_env_reasons('py37') == ['requirements.txt changed']
+        assert tox.requirements_delta('py37') == (['requests>=2.2', 'simplejson'], ['six'])
+        assert tox.install_command('py37', ['simplejson']) == ['pip', 'install', '-U', 'simplejson']
+
+        with open(os.path.join(site_packages, 'Click-7.0.dist-info', 'METADATA'), 'w') as fp:
+            fp.write('Name: Click\nVersion: 7.0\nRequires-Dist: Six (>=1.0)\nRequires-Dist: requests ; extra == "http"\n')
+        assert tox.requirements_delta('py37') == (['requests>=2.2', 'simplejson'], [])  # Click still requires six
+
+        with open('requirements.txt', 'a') as fp:
+            fp.write('-e ../other\n')
+        assert tox.requirements_delta('py37') is None
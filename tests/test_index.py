@@ -0,0 +1,48 @@
+import os
+
+from utils.process import run
+
+from test_stubs import temp_dir
+from workspace.index import WorkspaceIndex
+from workspace.scm import repos
+
+
+def test_workspace_index(cache_dir):
+    with temp_dir() as workspace:
+        run('git init beta')
+        run('git commit --allow-empty -m Dummy', cwd=str(workspace / 'beta'))
+        os.makedirs('alpha')
+        (workspace / 'file').write_text('not a dir')
+
+        assert repos() == [str(workspace / 'beta')]
+
+        entries = WorkspaceIndex(str(workspace)).entries()
+        assert list(entries) == ['beta']
+        assert entries['beta']['branch'] == 'master'
+        assert entries['beta']['head'] == run('git rev-parse HEAD', cwd=str(workspace / 'beta'), return_output=True).strip()
+        assert entries['beta']['remotes'] == []
+        assert len(list(cache_dir.glob('index-*.json'))) == 1
+
+        run('git init', cwd=str(workspace / 'alpha'))  # Existing dir becomes a repo
+        run('git checkout -b feature', cwd=str(workspace / 'beta'))
+        run('git remote add origin ../alpha', cwd=str(workspace / 'beta'))
+
+        entries = WorkspaceIndex(str(workspace)).entries()
+        assert list(sorted(entries)) == ['alpha', 'beta']
+        assert entries['beta']['branch'] == 'feature'
+        assert entries['beta']['remotes'] == ['origin']
+        assert repos() == [str(workspace / 'alpha'), str(workspace / 'beta')]
+
+        run('rm -rf beta')
+        assert repos() == [str(workspace / 'alpha')]
+
+
+def test_index_rebuild(wst, capsys):
+    with temp_dir():
+        run('git init alpha')
+
+        wst('index --rebuild')
+
+        out, _ = capsys.readouterr()
+        assert out.startswith('Rebuilt index for')
+        assert out.split('\n')[1] == 'alpha  -        -  -'
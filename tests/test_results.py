@@ -0,0 +1,33 @@
+import os
+import time
+
+from workspace.commands.test import Test
+from workspace.config import config
+from workspace.results import TestResult
+
+
+def test_test_result(cache_dir, monkeypatch):
+    key = TestResult.key('tree', 'py37', {'python': 'hash'}, ['pytest {env:PYTESTARGS:}', ''])
+    assert key != TestResult.key('tree', 'py37', {'python': 'hash'}, ['pytest {env:PYTESTARGS:}', '-k test_pass'])
+    assert TestResult.load(key) is None
+
+    TestResult('py37', summary='1 passed in 0.01 seconds').save(key)
+    result = TestResult.load(key)
+    assert result.env == 'py37'
+    assert result.summary == '1 passed in 0.01 seconds'
+    assert result.output is None
+    assert Test.summarize(result) == (True, '1 passed in 0.01 seconds')
+    assert Test.summarize({'foo': result, 'bar': TestResult('py37')}) == (
+        True, ['bar: Test successful / No output', 'foo: 1 passed in 0.01 seconds'])
+
+    old_key = TestResult.key('old tree', 'py37', {}, [])
+    TestResult('py37', time=time.time() - 8 * 86400).save(old_key)
+    assert TestResult.load(old_key) is None
+
+    expired_file = cache_dir / 'test-results' / (key + '.json')
+    os.utime(str(expired_file), (time.time() - 8 * 86400, time.time() - 8 * 86400))
+    TestResult('py37').save(old_key)
+    assert not expired_file.exists()
+
+    monkeypatch.setattr(config.test, 'result_cache_days', 0)
+    assert TestResult.load(old_key) is None
@@ -0,0 +1,355 @@
+from datetime import datetime, timezone
+import os
+import re
+import subprocess
+import threading
+
+from utils.process import run
+
+from test_stubs import temp_dir, temp_git_repo
+from workspace.commands.publish import Publish
+from workspace.scm import (QueryCache, RepoState, all_branches, commit_logs, deepen, current_branch, git_dir, git_config,
+                           read_refs, query_cache, keep_repo_states, repo_state, checkout_branch, create_branch,
+                           iter_commits, is_shallow, last_release, release_index, tag_release, working_tree_hash)
+
+
+def test_repo_state():
+    with temp_git_repo():
+        state = RepoState()
+        assert state.current_branch is None
+        assert state.branches() == []
+        assert state.remotes == []
+        assert not state.dirty
+
+        run('git commit --allow-empty -m Dummy')
+        run('git checkout -b feature@master')
+        with open('new_file', 'w') as fp:
+            fp.write('new')
+
+        state = RepoState()
+        assert state.current_branch == 'feature@master'
+        assert state.branches() == ['feature@master', 'master']
+        assert state.untracked == 1
+        assert state.dirty
+
+        run('git add new_file')
+        state = RepoState()
+        assert (state.staged, state.modified, state.untracked) == (1, 0, 0)
+
+        run('git commit -m Add')
+        run('git checkout HEAD^0')
+        state = RepoState()
+        assert state.detached
+        assert re.fullmatch(r'\(HEAD detached at \w{7}\)', state.current_branch)
+        assert re.fullmatch(r'\w{7}\* feature@master master', ' '.join(state.branches(verbose=True)))
+        assert not state.dirty
+
+
+def test_repo_state_with_remotes():
+    with temp_dir() as tmpdir:
+        run('git init --bare upstream.git')
+        run('git clone upstream.git repo')
+        os.chdir('repo')
+        run('git commit --allow-empty -m Dummy')
+        run('git push origin master')
+        run('git remote add upstream ../upstream.git')
+        run('git fetch upstream')
+        run('git branch -u upstream/master')
+        run('git checkout -b feature@master')
+        run('git push -u upstream feature@master')
+
+        state = RepoState()
+        assert state.remotes == ['origin', 'upstream']
+        assert (state.default_remote, state.upstream_remote) == ('origin', 'upstream')
+        assert state.tracking_branch() == 'upstream/feature@master'
+        assert state.tracking_branch('master') == 'upstream/master'
+        assert state.has_remote_branch('origin/master')
+        assert not state.has_remote_branch('origin/feature@master')
+        assert state.branches(verbose=True) == ['feature@master^u', 'master']
+        assert 'remotes/upstream/feature@master' in state.branches(remotes=True)
+
+        run('git commit --allow-empty -m Ahead')
+        state = RepoState()
+        assert (state.upstream, state.ahead, state.behind) == ('upstream/feature@master', 1, 0)
+
+        assert all_branches(str(tmpdir / 'repo')) == ['feature@master', 'master']
+        assert current_branch(str(tmpdir / 'repo')) == 'feature@master'
+        assert git_config()[('remote', 'upstream')]['url'] == '../upstream.git'
+
+        run('git worktree add ../worktree master')
+        os.chdir('../worktree')
+        assert git_dir() == str(tmpdir / 'repo' / '.git' / 'worktrees' / 'worktree')
+        assert RepoState().remotes == ['origin', 'upstream']
+        assert RepoState().current_branch == 'master'
+
+
+def test_repo_state_spawns_few_processes(monkeypatch):
+    """ Benchmark for the number of git processes spawned to get the state of a repo """
+    with temp_git_repo():
+        run('git commit --allow-empty -m Dummy')
+        run('git remote add origin ../origin.git')
+
+        spawns = []
+        popen_init = subprocess.Popen.__init__
+
+        def count_popen(self, *args, **kwargs):
+            spawns.append(args[0] if args else kwargs['args'])
+            popen_init(self, *args, **kwargs)
+
+        monkeypatch.setattr(subprocess.Popen, '__init__', count_popen)
+
+        state = RepoState()
+        state.current_branch, state.branches(remotes=True, verbose=True), state.remotes, state.tracking_branch()
+        assert len(spawns) == 0
+
+        state.head, state.ahead, state.behind, state.dirty
+        assert len(spawns) == 1
+
+
+def test_read_refs(monkeypatch):
+    with temp_git_repo():
+        assert read_refs() == ('ref: refs/heads/master', {})
+
+        run('git commit --allow-empty -m Dummy')
+        run('git branch feature/nested')
+        run('git update-ref refs/remotes/origin/master HEAD')
+        run('git symbolic-ref refs/remotes/origin/HEAD refs/remotes/origin/master')
+        sha = run('git rev-parse HEAD', return_output=True).strip()
+
+        refs = {'refs/heads/master': sha, 'refs/heads/feature/nested': sha, 'refs/remotes/origin/master': sha,
+                'refs/remotes/origin/HEAD': 'ref: refs/remotes/origin/master'}
+        assert read_refs() == ('ref: refs/heads/master', refs)
+
+        run('git pack-refs --all')
+        run('git commit --allow-empty -m Loose')
+        refs['refs/heads/master'] = run('git rev-parse HEAD', return_output=True).strip()
+        assert read_refs() == ('ref: refs/heads/master', refs)
+
+        state = RepoState()
+        assert state.branches() == ['master', 'feature/nested']
+        assert 'remotes/origin/HEAD -> origin/master' in state.branches(remotes=True)
+        assert state.has_remote_branch('origin/master')
+
+        with monkeypatch.context() as m:  # Falls back to git
+            m.setenv('GIT_DIR', '.git')
+            assert read_refs() is None
+            assert RepoState().branches(remotes=True) == state.branches(remotes=True)
+
+        run('git checkout feature/nested~0')
+        assert read_refs()[0] == sha
+        assert RepoState().current_branch == '(HEAD detached at {})'.format(sha[:7])
+
+
+def test_query_cache(caplog):
+    with temp_git_repo():
+        run('git commit --allow-empty -m Dummy')
+
+        assert repo_state() is not repo_state()
+
+        with caplog.at_level('DEBUG'), query_cache() as cache:
+            state = repo_state()
+            assert current_branch() == 'master'
+            assert all_branches() == ['master']
+
+            with query_cache() as nested_cache:
+                assert nested_cache is cache
+                assert repo_state() is state
+
+            create_branch('feature')
+            assert repo_state() is not state
+            assert all_branches() == ['feature', 'master']
+
+            checkout_branch('master')
+            assert current_branch() == 'master'
+
+            assert (cache.hits, cache.misses) == (8, 6)
+
+        assert 'SCM query cache: 8 hits, 6 misses' in caplog.text
+
+
+def test_query_cache_runs_queries_at_the_same_time():
+    cache = QueryCache()
+    both_running = threading.Barrier(2, timeout=5)
+
+    def query(name):
+        both_running.wait()  # Times out if the queries are run one at a time
+        return name
+
+    threads = [threading.Thread(target=cache.get, args=(('query', name), lambda name=name: query(name)))
+               for name in ('repo1', 'repo2')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.entries == {('query', 'repo1'): 'repo1', ('query', 'repo2'): 'repo2'}
+
+    def invalidated_query():
+        cache.invalidate()
+        return 'stale'
+
+    assert cache.get(('query', 'repo3'), invalidated_query) == 'stale'
+    assert ('query', 'repo3') not in cache.entries  # Not cached as it was invalidated while querying
+
+
+def _fast_import_commits(msgs, branch='master'):
+    """ Quickly create empty commits with the given messages (oldest first) on the branch """
+    stream = ''.join('commit refs/heads/{}\ncommitter T <t@t> {} +0000\ndata {}\n{}\n'.format(
+                     branch, 1500000000 + i, len(msg.encode()), msg) for i, msg in enumerate(msgs))
+    subprocess.run(['git', 'fast-import', '--quiet'], input=stream.encode(), check=True)
+
+
+def test_keep_repo_states(monkeypatch):
+    with temp_git_repo() as repo:
+        run('git commit --allow-empty -m Dummy')
+
+        states = keep_repo_states()
+        monkeypatch.setattr('workspace.scm._warm_repo_states', states)
+
+        state = repo_state()
+        assert state.branches() == ['master']
+        assert not state.dirty
+        assert list(states) == [str(repo)]
+
+        with open('file', 'w') as fp:
+            fp.write('Edit does not change the stamp')
+        assert repo_state() is state
+        assert state.dirty  # Status is read again
+
+        run('git branch feature')
+        new_state = repo_state()
+        assert new_state is not state
+        assert new_state.branches() == ['master', 'feature']
+        assert states[str(repo)][1] is new_state
+
+
+def test_working_tree_hash():
+    with temp_git_repo():
+        empty_tree_hash = working_tree_hash()
+        assert empty_tree_hash
+
+        with open('file', 'w') as fp:
+            fp.write('content')
+        with open('.gitignore', 'w') as fp:
+            fp.write('ignored\n')
+        with open('ignored', 'w') as fp:
+            fp.write('ignored')
+        tree_hash = working_tree_hash()
+        assert tree_hash != empty_tree_hash
+        assert run('git status --porcelain', return_output=True) == '?? .gitignore\n?? file\n'  # Index is unchanged
+        assert run('git count-objects', return_output=True).startswith('0 objects')  # Nor are objects written
+
+        run('git add file .gitignore')
+        run('git commit -m Add')
+        with open('ignored', 'w') as fp:
+            fp.write('changed')
+        assert working_tree_hash() == tree_hash
+
+        with open('file', 'w') as fp:
+            fp.write('changed')
+        assert working_tree_hash() != tree_hash
+
+    with temp_dir():
+        assert working_tree_hash() is None
+
+
+def test_iter_commits():
+    with temp_git_repo():
+        assert list(iter_commits()) == []
+
+        run(['git', 'commit', '--allow-empty', '-m', 'First', '--author', 'Jane <jane@example.com>'])
+        run('git tag 1.0.0')
+        run(['git', 'commit', '--allow-empty', '-m', 'Second\n\nBody\n\nMore body'])
+
+        second, first = iter_commits()
+        assert (first.author, first.email, first.subject, first.body) == ('Jane', 'jane@example.com', 'First', '')
+        assert first.refs == ['tag: 1.0.0'] and first.parents == ()
+        assert second.parents == (first.sha,)
+        assert second.refs == ['HEAD -> master']
+        assert second.message == 'Second\n\nBody\n\nMore body'
+        assert second.date.tzinfo is not None
+        assert [c.sha for c in iter_commits('1.0.0')] == [first.sha]
+
+
+def test_iter_commits_is_lazy_and_deepens_shallow_repo(monkeypatch):
+    with temp_dir():
+        run('git init source')
+        os.chdir('source')
+        _fast_import_commits(['Publish version 1.0.0'] + ['Change {}'.format(i) for i in range(150)])
+        run('git checkout master')
+
+        commits = iter_commits()
+        commit = next(commits)
+        assert commit.subject == 'Change 149'
+        assert commit.date == datetime.fromtimestamp(1500000150, timezone.utc)
+        commits.close()  # Stops git log
+
+        assert Publish().changes_since_last_publish() == ('1.0.0', ['Change {}'.format(i) for i in range(149, -1, -1)])
+
+        with temp_dir():  # Never published, so only the most recent changes are used
+            run('git init unpublished')
+            os.chdir('unpublished')
+            _fast_import_commits(['Change {}'.format(i) for i in range(150)])
+            run('git checkout master')
+
+            assert Publish().changes_since_last_publish() == (None, ['Change {}'.format(i) for i in range(149, 49, -1)])
+
+        old_commit = run('git rev-parse HEAD~50', return_output=True).strip()
+        run('git clone --depth 10 file://{} ../shallow'.format(os.getcwd()))
+        os.chdir('../shallow')
+
+        fetches = []
+        monkeypatch.setattr('workspace.scm.deepen', lambda *args, **kwargs: fetches.append(args) or deepen(*args, **kwargs))
+
+        assert len(list(iter_commits('HEAD~3..HEAD'))) == 3
+        assert is_shallow() and not fetches  # Range ended before the shallow boundary
+
+        assert len(list(iter_commits(old_commit + '..HEAD'))) == 50  # Boundary is fetched
+        assert is_shallow() and len(fetches) == 1
+
+        assert len(list(iter_commits())) == 151
+        assert not is_shallow()
+
+
+def test_commit_logs_deepens_shallow_repo_to_bounded_depth():
+    with temp_dir():
+        run('git init source')
+        os.chdir('source')
+        _fast_import_commits(['Change {}'.format(i) for i in range(150)])
+        run('git checkout master')
+
+        run('git clone --depth 10 file://{} ../shallow'.format(os.getcwd()))
+        os.chdir('../shallow')
+
+        assert 'Change 149' in commit_logs()
+        assert is_shallow()
+        assert run('git rev-list --count HEAD', return_output=True).strip() == '100'
+
+
+def test_last_release():
+    with temp_git_repo():
+        assert last_release(msg_prefix='Publish version ') == (None, None)
+
+        _fast_import_commits(['Initial', 'Publish version 0.9.0', 'Change'])
+        old_publish = run('git rev-parse master~', return_output=True).strip()
+        assert last_release() == (None, None)
+        assert last_release(msg_prefix='Publish version ') == ('0.9.0', old_publish)
+        assert release_index() == {'0.9.0': old_publish}  # No need to search the history again
+
+        run('git commit --allow-empty -m "Publish version 1.0.0"', shell=True)
+        tag_release('1.0.0', msg='Publish version 1.0.0')
+        run('git commit --allow-empty -m Feature')
+        head = run('git rev-parse HEAD~', return_output=True).strip()
+        assert last_release() == ('1.0.0', head)
+
+        run('git tag v1.10.0 HEAD')  # Not in the format that tag_release writes
+        run('git tag 1.10.0 HEAD')
+        run('git tag not-a-version HEAD')
+        run(['git', 'tag', '-a', '2.0.0', '-m', 'Merge upstream 2.0.0', 'HEAD'])
+        assert last_release(msg_prefix='Publish version ') == ('1.0.0', head)
+        assert last_release()[0] == '2.0.0'
+
+        tag_release('1.1.0', msg='Publish version 1.1.0')
+        run('git checkout -b maintenance HEAD~3')
+        assert last_release('.') == ('0.9.0', old_publish)
+        assert last_release(revision='master', msg_prefix='Publish version ')[0] == '1.1.0'
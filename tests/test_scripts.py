@@ -1,7 +1,11 @@
 import pytest
 import subprocess
+import sys
 
 from utils.process import run
+from test_stubs import temp_git_repo
+
+HEAVY_MODULES = ['bumper', 'git', 'pkg_resources', 'requests']
 
 
 @pytest.mark.parametrize("script", ['wst'])
@@ -12,3 +16,18 @@ def test_script_sanity(script):
     except subprocess.CalledProcessError as e:
         print(e.output)
         assert e.returncode == 0
+
+
+def test_status_does_not_import_heavy_modules():
+    script = """
+import sys
+from workspace.controller import Commander
+sys.argv = ['wst', 'st']
+Commander().run()
+print('Imported:', *[m for m in {} if m in sys.modules])
+""".format(HEAVY_MODULES)
+
+    with temp_git_repo():
+        output = run([sys.executable, '-c', script], return_output=True)
+
+    assert output.strip().split('\n')[-1] == 'Imported:'
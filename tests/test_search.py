@@ -0,0 +1,104 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from utils.process import run
+
+from test_stubs import temp_dir
+from workspace.config import config
+from workspace.search import SEARCH_WORKERS, search_repos
+
+
+@pytest.fixture()
+def search_api(monkeypatch):
+    """ Local stand-in for the Github search API that returns repos from a dict of name to URL """
+    repos = {}
+    requests = []
+
+    class SearchHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive
+
+        def do_GET(self):
+            name = parse_qs(urlparse(self.path).query)['q'][0]
+            requests.append((name, self.client_address))
+            body = json.dumps({'items': [{'ssh_url': repos[name]}] if name in repos else []}).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SearchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(config.checkout, 'search_api_url', 'http://127.0.0.1:{}/search'.format(server.server_port))
+
+    yield repos, requests
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_search_repos(search_api, monkeypatch):
+    repos, requests = search_api
+    repos.update({'alpha': 'git@example.com:team/alpha.git', 'beta': 'git@example.com:team/beta.git'})
+
+    assert search_repos(['alpha']) == ({'alpha': repos['alpha']}, {})
+    assert search_repos(['beta']) == ({'beta': repos['beta']}, {})
+    assert len(set(client for _, client in requests)) == 1  # Connection is reused
+
+    assert search_repos(['alpha', 'beta', 'gamma']) == ({'alpha': repos['alpha'], 'beta': repos['beta']},
+                                                        {'gamma': 'No repo matching "gamma" found.'})
+    assert [name for name, _ in requests] == ['alpha', 'beta', 'gamma']  # Others are cached
+
+    monkeypatch.setattr(config.checkout, 'search_cache_hours', 0)
+    repos['alpha'] = 'git@example.com:other/alpha.git'
+    assert search_repos(['alpha']) == ({'alpha': repos['alpha']}, {})
+
+    monkeypatch.setattr(config.checkout, 'search_api_url', 'http://127.0.0.1:1/offline')
+    assert search_repos(['alpha']) == ({'alpha': repos['alpha']}, {})  # From expired cache
+    urls, errors = search_repos(['gamma'])
+    assert not urls and errors['gamma'].startswith('Could not find repo for gamma using http://127.0.0.1:1/offline')
+
+
+def test_search_repos_at_the_same_time(search_api, monkeypatch):
+    repos, requests = search_api
+    names = ['repo{}'.format(i) for i in range(SEARCH_WORKERS * 2)]
+    repos.update((name, 'git@example.com:team/{}.git'.format(name)) for name in names)
+
+    assert search_repos(names) == (repos, {})
+
+    monkeypatch.setattr(config.checkout, 'search_cache_hours', 0)
+    clients = set(client for _, client in requests)
+    assert len(clients) <= SEARCH_WORKERS
+
+    search_repos(names)
+    assert set(client for _, client in requests) == clients  # Pooled connections are reused, none are dropped
+
+
+def test_checkout_searched_repos(search_api, wst, capsys):
+    repos, requests = search_api
+
+    with temp_dir() as tmpdir:
+        for name in ['alpha', 'beta']:
+            run(['git', 'init', '--bare', 'remotes/{}.git'.format(name)])
+            repos[name] = str(tmpdir / 'remotes' / '{}.git'.format(name))
+        os.makedirs('workspace')
+        os.chdir('workspace')
+
+        capsys.readouterr()
+
+        with pytest.raises(SystemExit):
+            wst('checkout alpha beta gamma')
+
+        out, _ = capsys.readouterr()
+        assert 'Using repo url {} for alpha\n'.format(repos['alpha']) in out
+        assert out.endswith('Failed to checkout 1 product(s):\n  gamma: No repo matching "gamma" found.\n')
+        assert sorted(os.listdir('.')) == ['alpha', 'beta']
+        assert sorted(name for name, _ in requests) == ['alpha', 'beta', 'gamma']
@@ -1,7 +1,9 @@
 import re
+import time
 
 from utils.process import run
-from test_stubs import temp_git_repo
+from test_stubs import temp_dir, temp_git_repo
+from workspace.scm import repo_state
 
 
 def test_status(wst, capsys):
@@ -24,3 +26,82 @@ def test_status(wst, capsys):
         wst('status')
         out, _ = capsys.readouterr()
         assert re.fullmatch('# Branches: \w+\* feature master\n', out)
+
+
+def test_status_alias(wst, capsys):
+    with temp_git_repo():
+        run('git commit --allow-empty -m Dummy')
+        wst('st')
+        out, _ = capsys.readouterr()
+        assert out == '# Branches: master\n'
+
+
+def test_status_workspace(wst, capfd, monkeypatch):
+    with temp_dir() as workspace:
+        for name in ['zeta', 'alpha', 'slow']:
+            run('git init ' + name)
+            run('git commit --allow-empty -m Dummy', cwd=str(workspace / name))
+            run('git checkout -b feature@master', cwd=str(workspace / name))
+
+        def slow_repo_state(repo):
+            if repo.endswith('slow'):
+                time.sleep(2)
+            return repo_state(repo)
+
+        monkeypatch.setattr('workspace.commands.status.repo_state', slow_repo_state)
+        monkeypatch.setattr('workspace.commands.status.config.status.timeout', 0.5)
+        monkeypatch.setenv('PAGER', 'cat')
+
+        wst('status')
+
+        out, _ = capfd.readouterr()
+        assert out.endswith('[ alpha ]\n# Branches: feature@master\n\n'
+                            '[ slow ]\n# Timed out after 0.5 seconds\n\n'
+                            '[ zeta ]\n# Branches: feature@master\n\n')
+
+
+def test_status_summary(wst, capsys):
+    with temp_dir() as workspace:
+        for name in ['beta', 'alpha']:
+            run('git init ' + name)
+            run('git commit --allow-empty -m Dummy', cwd=str(workspace / name))
+
+        run('git checkout -b feature@master', cwd=str(workspace / 'beta'))
+        run('git checkout -b fix@master', cwd=str(workspace / 'beta'))
+        (workspace / 'beta' / 'new_file').write_text('new')
+        run('git add new_file', cwd=str(workspace / 'beta'))
+        (workspace / 'beta' / 'new_file').write_text('changed')
+        (workspace / 'beta' / 'untracked_file').write_text('untracked')
+
+        capsys.readouterr()
+        wst('status --summary')
+
+        out, _ = capsys.readouterr()
+        assert out == ('Product  Ahead  Behind  Staged  Modified  Untracked  Branch      Child Branches\n'
+                       'alpha        -       -       -         -          -  master\n'
+                       'beta         -       -       1         1          1  fix@master  feature@master\n')
+
+
+def test_status_summary_timeout(wst, capsys, monkeypatch):
+    with temp_dir() as workspace:
+        for name in ['slow', 'fast']:
+            run('git init ' + name)
+            run('git commit --allow-empty -m Dummy', cwd=str(workspace / name))
+
+        def slow_repo_state(repo):
+            if repo.endswith('slow'):
+                time.sleep(2)
+            return repo_state(repo)
+
+        monkeypatch.setattr('workspace.commands.status.repo_state', slow_repo_state)
+        monkeypatch.setattr('workspace.commands.status.config.status.timeout', 0.5)
+
+        capsys.readouterr()
+        start_time = time.time()
+        wst('status --summary')
+        assert time.time() - start_time < 1.5
+
+        out, _ = capsys.readouterr()
+        assert out == ('Product  Ahead  Behind  Staged  Modified  Untracked  Branch  Child Branches\n'
+                       'fast         -       -       -         -          -  master\n'
+                       'slow                                                 (timed out after 0.5 seconds)\n')
@@ -0,0 +1,238 @@
+import os
+
+import pytest
+from utils.process import run, silent_run
+
+from test_stubs import temp_dir
+from workspace.scm import (SCMError, update_repo, RepoState, ssh_multiplexing, url_host, prefetch_repo,
+                           remote_branches_changed, query_cache, fetch_remotes)
+
+
+def _commit(repo, msg):
+    run(['git', 'commit', '--allow-empty', '-m', msg], cwd=repo)
+
+
+@pytest.fixture()
+def fork_repo():
+    """ Repo with origin (fork) and upstream remotes, and a clone of upstream to make changes """
+    with temp_dir() as tmpdir:
+        run('git init --bare upstream.git')
+        run('git clone upstream.git other')
+        _commit('other', 'Initial')
+        run('git push origin master', cwd='other')
+        run('git clone --bare upstream.git origin.git')
+
+        run('git clone origin.git repo')
+        run('git remote add upstream ../upstream.git', cwd='repo')
+        run('git fetch upstream', cwd='repo')
+        run('git branch -u upstream/master', cwd='repo')
+
+        yield tmpdir
+
+
+def test_update(fork_repo, wst):
+    _commit('other', 'Upstream change')
+    run('git push origin master', cwd='other')
+    upstream_sha = RepoState('other').head
+
+    os.chdir('repo')
+    run('git checkout -b feature@master')
+    _commit('.', 'Feature change')
+
+    wst('update')
+
+    state = RepoState()
+    assert state.current_branch == 'feature@master'
+    assert state.sha('master') == upstream_sha
+    assert run('git log --format=%s', return_output=True).split('\n')[:3] == ['Feature change', 'Upstream change',
+                                                                              'Initial']
+
+
+def test_update_errors(fork_repo, capsys):
+    os.chdir('repo')
+    run('git remote set-url origin ../missing.git')
+
+    with pytest.raises(SCMError) as e:
+        update_repo()
+
+    assert str(e.value) == 'Failed to pull from remote(s): origin'
+    out, _ = capsys.readouterr()
+    assert "    ... from origin\n    ...   '../missing.git' does not appear to be a git repository\n" in out
+
+    run('git remote set-url origin ../origin.git')
+    _commit('../other', 'Upstream change')
+    run('git push origin master', cwd='../other')
+    _commit('.', 'Local change')
+
+    with pytest.raises(SCMError) as e:
+        update_repo()
+
+    assert str(e.value) == 'Failed to pull from remote(s): upstream'
+    out, _ = capsys.readouterr()
+    assert '    ... from upstream\n    ...   Not possible to fast-forward, aborting\n' in out
+
+
+def test_update_skips_unchanged_repos(wst, capsys):
+    with temp_dir():
+        for name in ['alpha', 'beta']:
+            run('git init --bare remotes/{}.git'.format(name))
+            run('git clone remotes/{0}.git {0}'.format(name))
+            _commit(name, 'Initial')
+            run('git push -u origin master', cwd=name)
+
+        run('git clone beta.git other', cwd='remotes')
+        _commit('remotes/other', 'Remote change')
+        run('git push origin master', cwd='remotes/other')
+
+        capsys.readouterr()
+        wst('update')
+
+        out, _ = capsys.readouterr()
+        assert out.startswith('Updating beta\nSkipped 1 product(s) as they are already up-to-date\n'
+                              'Host   Updated  Skipped  Failed  Retries     Time\n'
+                              'local        1        1       0        0')
+        assert RepoState('beta').head == RepoState('remotes/other').head
+
+        wst('update')
+
+        out, _ = capsys.readouterr()
+        assert out.startswith('Skipped 2 product(s) as they are already up-to-date\n')
+
+        run('git checkout -b feature@master', cwd='alpha')
+        run('git checkout master', cwd='alpha')
+        _commit('alpha', 'Local change')  # Master matches origin/master after push, but feature does not have it
+        run('git push origin master', cwd='alpha')
+        run('git checkout feature@master', cwd='alpha')
+
+        wst('update')
+
+        out, _ = capsys.readouterr()
+        assert out.startswith('Updating alpha\nSkipped 1 product(s) as they are already up-to-date\n')
+        assert RepoState('alpha').head == RepoState('alpha').sha('master')  # Rebased onto master
+
+
+def test_fetch_remotes_errors(fork_repo, monkeypatch):
+    os.chdir('repo')
+    run('git remote set-url upstream ../missing.git')
+
+    errors = fetch_remotes(['origin', 'upstream'])
+    assert list(errors) == ['upstream']
+    assert "'../missing.git' does not appear to be a git repository" in errors['upstream']
+
+    def old_git_fetch(cmd, *args, **kwargs):
+        if cmd[-2:] == ['origin', 'upstream']:
+            output, success = silent_run(cmd, *args, **kwargs)
+            return output.replace('error: could not fetch', 'error: Could not fetch'), success
+        return silent_run(cmd, *args, **kwargs)
+
+    monkeypatch.setattr('workspace.scm.silent_run', old_git_fetch)
+    assert list(fetch_remotes(['origin', 'upstream'])) == ['upstream']
+
+    def unknown_fetch_error(cmd, *args, **kwargs):
+        if cmd[-2:] == ['origin', 'upstream']:
+            return 'error: some fetch failed', False
+        return silent_run(cmd, *args, **kwargs)
+
+    monkeypatch.setattr('workspace.scm.silent_run', unknown_fetch_error)
+    assert list(fetch_remotes(['origin', 'upstream'])) == ['upstream']  # Fetched one at a time
+
+
+def test_update_retries_transient_errors(fork_repo):
+    with open('flaky-upload-pack', 'w') as fp:
+        fp.write('#!/bin/sh\n'
+                 'if [ ! -e {0}/failed ]; then touch {0}/failed; echo "fatal: Connection reset by peer" >&2; exit 128; fi\n'
+                 'exec git-upload-pack "$@"\n'.format(fork_repo))
+    os.chmod('flaky-upload-pack', 0o755)
+
+    os.chdir('repo')
+    run(['git', 'config', 'remote.upstream.uploadpack', str(fork_repo / 'flaky-upload-pack')])
+    _commit('../other', 'Upstream change')
+    run('git push origin master', cwd='../other')
+
+    assert update_repo(retries=2, retry_delay=0) == 1
+    assert RepoState().head == RepoState('../other').head
+
+    os.remove('../failed')
+    with pytest.raises(SCMError):
+        update_repo(retries=0)
+
+
+def test_update_after_prefetch(fork_repo):
+    os.chdir('repo')
+    _commit('../other', 'Upstream change')
+    run('git push origin master', cwd='../other')
+    upstream_sha = RepoState('../other').head
+
+    assert prefetch_repo() == {}
+    assert RepoState().head != upstream_sha  # Only remote tracking branches are updated
+    assert RepoState().sha('remotes/upstream/master') == upstream_sha
+
+    for remote in ['origin', 'upstream']:  # No network needed after prefetch
+        run(['git', 'remote', 'set-url', remote, '../missing.git'])
+
+    assert remote_branches_changed(prefetched_within=60)
+    update_repo(prefetched_within=60)
+    assert RepoState().head == upstream_sha
+    assert not remote_branches_changed(prefetched_within=60)
+
+    with pytest.raises(SCMError):
+        update_repo()
+
+
+def test_remote_branches_changed(fork_repo, monkeypatch):
+    os.chdir('repo')
+    run('git fetch origin')
+    assert not remote_branches_changed()
+
+    run('git push origin master:untracked', cwd='../other')  # Not tracked by any local branch
+    assert not remote_branches_changed()
+
+    run('git tag 1.0.0', cwd='../other')
+    run('git push origin 1.0.0', cwd='../other')
+    assert remote_branches_changed()  # Only a tag changed
+
+    run('git fetch upstream --tags')
+    assert not remote_branches_changed()
+
+    _commit('../other', 'Moved tag')
+    run('git tag -f 1.0.0', cwd='../other')
+    run('git push -f origin 1.0.0', cwd='../other')
+    assert remote_branches_changed()
+    run('git fetch upstream --tags --force')
+    assert not remote_branches_changed()
+
+    ls_remotes = []
+
+    def count_ls_remote(cmd, *args, **kwargs):
+        if cmd[:2] == ['git', 'ls-remote']:
+            ls_remotes.append(cmd)
+        return silent_run(cmd, *args, **kwargs)
+
+    monkeypatch.setattr('workspace.scm.silent_run', count_ls_remote)
+    run('git clone ../upstream.git ../another')
+
+    with query_cache():
+        assert not remote_branches_changed()
+        assert not remote_branches_changed('../another')
+    assert len(ls_remotes) == 2  # upstream.git is listed once for both repos
+
+
+def test_ssh_multiplexing(monkeypatch):
+    monkeypatch.delenv('GIT_SSH_COMMAND', raising=False)
+    monkeypatch.delenv('GIT_SSH', raising=False)
+
+    with ssh_multiplexing():
+        assert 'ControlMaster=auto' in os.environ['GIT_SSH_COMMAND']
+    assert 'GIT_SSH_COMMAND' not in os.environ
+
+    monkeypatch.setenv('GIT_SSH_COMMAND', 'ssh -i key')
+    with ssh_multiplexing():
+        assert os.environ['GIT_SSH_COMMAND'] == 'ssh -i key'
+
+
+def test_url_host():
+    assert url_host('git@github.com:maxzheng/workspace-tools.git') == 'github.com'
+    assert url_host('ssh://git@git.example.com:2222/team/repo.git') == 'git.example.com'
+    assert url_host('https://github.com/maxzheng/workspace-tools.git') == 'github.com'
+    assert url_host('../upstream.git') is None
+    assert url_host('file:///srv/repo.git') is None
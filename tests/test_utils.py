@@ -1,4 +1,8 @@
-from workspace.utils import shortest_id
+from collections import Counter
+import threading
+import time
+
+from workspace.utils import parallel_call, shortest_id, stream_call
 
 
 def test_shortest_id():
@@ -6,3 +10,73 @@ def test_shortest_id():
     assert shortest_id('apple', ['apricot', 'banana']) == 'app'
     assert shortest_id('apple', ['apple seed', 'banana']) == 'apple'
     assert shortest_id('apple', ['apple', 'banana']) == 'a'
+
+
+def test_stream_call():
+    def call(seconds):
+        time.sleep(seconds)
+        if seconds == 0.1:
+            raise ValueError('Bad sleep')
+        return seconds
+
+    results = list(stream_call(call, [0.3, 0.1, 0.2, 5], timeout=1))
+
+    assert [args for args, _ in results] == [0.1, 0.2, 0.3, 5]
+    assert isinstance(results[0][1], ValueError)
+    assert [result for _, result in results[1:3]] == [0.2, 0.3]
+    assert isinstance(results[3][1], TimeoutError)
+
+    assert [args for args, _ in stream_call(call, [0.3, 0.1, 0.2], ordered=True)] == [0.3, 0.1, 0.2]
+
+
+def test_stream_call_waits_for_timed_out_calls():
+    running = []
+    max_running = []
+
+    def call(seconds):
+        running.append(seconds)
+        max_running.append(len(running))
+        time.sleep(seconds)
+        running.remove(seconds)
+        return seconds
+
+    results = stream_call(call, [0.3, 0], workers=1, timeout=0.1)
+
+    assert isinstance(next(results)[1], TimeoutError)
+    assert running == [0.3]  # Still running, so the next call waits for its slot
+    assert next(results) == (0, 0)
+    assert max(max_running) == 1
+
+
+def test_stream_call_with_processes():
+    results = stream_call(abs, [-1, -2, -3], workers=2, processes=True, ordered=True)
+    assert next(results) == (-1, 1)
+    results.close()  # Cancels the remaining calls
+
+    assert list(stream_call(abs, [-1, -2], processes=True, ordered=True)) == [(-1, 1), (-2, 2)]
+
+
+def test_stream_call_with_groups():
+    running = Counter()
+    max_running = Counter()
+    lock = threading.Lock()
+
+    def call(host, _):
+        with lock:
+            running[host] += 1
+            max_running[host] = max(max_running[host], running[host])
+        time.sleep(0.05)
+        with lock:
+            running[host] -= 1
+
+    args = [('github.com', i) for i in range(6)] + [('gitlab.com', i) for i in range(3)]
+    results = list(stream_call(call, args, workers=4, group=lambda arg: arg[0], group_workers=2))
+
+    assert len(results) == 9
+    assert max_running == {'github.com': 2, 'gitlab.com': 2}
+
+
+def test_parallel_call():
+    completed = []
+    assert parallel_call(max, [(1, 2), (4, 3)], callback=completed.append) == {(1, 2): 2, (4, 3): 4}
+    assert sorted(completed) == [2, 4]
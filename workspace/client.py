@@ -0,0 +1,93 @@
+"""
+Thin client that runs wst commands in the warm process started by "wst daemon".
+
+It forwards the args, current dir, environment, and terminal (stdin/stdout/stderr) to the daemon, and falls back to
+running the command in-process if the daemon is not running. This module is kept light (no workspace imports) as
+its import time is part of every command run thru the daemon.
+
+Usage: python -m workspace.client <wst args>
+"""
+import array
+import json
+import os
+import signal
+import socket
+import sys
+
+
+SOCKET_FILE_NAME = 'daemon.sock'
+
+
+def socket_file():
+    """ Path to the daemon socket file. Same as workspace.utils.cache_path(SOCKET_FILE_NAME) """
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join('~', '.cache')
+    return os.path.join(os.path.expanduser(cache_dir), 'workspace-tools', SOCKET_FILE_NAME)
+
+
+def connect():
+    """ Returns a socket connected to the daemon, or None if the daemon is not running. """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(socket_file())
+        return sock
+
+    except OSError:
+        sock.close()
+
+
+def run_remote(sock, argv):
+    """
+    Run the command in the daemon and wait for it to finish.
+
+    :param socket sock: Socket connected to the daemon
+    :param list argv: Command args (without the program name)
+    :return: Exit code of the command
+    """
+    request = json.dumps({'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}).encode() + b'\n'
+    fds = array.array('i', [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    sent = sock.sendmsg([request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+    sock.sendall(request[sent:])
+
+    pid = None
+
+    def forward_signal(signum, frame):
+        if pid:
+            os.kill(pid, signum)
+
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, forward_signal)
+
+    for line in sock.makefile('rb'):
+        status, _, value = line.decode().strip().partition(' ')
+
+        if status == 'PID':
+            pid = int(value)
+
+        elif status == 'EXIT':
+            return int(value)
+
+    return 1  # Daemon went away before the command finished
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    sock = connect()
+
+    if not sock:
+        from workspace.controller import Commander
+
+        sys.argv = ['wst'] + argv
+        return Commander.main()
+
+    with sock:
+        return run_remote(sock, argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -32,6 +32,9 @@ class AbstractCommand(object):
         :return: Tuple of (help_doc, param_docs) where help_doc is the part before :param, and param_docs is a dict of param -> param doc.
         :rtype: tuple(str, dict(str, str))
         """
+        if '_docs' in cls.__dict__:  # Cached per class as it is called for each arg
+            return cls._docs
+
         doc_parts = cls.__doc__ and cls.__doc__.split(':param ')
 
         # Try to get / merge from parent class
@@ -53,7 +56,9 @@ class AbstractCommand(object):
             param = type_param.split()[-1]
             params[param] = param_doc.strip()
 
-        return doc, params
+        cls._docs = doc, params
+
+        return cls._docs
 
     @classmethod
     def arguments(cls):
@@ -3,8 +3,6 @@ import logging
 
 import click
 
-from bumper import BumperDriver
-
 from workspace.commands import AbstractCommand
 from workspace.commands.helpers import expand_product_groups
 from workspace.config import config
@@ -58,6 +56,8 @@ class Bump(AbstractCommand):
         """
           :return: Tuple with 3 elements: A map of file to bump message, commit message, and list of :class:`Bump`
         """
+        from bumper import BumperDriver
+
         repo_check()
 
         self.commander.run('update')
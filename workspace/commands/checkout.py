@@ -1,13 +1,20 @@
 from __future__ import absolute_import
+from contextlib import ExitStack
+from functools import partial
 import logging
 import os
+import sys
 
 import click
 
 from workspace.commands import AbstractCommand
 from workspace.commands.helpers import expand_product_groups
-from workspace.scm import (checkout_product, checkout_branch, all_branches, checkout_files, is_repo,
-                           product_checkout_path, product_name, upstream_remote, all_remotes, update_tags)
+from workspace.config import config, product_groups
+from workspace.scm import (checkout_product, checkout_branch, checkout_files, is_repo, product_checkout_path,
+                           product_name, update_tags, repo_state, ssh_multiplexing, url_host, SEARCH_NAME_RE)
+from workspace.search import search_repos
+from workspace.utils import stream_call
+
 log = logging.getLogger(__name__)
 
 
@@ -15,57 +22,132 @@ class Checkout(AbstractCommand):
     """
       Checkout products (repo urls) or branch, or revert files.
 
+      Multiple products are checked out (or updated if checked out already) in parallel, and any failures are
+      reported at the end.
+
       :param list target: List of products (git repository URLs) to checkout. When inside a git repo,
                           checkout the branch or revert changes for file(s).
+      :param str filter: Partial clone filter to fetch file contents on demand, such as blob:none.
+                         Defaults to [checkout] filter config.
+      :param int depth: Shallow clone with history truncated to the given number of commits. It is deepened on demand
+                        by commands that need more history. Defaults to [checkout] depth config.
+      :param list sparse: Only checkout the given dir(s) in the products. Defaults to [sparse_checkout] config for the
+                          product or its product group.
     """
     alias = 'co'
 
     @classmethod
     def arguments(cls):
         _, docs = cls.docs()
-        return [cls.make_args('target', nargs='+', help=docs['target'])]
+        return [
+          cls.make_args('target', nargs='+', help=docs['target']),
+          cls.make_args('--filter', help=docs['filter']),
+          cls.make_args('--depth', type=int, help=docs['depth']),
+          cls.make_args('--sparse', metavar='DIR', action='append', help=docs['sparse'])
+        ]
 
     def run(self):
         if is_repo():
             if len(self.target) == 1:
-                if self.target[0] in all_branches():
+                state = repo_state()
+
+                if self.target[0] in state.branches():
                     checkout_branch(self.target[0])
                     click.echo('Switched to branch ' + self.target[0])
                     return
 
                 else:
-                    possible_remotes = {upstream_remote()}
+                    upstream_remote = state.upstream_remote
+                    possible_remotes = {upstream_remote}
                     if '/' in self.target[0]:
                         possible_remotes.add(self.target[0].split('/')[0])
 
                     for pull_tags in [False, True]:
                         if pull_tags:
-                            for remote in possible_remotes & set(all_remotes()):
+                            for remote in possible_remotes & set(state.remotes):
                                 update_tags(remote)
+                            state = repo_state()
 
-                        if '/' in self.target[0] and 'remotes/{}'.format(self.target[0]) in all_branches(remotes=True):
+                        if '/' in self.target[0] and state.has_remote_branch(self.target[0]):
                             checkout_branch(self.target[0])
                             click.echo('Switched to branch ' + self.target[0].split('/')[-1])
                             return
 
-                        if 'remotes/{}/{}'.format(upstream_remote(), self.target[0]) in all_branches(remotes=True):
-                            checkout_branch("{}/{}".format(upstream_remote(), self.target[0]))
+                        if state.has_remote_branch('{}/{}'.format(upstream_remote, self.target[0])):
+                            checkout_branch("{}/{}".format(upstream_remote, self.target[0]))
                             click.echo('Switched to branch ' + self.target[0])
                             return
 
             checkout_files(self.target)
             return
 
-        product_urls = expand_product_groups(self.target)
+        product_urls = []
+        for product_url in expand_product_groups(self.target):
+            if product_url.rstrip('/') not in product_urls:
+                product_urls.append(product_url.rstrip('/'))
+
+        failures = []
+
+        search_names = [name for name in product_urls
+                        if SEARCH_NAME_RE.match(name) and not os.path.exists(product_checkout_path(name))]
+        if search_names:  # Resolve them all at once
+            urls, errors = search_repos(search_names)
+            failures.extend(errors.items())
+
+            for name in search_names:
+                if name in urls:
+                    click.echo('Using repo url {} for {}'.format(urls[name], name))
+            product_urls = [urls.get(url, url) for url in product_urls if url not in errors]
+
+        with ExitStack() as stack:
+            if config.update.ssh_multiplexing:
+                stack.enter_context(ssh_multiplexing())
+
+            checkout = partial(_checkout_product, filter=self.filter or config.checkout.filter or None,
+                               depth=self.depth or config.checkout.depth or None, sparse_dirs=self.sparse,
+                               shared_objects=config.checkout.shared_objects)
+            results = stream_call(checkout, product_urls, workers=config.checkout.workers,
+                                  group=url_host, group_workers=config.update.workers_per_host)
+            for product_url, error in results:  # As each product finishes
+                if error is None:
+                    click.echo('Finished ' + product_url)
+                else:
+                    click.echo('Failed to checkout ' + product_url)
+                    failures.append((product_url, error))
+
+        if failures:
+            click.echo('Failed to checkout {} product(s):'.format(len(failures)))
+            for product_url, error in sorted(failures):
+                click.echo('  {}: {}'.format(product_url, error))
+            sys.exit(1)
+
+
+def _checkout_product(product_url, filter=None, depth=None, sparse_dirs=None, shared_objects=False):
+    """ Checkout or update the product and return the error, if any """
+    product_path = product_checkout_path(product_url)
+    sparse_dirs = sparse_dirs or _sparse_dirs(product_url)
+
+    if os.path.exists(product_path):
+        click.echo('Updating ' + product_name(product_path))
+    else:
+        click.echo('Checking out ' + product_url)
+
+    try:
+        checkout_product(product_url, product_path, quiet=True, filter=filter, depth=depth, sparse_dirs=sparse_dirs,
+                         shared_objects=shared_objects)
+
+    except Exception as e:
+        return str(e) or repr(e)
 
-        for product_url in product_urls:
-            product_url = product_url.strip('/')
 
-            product_path = product_checkout_path(product_url)
+def _sparse_dirs(product_url):
+    """ Returns the [sparse_checkout] dirs for the product or the first product group (sorted) that it belongs to """
+    sparse_dirs = dict(list(config.sparse_checkout))
+    name = product_name(product_url)
 
-            if os.path.exists(product_path):
-                click.echo('Updating ' + product_name(product_path))
-            else:
-                click.echo('Checking out ' + product_url)
+    if name in sparse_dirs:
+        return sparse_dirs[name].split()
 
-            checkout_product(product_url, product_path)
+    for group, products in sorted(product_groups().items()):
+        if group in sparse_dirs and (product_url in products or name in [product_name(p) for p in products]):
+            return sparse_dirs[group].split()
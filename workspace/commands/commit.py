@@ -8,8 +8,7 @@ import click
 from workspace.commands import AbstractCommand
 from workspace.config import config
 from workspace.scm import local_commit, add_files, checkout_branch,\
-    create_branch, all_branches, diff_branch, current_branch, remove_branch, hard_reset, \
-    commit_logs, parent_branch
+    create_branch, diff_branch, current_branch, remove_branch, hard_reset, commit_logs, parent_branch, repo_state
 from workspace.utils import prompt_with_editor
 
 log = logging.getLogger(__name__)
@@ -106,7 +105,7 @@ class Commit(AbstractCommand):
                 click.echo('Running tests')
                 test_output = self.commander.run('test', return_output=False, test_dependents=self.test > 1)
 
-            branches = all_branches()
+            branches = repo_state().branches()
             cur_branch = branches and branches[0]
 
             if (not (self.push or self.amend) and config.commit.commit_branch_indicator not in cur_branch and
@@ -0,0 +1,294 @@
+from __future__ import absolute_import
+import array
+import json
+import logging
+import os
+import pickle
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+
+import click
+from utils.process import is_running
+
+from workspace.client import SOCKET_FILE_NAME
+from workspace.commands import AbstractCommand
+from workspace.config import config, product_groups, USER_CONFIG_FILE
+from workspace.scm import keep_repo_states
+from workspace.utils import cache_path, daemonize
+
+log = logging.getLogger(__name__)
+
+PID_FILE_NAME = 'daemon.pid'
+LOG_FILE_NAME = 'daemon.log'
+REPO_STATES_DIR_NAME = 'daemon-repo-states'  # Repo states read by workers for the daemon to keep
+
+
+class Daemon(AbstractCommand):
+    """
+      Run a warm wst process in the background so that commands start instantly.
+
+      Commands are run thru the daemon by the "ws" bash function and its command functions/aliases from "wst setup",
+      or with "python -m workspace.client <command>". They run in-process as usual when the daemon is not running.
+
+      The branches and remotes of repos read by commands are kept by the daemon for later commands until the repo's
+      HEAD, index, refs or config changes.
+
+      :param bool foreground: Run the daemon in the foreground instead of in the background
+      :param bool stop: Stop the running daemon
+      :param bool status: Show if the daemon is running
+    """
+
+    @classmethod
+    def arguments(cls):
+        _, docs = cls.docs()
+        return [
+          cls.make_args('-f', '--foreground', action='store_true', help=docs['foreground']),
+          cls.make_args('--stop', action='store_true', help=docs['stop']),
+          cls.make_args('--status', action='store_true', help=docs['status'])
+        ]
+
+    def run(self):
+        pid = self.running_pid()
+
+        if self.stop:
+            if not pid:
+                click.echo('Daemon is not running')
+                return
+
+            os.kill(pid, signal.SIGTERM)
+            for _ in range(50):
+                if not is_running(pid):
+                    break
+                time.sleep(0.1)
+            click.echo('Stopped daemon')
+
+        elif self.status:
+            if pid:
+                click.echo('Daemon is running (pid {})'.format(pid))
+            else:
+                click.echo('Daemon is not running')
+
+        elif pid:
+            click.echo('Daemon is already running (pid {})'.format(pid))
+
+        else:
+            if not self.foreground:
+                click.echo('Started daemon. Run "wst daemon --stop" to stop it.')
+                os.makedirs(cache_path(), exist_ok=True)
+                daemonize(log_file=cache_path(LOG_FILE_NAME))
+
+            self.serve()
+
+    @classmethod
+    def running_pid(cls):
+        """ Returns the pid of the running daemon, or None if it is not running. """
+        try:
+            with open(cache_path(PID_FILE_NAME)) as fp:
+                pid = int(fp.read())
+            if is_running(pid) and os.path.exists(cache_path(SOCKET_FILE_NAME)):
+                return pid
+
+        except Exception:
+            pass
+
+    def warm_up(self):
+        """ Import all commands and read config ahead of time so that they are ready for the command workers. """
+        for name in self.commander.commands():
+            self.commander.command(name)
+
+        product_groups()  # Reads config
+
+        self._config_mtime = self._user_config_mtime()
+        self.repo_states = keep_repo_states()
+
+    def refresh(self):
+        """ Re-read the user config if it has been changed since it was last read, and keep repo states from workers. """
+        config_mtime = self._user_config_mtime()
+
+        if config_mtime != self._config_mtime:
+            log.debug('Reloading %s', USER_CONFIG_FILE)
+            config.reload()
+            self._config_mtime = config_mtime
+
+        self.load_repo_states()
+
+    def load_repo_states(self):
+        """ Keep the repo states saved by workers (see :meth:`save_repo_states`) for the next workers """
+        states_dir = cache_path(REPO_STATES_DIR_NAME)
+
+        for name in sorted(os.listdir(states_dir)) if os.path.isdir(states_dir) else []:
+            states_file = os.path.join(states_dir, name)
+
+            try:
+                if name.endswith('.pickle'):
+                    with open(states_file, 'rb') as fp:
+                        self.repo_states.update(pickle.load(fp))
+            except Exception as e:
+                log.debug('Could not load repo states from %s: %s', states_file, e)
+
+            finally:
+                os.unlink(states_file)
+
+    def save_repo_states(self, kept_states):
+        """
+        Save the repo states that were read by the command in this worker for the daemon to keep.
+
+        :param dict kept_states: Repo states that the daemon had when the worker was forked
+        """
+        states = dict((repo, (stamp, state)) for repo, (stamp, state) in self.repo_states.items()
+                      if kept_states.get(repo) != (stamp, state))
+
+        if not states:
+            return
+
+        for _, state in states.values():
+            state._status = None  # Only branches / remotes are kept
+
+        try:
+            states_dir = cache_path(REPO_STATES_DIR_NAME)
+            os.makedirs(states_dir, exist_ok=True)
+
+            with tempfile.NamedTemporaryFile('wb', dir=states_dir, suffix='.tmp', delete=False) as fp:  # Only user
+                pickle.dump(states, fp)
+            os.rename(fp.name, fp.name[:-len('.tmp')] + '.pickle')
+
+        except Exception as e:
+            log.debug('Could not save repo states: %s', e)
+
+    def _user_config_mtime(self):
+        config_file = os.path.expanduser(USER_CONFIG_FILE)
+        return os.path.exists(config_file) and os.stat(config_file).st_mtime
+
+    def serve(self):
+        """ Serve commands from clients until stopped. Each command runs in a worker forked from this process. """
+        self.warm_up()
+
+        socket_file = cache_path(SOCKET_FILE_NAME)
+        pid_file = cache_path(PID_FILE_NAME)
+
+        os.makedirs(os.path.dirname(socket_file), exist_ok=True)
+        if os.path.exists(socket_file):
+            os.unlink(socket_file)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)  # Only the user can connect
+        try:
+            server.bind(socket_file)
+        finally:
+            os.umask(umask)
+        server.listen(16)
+
+        with open(pid_file, 'w') as fp:
+            fp.write(str(os.getpid()))
+
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # Workers are reaped automatically
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+        log.info('Serving commands on %s', socket_file)
+
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    try:
+                        self.refresh()
+                        self._fork_worker(server, conn)
+                    except Exception as e:
+                        log.exception(e)
+
+        finally:
+            server.close()
+            os.unlink(socket_file)
+            os.unlink(pid_file)
+
+    def _fork_worker(self, server, conn):
+        """ Receive the command request from the client connection and run it in a worker process """
+        fds = array.array('i')
+        data, ancdata, _, _ = conn.recvmsg(65536, socket.CMSG_LEN(3 * fds.itemsize))
+
+        for level, type, fd_data in ancdata:
+            if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+                fds.frombytes(fd_data[:len(fd_data) - (len(fd_data) % fds.itemsize)])
+
+        while data and not data.endswith(b'\n'):
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+
+        try:
+            request = json.loads(data.decode())
+            if len(fds) != 3:
+                raise ValueError('Expected 3 file descriptors (stdin, stdout, stderr), but got {}'.format(len(fds)))
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+
+        except Exception:
+            for fd in fds:
+                os.close(fd)
+            raise
+
+        if pid:  # Worker has its own copy of the client's file descriptors
+            for fd in fds:
+                os.close(fd)
+            return
+
+        exit_code = 1
+
+        try:
+            server.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+            for target_fd, fd in enumerate(fds):
+                os.dup2(fd, target_fd)
+                os.close(fd)
+
+            sys.stdin = open(0, closefd=False)
+            sys.stdout = open(1, 'w', buffering=1, closefd=False)
+            sys.stderr = open(2, 'w', buffering=1, closefd=False)
+            for handler in logging.root.handlers:
+                if isinstance(handler, logging.StreamHandler):
+                    handler.setStream(sys.stderr)
+            logging.root.setLevel(logging.INFO)
+
+            conn.sendall('PID {}\n'.format(os.getpid()).encode())
+
+            kept_states = dict(self.repo_states)
+            exit_code = self._run_command(request)
+            self.save_repo_states(kept_states)
+
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            try:
+                conn.sendall('EXIT {}\n'.format(exit_code).encode())
+            finally:
+                os._exit(exit_code)
+
+    def _run_command(self, request):
+        """ Run the command request in the current (worker) process and return the exit code. """
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = ['wst'] + request['argv']
+
+        try:
+            type(self.commander)()._run()
+            return 0
+
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+
+        except BaseException:
+            traceback.print_exc()
+            return 1
@@ -4,7 +4,7 @@ import os
 
 from workspace.commands import AbstractCommand
 from workspace.commands.helpers import ProductPager
-from workspace.scm import diff_repo, repos, product_name, current_branch, parent_branch
+from workspace.scm import diff_repo, repos, product_name, parent_branch, repo_state
 from workspace.utils import log_exception
 
 log = logging.getLogger(__name__)
@@ -40,7 +40,7 @@ class Diff(AbstractCommand):
 
         for repo in scm_repos:
             with log_exception():
-                cur_branch = current_branch(repo)
+                cur_branch = repo_state(repo).current_branch
                 branch = (parent_branch(cur_branch) or 'master') if self.parent else None
                 color = not pager.pager or 'less' in pager.pager.args
                 output = diff_repo(repo, branch=branch, context=self.context, return_output=True,
@@ -1,15 +1,28 @@
+import ast
+import glob
+import hashlib
+import json
 import logging
 import os
 import re
+import shutil
 import subprocess
+from urllib.parse import unquote, urlparse
 
 from localconfig import LocalConfig
 
-from workspace.config import product_groups
+from workspace.config import config, product_groups
 from workspace.scm import project_path
 
 log = logging.getLogger(__name__)
 
+ENV_FINGERPRINT_FILE = '.wst-fingerprint-{env}.json'  # In the envdir. Per env as envs may share an envdir
+ENV_REQUIREMENTS_FILE = '.wst-requirements.json'  # In the envdir
+SYNCABLE_FINGERPRINT_INPUTS = ['setup.py install_requires']  # And the requirement files
+REQUIREMENT_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*')
+ENV_INSTALL_SETTINGS = ['deps', 'basepython', 'usedevelop', 'extras', 'install_command', 'setenv']  # In [testenv]
+DEPS_REQUIREMENT_FILE_RE = re.compile(r'^\s*(?:-r|--requirement|-c|--constraint)(?:\s*=\s*|\s*)(\S+)')
+
 
 class ToxIni(LocalConfig):
     """ Represents tox.ini """
@@ -91,6 +104,314 @@ class ToxIni(LocalConfig):
         commands = commands.replace('\\\n', '')
         return [_f for _f in self.expand_vars(commands).split('\n') if _f]
 
+    def env_fingerprint(self, env):
+        """
+        Fingerprint of what the env is installed from: the requirement files (ignoring comments / order) including
+        those referenced in deps with -r / -c, the install settings in the [testenv] sections for the env (see
+        :data:`ENV_INSTALL_SETTINGS`), install_requires in setup.py, and the python for the env.
+
+        :return: Dict of input name to its hash
+        """
+        inputs = {}
+
+        for req_file in config.bump.requirement_files.split():
+            requirements = self._requirement_lines(req_file)
+            if requirements is not None:
+                inputs[req_file] = requirements
+
+        sections = [section for section in [self.envsection(), self.envsection(env)] if section in self]
+        inputs['tox.ini [testenv]'] = [sorted((key, str(value)) for key, value in self.items(section)
+                                              if key in ENV_INSTALL_SETTINGS)
+                                       for section in sections]
+
+        for section in sections:
+            for line in str(self.get(section, 'deps', '')).split('\n'):
+                match = DEPS_REQUIREMENT_FILE_RE.match(line)
+                if match:
+                    req_path = os.path.join(self.path, self.expand_vars(match.group(1)))
+                    req_file = os.path.relpath(req_path, self.path)
+                    if req_file not in inputs:
+                        requirements = self._requirement_lines(req_path)
+                        if requirements is not None:
+                            inputs[req_file] = requirements
+
+        install_requires = self._install_requires()
+        if install_requires is not None:
+            inputs['setup.py install_requires'] = install_requires
+
+        python = (self.get(self.envsection(env), 'basepython') or self.get(self.envsection(), 'basepython') or
+                  ('python{}.{}'.format(env[2], env[3:]) if re.match(r'^py\d\d+$', env) else 'python'))
+        python_path = shutil.which(python)
+        inputs['python'] = os.path.realpath(python_path) if python_path else python
+
+        return {name: hashlib.sha1(json.dumps(value).encode('utf-8')).hexdigest() for name, value in inputs.items()}
+
+    def _requirement_lines(self, req_file):
+        """ Returns sorted requirement lines without comments / whitespace from the requirement file, or None if it does not exist """
+        req_path = os.path.join(self.path, req_file)
+
+        if os.path.exists(req_path):
+            with open(req_path) as fp:
+                return sorted(filter(None, (' '.join(re.sub(r'(^|\s)#.*', '', line).split()) for line in fp)))
+
+    def _install_requires(self):
+        """ Returns install_requires from the setup() call in setup.py, or its source if it is not a literal """
+        try:
+            with open(os.path.join(self.path, 'setup.py')) as fp:
+                tree = ast.parse(fp.read())
+
+        except (IOError, OSError, SyntaxError):
+            return None
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.keyword) and node.arg == 'install_requires':
+                try:
+                    return sorted(ast.literal_eval(node.value))
+                except (ValueError, TypeError):
+                    return ast.dump(node.value)
+
+    def stale_env_reasons(self, env):
+        """
+        Returns a list of reasons that the env needs to be redeveloped (such as "requirements.txt changed"), or an empty
+        list if it is up to date. Envs that were developed before fingerprints were saved are checked by comparing
+        the mtimes of the requirement files and tox.ini with the envdir once, and then fingerprinted if up to date.
+        """
+        envdir = self.envdir(env)
+        fingerprint_file = os.path.join(envdir, ENV_FINGERPRINT_FILE.format(env=env))
+
+        if not os.path.exists(envdir):
+            return ['env does not exist']
+
+        if not os.path.exists(fingerprint_file):
+            env_mtime = os.stat(envdir).st_mtime
+            for req_file in config.bump.requirement_files.split() + [os.path.basename(self.tox_ini)]:
+                req_path = os.path.join(self.path, req_file)
+                if os.path.exists(req_path) and os.stat(req_path).st_mtime > env_mtime:
+                    return ['{} was modified after env was developed (no fingerprint)'.format(req_file)]
+
+            self.save_env_fingerprint(env)
+            return []
+
+        try:
+            with open(fingerprint_file) as fp:
+                saved_fingerprint = json.load(fp)
+        except (IOError, OSError, ValueError) as e:
+            return ['fingerprint could not be read: {}'.format(e)]
+
+        fingerprint = self.env_fingerprint(env)
+
+        return ['{} changed'.format(name) for name in sorted(set(fingerprint) | set(saved_fingerprint))
+                if fingerprint.get(name) != saved_fingerprint.get(name)]
+
+    def save_env_fingerprint(self, env):
+        """ Save the fingerprint of the env (after it was developed) so that it is not redeveloped until it changes """
+        envdir = self.envdir(env)
+
+        if os.path.exists(envdir):
+            with open(os.path.join(envdir, ENV_FINGERPRINT_FILE.format(env=env)), 'w') as fp:
+                json.dump(self.env_fingerprint(env), fp, indent=2, sort_keys=True)
+
+            requirements = self.env_requirements()
+            with open(os.path.join(envdir, ENV_REQUIREMENTS_FILE), 'w') as fp:
+                json.dump(requirements and [str(r) for r in requirements], fp, indent=2)
+
+    def env_requirements(self):
+        """
+        Requirements that the env is installed with from the requirement files and install_requires in setup.py
+
+        :return: List of :class:`pkg_resources.Requirement`, or None if any of them can not be synced individually
+                 (such as "-e", "-r", URLs, or environment markers)
+        """
+        import pkg_resources
+
+        lines = []
+        for req_file in config.bump.requirement_files.split():
+            lines.extend(self._requirement_lines(req_file) or [])
+
+        install_requires = self._install_requires()
+        if isinstance(install_requires, str):  # Not a literal
+            return None
+        lines.extend(install_requires or [])
+
+        requirements = []
+        for line in lines:
+            try:
+                requirement = pkg_resources.Requirement.parse(line)
+            except Exception:
+                return None
+
+            if requirement.marker or requirement.url:
+                return None
+
+            requirements.append(requirement)
+
+        return requirements
+
+    def installed_distributions(self, env):
+        """
+        Read the name and version of distributions installed in the env from their dist-info / egg-info metadata.
+
+        :return: Dict of normalized name to version. Version is None for editable installs from an egg-link.
+        """
+        return dict((name, version) for name, (version, _) in self._read_distributions(env).items())
+
+    def _read_distributions(self, env):
+        """
+        Returns a dict of normalized name to a tuple of (version, set of normalized names of the distributions that it
+        requires) for the distributions installed in the env. Requirements for extras are not included.
+        """
+        distributions = {}
+
+        for site_packages in glob.glob(os.path.join(self.envdir(env), 'lib', 'python*', 'site-packages')):
+            for entry in os.listdir(site_packages):
+                entry_path = os.path.join(site_packages, entry)
+                editable = entry.endswith('.egg-link')
+
+                if editable:  # Metadata is in the egg-info in the source dir
+                    distributions.setdefault(normalize_name(entry[:-len('.egg-link')]), (None, set()))
+                    try:
+                        with open(entry_path) as fp:
+                            egg_infos = glob.glob(os.path.join(fp.readline().strip(), '*.egg-info'))
+                    except (IOError, OSError):
+                        egg_infos = []
+                    if not egg_infos:
+                        continue
+                    entry_path = egg_infos[0]
+
+                requires_path = None
+
+                if entry_path.endswith('.dist-info'):
+                    metadata_path = os.path.join(entry_path, 'METADATA')
+                elif entry_path.endswith('.egg-info'):
+                    metadata_path = os.path.join(entry_path, 'PKG-INFO') if os.path.isdir(entry_path) else entry_path
+                    requires_path = os.path.join(entry_path, 'requires.txt')
+                else:
+                    continue
+
+                headers = {}
+                requires = set()
+                try:
+                    with open(metadata_path, errors='replace') as fp:
+                        for line in fp:
+                            if not line.strip():
+                                break
+                            key, _, value = line.partition(':')
+                            headers.setdefault(key, value.strip())
+                            if key == 'Requires-Dist' and 'extra ==' not in value:
+                                requires.add(value)
+
+                    if requires_path and os.path.exists(requires_path):
+                        with open(requires_path, errors='replace') as fp:
+                            for line in fp:
+                                if line.startswith('['):  # Extras
+                                    break
+                                requires.add(line)
+
+                except (IOError, OSError):
+                    continue
+
+                if headers.get('Name'):
+                    required_names = set(normalize_name(match.group(0)) for match in
+                                         (REQUIREMENT_NAME_RE.match(r.strip()) for r in requires) if match)
+                    version = None if editable else headers.get('Version')
+                    distributions[normalize_name(headers['Name'])] = (version, required_names)
+
+        return distributions
+
+    def editable_paths(self, env):
+        """
+        Read the source paths of the distributions installed in editable / develop mode in the env from their egg-link
+        files or the direct_url.json of their dist-info.
+
+        :return: Dict of normalized name to source path
+        """
+        paths = {}
+
+        for site_packages in glob.glob(os.path.join(self.envdir(env), 'lib', 'python*', 'site-packages')):
+            for entry in os.listdir(site_packages):
+                entry_path = os.path.join(site_packages, entry)
+
+                try:
+                    if entry.endswith('.egg-link'):
+                        with open(entry_path) as fp:
+                            paths[normalize_name(entry[:-len('.egg-link')])] = fp.readline().strip()
+
+                    elif entry.endswith('.dist-info') and os.path.exists(os.path.join(entry_path, 'direct_url.json')):
+                        with open(os.path.join(entry_path, 'direct_url.json')) as fp:
+                            direct_url = json.load(fp)
+
+                        if direct_url.get('dir_info', {}).get('editable') and direct_url['url'].startswith('file:'):
+                            name = entry[:-len('.dist-info')].rsplit('-', 1)[0]
+                            paths[normalize_name(name)] = unquote(urlparse(direct_url['url']).path)
+
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+
+        return paths
+
+    def requirements_delta(self, env):
+        """
+        Compare the requirements that the env should be installed with against what is installed.
+
+        :return: Tuple of (list of requirements to install, list of names to uninstall) where the names to uninstall
+                 are those that were required when the env was last developed but are no longer required by the
+                 requirements or other installed distributions.
+                 None if the delta can't be determined, and so the env should be redeveloped with tox instead.
+        """
+        requirements = self.env_requirements()
+        if requirements is None:
+            return None
+
+        try:
+            with open(os.path.join(self.envdir(env), ENV_REQUIREMENTS_FILE)) as fp:
+                saved_requirements = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if saved_requirements is None:
+            return None
+
+        import pkg_resources
+
+        installed = self.installed_distributions(env)
+        required_names = set(normalize_name(r.project_name) for r in requirements)
+
+        to_install = []
+        for requirement in requirements:
+            name = normalize_name(requirement.project_name)
+            if name not in installed or (installed[name] is not None and
+                                         not requirement.specifier.contains(installed[name], prereleases=True)):
+                to_install.append(str(requirement))
+
+        to_uninstall = set()
+        for saved_requirement in saved_requirements:
+            name = normalize_name(pkg_resources.Requirement.parse(saved_requirement).project_name)
+            if name not in required_names and name in installed:
+                to_uninstall.add(name)
+
+        # Keep those that are still required by other installed distributions (that are not uninstalled)
+        distributions = self._read_distributions(env)
+        while True:
+            still_required = set(name for name in to_uninstall for other, (_, requires) in distributions.items()
+                                 if other not in to_uninstall and name in requires)
+            if not still_required:
+                break
+            to_uninstall -= still_required
+
+        return sorted(set(to_install)), sorted(to_uninstall)
+
+    def install_command(self, env, packages):
+        """ Returns the install_command for the env (as a list) to install the given packages with """
+        command = self.get(self.envsection(env), 'install_command',
+                           self.get(self.envsection(), 'install_command', 'python -m pip install {opts} {packages}'))
+        command = command.replace('\\\n', '').replace('{opts}', '').split()
+
+        if command and os.path.exists(self.bindir(env, command[0])):
+            command[0] = self.bindir(env, command[0])
+
+        packages_index = command.index('{packages}') if '{packages}' in command else len(command)
+        return command[:packages_index] + list(packages) + command[packages_index + 1:]
+
     def expand_vars(self, value, extra_vars={}):
         if '{' in value:
             value = self.VAR_RE.sub(lambda m: extra_vars.get(
@@ -142,6 +463,11 @@ def create_pager(highlight_text=None):
     return pager
 
 
+def normalize_name(name):
+    """ Normalize distribution name for comparison, such as "Foo_Bar" to "foo-bar" """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
 def expand_product_groups(names):
     """ Expand product groups found in the given list of names to produce a sorted list of unique names. """
     unique_names = set(names)
@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+from datetime import datetime
+import logging
+
+import click
+
+from workspace.commands import AbstractCommand
+from workspace.index import WorkspaceIndex
+from workspace.scm import workspace_path
+
+log = logging.getLogger(__name__)
+
+
+class Index(AbstractCommand):
+    """
+      Show the index of products in the workspace that commands use to find products.
+
+      The index is kept in ~/.cache/workspace-tools and refreshed automatically for changes in the workspace.
+
+      :param bool rebuild: Rebuild the index from scratch
+    """
+
+    @classmethod
+    def arguments(cls):
+        _, docs = cls.docs()
+        return [cls.make_args('--rebuild', action='store_true', help=docs['rebuild'])]
+
+    def run(self):
+        index = WorkspaceIndex(workspace_path())
+        index.refresh(rebuild=self.rebuild)
+
+        if self.rebuild:
+            click.echo('Rebuilt index for {}'.format(index.workspace_dir))
+
+        entries = sorted(index.entries().items())
+        name_width = max([len(name) for name, _ in entries] + [0])
+        branch_width = max([len(entry['branch'] or '-') for _, entry in entries] + [0])
+
+        for name, entry in entries:
+            fetched = datetime.fromtimestamp(entry['fetched']).strftime('%Y-%m-%d %H:%M') if entry['fetched'] else '-'
+            click.echo('{:<{}}  {:<7}  {:<{}}  {:<16}  {}'.format(
+                name, name_width, (entry['head'] or '-')[:7], entry['branch'] or '-', branch_width, fetched,
+                ' '.join(entry['remotes'])).rstrip())
@@ -16,7 +16,8 @@ class Log(AbstractCommand):
 
       :param bool diff: Generate patch / show diff
       :param str show: Show specific revision. This implies --diff and limit of 1
-      :param int limit: Limit number of log entries
+      :param int limit: Limit number of log entries. Without it, the history of a shallow clone is only deepened to
+                        show the last 100 commits.
       :param list extra_args: Extra args to pass to the underlying SCM's log command
     """
 
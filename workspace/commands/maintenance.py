@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+import logging
+import os
+import sys
+
+import click
+
+from workspace.commands import AbstractCommand
+from workspace.scm import (SCMError, object_stores, repack_object_store, repo_state, repos,
+                           update_object_store, uses_object_store, git_config, workspace_path)
+
+log = logging.getLogger(__name__)
+
+
+class Maintenance(AbstractCommand):
+    """
+      Maintain the shared object stores in the workspace that checkouts borrow objects from to save clone time and
+      disk space (see [checkout] shared_objects config).
+
+      Each store is fetched from the remotes of the products that use it, and then repacked without dropping any
+      objects as the products may reference them.
+    """
+
+    def run(self):
+        workspace_dir = workspace_path()
+        stores = object_stores(workspace_dir)
+        failed = False
+
+        if not stores:
+            click.echo('No shared object store found')
+            return
+
+        workspace_repos = repos(workspace_dir)
+
+        for store_path in stores:
+            name = os.path.basename(store_path)[:-len('.git')]
+            store_repos = [repo for repo in workspace_repos if uses_object_store(repo, store_path)]
+            urls = []
+            for repo in store_repos:
+                repo_config = git_config(repo)
+                for remote in repo_state(repo).remotes:
+                    url = repo_config.get(('remote', remote), {}).get('url')
+                    if url:  # Remote may only have a pushurl
+                        urls.append(url)
+
+            try:
+                update_object_store(store_path, urls)
+                repack_object_store(store_path)
+
+                click.echo('Maintained {} for {} product(s): {:.1f} MB'.format(
+                    name, len(store_repos), _dir_size(store_path) / 1024.0 / 1024))
+
+            except SCMError as e:
+                log.error('%s: %s', name, e)
+                failed = True
+
+        if failed:
+            sys.exit(1)
+
+
+def _dir_size(path):
+    """ Total size of the files in the dir """
+    return sum(os.path.getsize(os.path.join(dir, name)) for dir, _, names in os.walk(path) for name in names)
@@ -5,11 +5,10 @@ import sys
 import textwrap
 
 import click
-import git
 from utils.process import run as process_run
 from workspace.commands import AbstractCommand
 from workspace.config import config
-from workspace.scm import checkout_branch, current_branch, merge_branch, repo_path
+from workspace.scm import checkout_branch, current_branch, ensure_history, merge_branch, repo_path
 
 log = logging.getLogger(__name__)
 
@@ -56,6 +55,8 @@ class Merge(AbstractCommand):
         ]
 
     def run(self):
+        import git
+
         current = current_branch()
         repo = git.Repo(path=repo_path())
 
@@ -204,4 +205,5 @@ class Merge(AbstractCommand):
         return commits
 
     def _unmerged_commits(self, repo, from_branch, target_branch):
+        ensure_history(repo.working_dir, merge_base=(target_branch, from_branch))
         return repo.git.log('{}..{}'.format(target_branch, from_branch), oneline=True)
\ No newline at end of file
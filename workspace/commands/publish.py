@@ -5,6 +5,7 @@ import logging
 import os
 import re
 import sys
+from itertools import islice
 
 import click
 from localconfig import LocalConfig
@@ -12,13 +13,14 @@ from six.moves import range
 from utils.process import run, silent_run
 from workspace.commands import AbstractCommand
 from workspace.commands.helpers import ToxIni
-from workspace.scm import repo_check, repo_path, commit_logs, extract_commit_msgs
+from workspace.scm import iter_commits, last_release, push_tag, repo_check, repo_path, tag_release, upstream_remote
 
 log = logging.getLogger(__name__)
 new_version = None  # Doesn't work if it is in bump_version
 PUBLISH_VERSION_PREFIX = 'Publish version '
 IGNORE_CHANGE_RE = re.compile('^(?:Update changelog|Fix tests?)\s*$', flags=re.IGNORECASE)
 VERSION_RE = re.compile('version\s*=\s*([\'"])(.*)[\'"]')
+MAX_UNRELEASED_CHANGES = 100  # Commits to look through for changes when there is no earlier publish
 
 
 class Publish(AbstractCommand):
@@ -29,6 +31,7 @@ class Publish(AbstractCommand):
         :param str repo: Repository to publish to
         :param bool minor: Perform a minor publish by bumping the minor version
         :param bool major: Perform a major publish by bumping the major version
+        :param bool push_tag: Push the release tag to the upstream remote (or origin if there is no upstream)
     """
 
     @classmethod
@@ -37,7 +40,8 @@ class Publish(AbstractCommand):
         return [
             cls.make_args('-r', '--repo', default='pypi', help=docs['repo']),
             cls.make_args('--minor', action='store_true', help=docs['minor']),
-            cls.make_args('--major', action='store_true', help=docs['major'])
+            cls.make_args('--major', action='store_true', help=docs['major']),
+            cls.make_args('--push-tag', action='store_true', help=docs['push_tag'])
         ]
 
     def run(self):
@@ -130,12 +134,36 @@ class Publish(AbstractCommand):
                            files=[setup_file, changelog_file],
                            skip_style_check=True)
 
+        try:
+            tag_release(new_version, msg=PUBLISH_VERSION_PREFIX + new_version, path=repo_path())
+        except Exception as e:
+            log.warning('Failed to tag release %s: %s', new_version, e)
+        else:
+            remote = self.push_tag and upstream_remote(repo_path())
+            if remote:
+                push_tag(new_version, remotes=[remote], path=repo_path())
+
     def changes_since_last_publish(self):
-        commit_msgs = extract_commit_msgs(commit_logs(limit=100, repo=repo_path()), True)
+        """
+        Returns a tuple of (last published version, list of commit messages since then).
+
+        The last publish is found from the release tags / index that publish records, or by the "Publish version"
+        commit message for repos published before then, and the changes are the commits in the range since it. A
+        "Publish version" commit in the range (e.g. committed manually) is a newer publish, so the changes stop there.
+        When the repo has never been published, only the last :data:`MAX_UNRELEASED_CHANGES` commits are used.
+        """
+        repo = repo_path()
+        published_version, published_commit = last_release(repo, msg_prefix=PUBLISH_VERSION_PREFIX)
+        revision = published_commit + '..HEAD' if published_commit else None
+        commits = iter_commits(revision, repo=repo)
         changes = []
-        published_version = None
 
-        for msg in commit_msgs:
+        if not published_commit:
+            commits = islice(commits, MAX_UNRELEASED_CHANGES)
+
+        for commit in commits:
+            msg = '\n'.join(line for line in commit.message.split('\n') if line)
+
             if msg.startswith(PUBLISH_VERSION_PREFIX):
                 published_version = msg.split(PUBLISH_VERSION_PREFIX)[-1]
                 break
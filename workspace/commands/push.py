@@ -5,8 +5,8 @@ import sys
 import click
 
 from workspace.commands import AbstractCommand
-from workspace.scm import (checkout_branch, remove_branch, current_branch, all_remotes,
-                           push_repo, merge_branch, update_branch, parent_branch, default_remote)
+from workspace.scm import (checkout_branch, remove_branch, push_repo, merge_branch, update_branch, parent_branch,
+                           repo_state)
 
 
 log = logging.getLogger(__name__)
@@ -33,7 +33,7 @@ class Push(AbstractCommand):
 
     def run(self):
 
-        current = current_branch()
+        current = repo_state().current_branch
 
         if not self.branch:
             self.branch = current
@@ -67,11 +67,13 @@ class Push(AbstractCommand):
 
             click.echo('Pushing ' + parent)
 
-        remotes = all_remotes() if self.all_remotes else [default_remote()]
+        state = repo_state()
+        branch = state.current_branch
+        remotes = state.remotes if self.all_remotes else [state.default_remote]
         for remote in remotes:
             if len(remotes) > 1:
                 click.echo('    ... to ' + remote)
-            push_repo(force=self.force, remote=remote, branch=current_branch())
+            push_repo(force=self.force, remote=remote, branch=branch)
 
         if self.merge:
             remove_branch(self.branch, remote=True, force=True)
@@ -6,8 +6,8 @@ import re
 import sys
 
 import click
-import requests
 
+from workspace.client import socket_file
 from workspace.commands import AbstractCommand
 from workspace.scm import is_repo, product_name
 
@@ -21,7 +21,13 @@ WS_SETUP_START = '# Added by "workspace setup" (do not remove comments before /
 WS_SETUP_END = "# workspace setup - end"
 
 WS_FUNCTION_TEMPLATE = """\
-alias _wst=%s
+function _wst() {
+  if [ -S %s ]; then
+    %s -m workspace.client "$@"  # Run in warm process from "wst daemon"
+  else
+    %s "$@"
+  fi
+}
 
 function ws() {
   if [ $# -gt 0 ]; then
@@ -367,6 +373,8 @@ class Setup(AbstractCommand):
         coveragerc_file = os.path.join(project_path, '.coveragerc')
         self._create_or_update_file(coveragerc_file, COVERAGERC_TMPL)
 
+        import requests
+
         gitignore_file = os.path.join(project_path, '.gitignore')
         resp = requests.get('https://raw.githubusercontent.com/github/gitignore/master/Python.gitignore')
         gitignore_content = resp.text.replace('htmlcov', 'htmlcov/\ntextcov')
@@ -451,7 +459,7 @@ class Setup(AbstractCommand):
             fh.write('source %s\n' % WSTRC_FILE)
 
         with open(wstrc_path, 'w') as fh:
-            fh.write(WS_FUNCTION_TEMPLATE % (os.path.abspath(sys.argv[0]), workspace_dir))
+            fh.write(WS_FUNCTION_TEMPLATE % (socket_file(), sys.executable, os.path.abspath(sys.argv[0]), workspace_dir))
             click.echo('Added "ws" bash function with workspace directory set to ' + workspace_dir)
 
             if self.additional_commands:
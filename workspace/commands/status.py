@@ -2,18 +2,37 @@ from __future__ import absolute_import
 import os
 import logging
 
+import click
+
 from workspace.commands import AbstractCommand
 from workspace.commands.helpers import ProductPager
-from workspace.scm import stat_repo, repos, product_name, all_branches, is_repo, all_remotes
+from workspace.config import config
+from workspace.scm import stat_repo, repos, product_name, is_repo, repo_state
+from workspace.utils import stream_call
 
 log = logging.getLogger(__name__)
 
 
 class Status(AbstractCommand):
-    """ Show status on current product or all products in workspace """
+    """
+      Show status on current product or all products in workspace
+
+      Status for all products are collected in parallel and shown in alphabetical order. Max number of products to get
+      status for at the same time and how long to wait for a product can be configured in [status] section.
+
+      :param bool summary: Show a one line summary per product: ahead / behind, number of staged / modified /
+                           untracked files, current branch, and other child branches.
+    """
     alias = 'st'
 
+    @classmethod
+    def arguments(cls):
+        _, docs = cls.docs()
+        return [cls.make_args('-s', '--summary', action='store_true', help=docs['summary'])]
+
     def run(self):
+        if self.summary:
+            return self.show_summary()
 
         try:
             scm_repos = repos()
@@ -21,28 +40,85 @@ class Status(AbstractCommand):
             optional = len(scm_repos) == 1
             pager = ProductPager(optional=optional)
 
-            for repo in scm_repos:
-                stat_path = os.getcwd() if in_repo else repo
-                output = stat_repo(stat_path, return_output=True, with_color=True)
-                nothing_to_commit = ('nothing to commit' in output and
-                                     'Your branch is ahead of' not in output and
-                                     'Your branch is behind' not in output)
+            status_args = [(repo, os.getcwd() if in_repo else repo, len(scm_repos) == 1) for repo in scm_repos]
 
-                branches = all_branches(repo, verbose=True)
-                child_branches = [b for b in branches if '@' in b]
+            for (repo, _, _), output in stream_call(_repo_status, status_args, workers=config.status.workers,
+                                                    timeout=config.status.timeout, ordered=True):
+                if isinstance(output, SystemExit):
+                    raise output
 
-                if len(child_branches) >= 1 or len(scm_repos) == 1:
-                    show_branches = branches if len(scm_repos) == 1 else child_branches
-                    remotes = all_remotes() if len(scm_repos) == 1 else []
-                    remotes = '\n# Remotes: {}'.format(' '.join(remotes)) if len(remotes) > 1 else ''
+                elif isinstance(output, TimeoutError):
+                    output = '# Timed out after {} seconds'.format(config.status.timeout)
 
-                    if nothing_to_commit:
-                        output = '# Branches: {}{}'.format(' '.join(show_branches), remotes)
-                        nothing_to_commit = False
-                    elif len(show_branches) > 1:
-                        output = '# Branches: {}{}\n#\n{}'.format(' '.join(show_branches), remotes, output)
+                elif isinstance(output, BaseException):
+                    output = '# Failed to get status: {}'.format(output)
 
-                if output and not nothing_to_commit:
+                if output:
                     pager.write(product_name(repo), output)
         finally:
             pager.close_and_wait()
+
+    def show_summary(self):
+        """ Show one line summary per product as a table """
+        rows = []
+        branch_width = len('Branch')
+
+        for repo, summary in stream_call(_repo_summary, repos(), workers=config.status.workers,
+                                         timeout=config.status.timeout, ordered=True):
+            if isinstance(summary, SystemExit):
+                raise summary
+
+            elif isinstance(summary, TimeoutError):
+                summary = [''] * 5 + ['(timed out after {} seconds)'.format(config.status.timeout), '']
+
+            elif isinstance(summary, BaseException):
+                summary = [''] * 5 + ['(failed: {})'.format(summary), '']
+
+            else:
+                branch_width = max(branch_width, len(summary[5]))
+
+            rows.append([product_name(repo)] + summary)
+
+        # Widths are from the results so that no repo is read outside of the parallel / timed calls above
+        name_width = max([len(row[0]) for row in rows] + [len('Product')])
+        row_format = '{:<%d}  {:>5}  {:>6}  {:>6}  {:>8}  {:>9}  {:<%d}  {}' % (name_width, branch_width)
+
+        click.echo(row_format.format('Product', 'Ahead', 'Behind', 'Staged', 'Modified', 'Untracked', 'Branch',
+                                     'Child Branches').rstrip())
+
+        for row in rows:
+            click.echo(row_format.format(*row).rstrip())
+
+
+def _repo_status(repo, stat_path, single_repo):
+    """ Returns the status output to show for the repo, or None if there is nothing to show """
+    state = repo_state(repo)
+    nothing_to_commit = not (state.dirty or state.ahead or state.behind)
+    output = None if nothing_to_commit else stat_repo(stat_path, return_output=True, with_color=True)
+
+    branches = state.branches(verbose=True)
+    child_branches = [b for b in branches if '@' in b]
+
+    if len(child_branches) >= 1 or single_repo:
+        show_branches = branches if single_repo else child_branches
+        remotes = state.remotes if single_repo else []
+        remotes = '\n# Remotes: {}'.format(' '.join(remotes)) if len(remotes) > 1 else ''
+
+        if nothing_to_commit:
+            output = '# Branches: {}{}'.format(' '.join(show_branches), remotes)
+            nothing_to_commit = False
+        elif len(show_branches) > 1:
+            output = '# Branches: {}{}\n#\n{}'.format(' '.join(show_branches), remotes, output)
+
+    if output and not nothing_to_commit:
+        return output
+
+
+def _repo_summary(repo):
+    """ Returns summary columns for the repo: ahead, behind, staged, modified, untracked, branch, and child branches """
+    state = repo_state(repo)
+    counts = [state.ahead, state.behind, state.staged, state.modified + state.conflicts, state.untracked]
+    branch = state.current_branch or ''
+    child_branches = [b for b in state.branches() if '@' in b and b != branch]
+
+    return [c or '-' for c in counts] + [branch, ' '.join(child_branches)]
@@ -3,7 +3,6 @@ from __future__ import print_function
 import argparse
 import logging
 import os
-import pkg_resources
 import re
 import sys
 import tempfile
@@ -13,11 +12,13 @@ import json
 from utils.process import run
 
 from workspace.commands import AbstractCommand
-from workspace.commands.helpers import expand_product_groups, ToxIni
+from workspace.commands.helpers import expand_product_groups, ToxIni, SYNCABLE_FINGERPRINT_INPUTS
 from workspace.config import config
+from workspace.coverage_map import CoverageMap
+from workspace.results import TestResult
 from workspace.scm import (product_name, repo_path, product_repos, product_path, repos,
-                           workspace_path, current_branch, project_path)
-from workspace.utils import log_exception, parallel_call
+                           workspace_path, current_branch, project_path, working_tree_hash)
+from workspace.utils import log_exception, show_status, stream_call
 
 log = logging.getLogger(__name__)
 
@@ -40,8 +41,10 @@ class Test(AbstractCommand):
                                    This product must be installed as editable in its dependents for the results to be useful.
                                    Most args are ignored when this is used.
       :param bool redevelop: Redevelop the test environment by installing on top of existing one.
-                             This is implied if test environment does not exist, or whenever requirements.txt or
-                             pinned.txt is modified after the environment was last updated.
+                             This is implied if test environment does not exist, or whenever its requirements
+                             (requirements.txt, pinned.txt, [testenv] in tox.ini, install_requires in setup.py, or
+                             python) changed since it was last developed. Use -d to see if / why it is stale.
+                             When only requirements changed, just those are installed / uninstalled in the env.
                              Use -ro to do redevelop only without running tests.
                              Use -rr to remove the test environment first before redevelop (recreate).
       :param bool install_only: Modifier for redevelop. Perform install only without running test.
@@ -58,7 +61,17 @@ class Test(AbstractCommand):
       :param bool debug: Turn on debug logging
       :param list install_editable: List of products or product groups to install in editable mode.
       :param list extra_args: Extra args from argparse to be passed to pytest
-      :return: Dict of env to commands ran on success. If return_output is True, return a string output.
+      :param bool no_cache: Run tests even if they already passed for the same content, test env and args.
+                            Passed results are cached for [test] result_cache_days in workspace.cfg.
+      :param bool parallel: Run envs at the same time, except envs that share the same envdir. Output of each env
+                            is shown when it completes, followed by a summary of all envs.
+      :param bool changed: Only run the tests affected by changes since the last full test run with coverage,
+                           which records the tests that cover each line when enabled with [test] coverage_map in
+                           workspace.cfg.
+                           All tests are run when the coverage map was not recorded at HEAD or the parent branch,
+                           or non-Python files (e.g. requirements.txt or tox.ini) changed.
+      :return: Dict of env to commands ran on success. If return_output is True, return a string output,
+               or the :class:`workspace.results.TestResult` if the tests already passed.
                If test_dependents is True, return a mapping of product name to the mentioned results.
     """
 
@@ -80,6 +93,9 @@ class Test(AbstractCommand):
           cls.make_args('-r', '--redevelop', action='count', help=docs['redevelop']),
           cls.make_args('-o', action='store_true', dest='install_only', help=argparse.SUPPRESS),
           cls.make_args('-e', '--install-editable', nargs='+', help=docs['install_editable']),
+          cls.make_args('--no-cache', action='store_true', help=docs['no_cache']),
+          cls.make_args('--changed', action='store_true', help=docs['changed']),
+          cls.make_args('-p', '--parallel', action='store_true', help=docs['parallel']),
         ]
 
     @classmethod
@@ -100,7 +116,8 @@ class Test(AbstractCommand):
         """
           Summarize the test results
 
-          :param dict|str tests: Map of product name to test result, or the test result of the current prod.
+          :param dict|str|TestResult tests: Map of product name to test result, or the test result of the current prod.
+                                            Test result is the test output, or the stored result of a cached test run.
           :param bool include_no_tests: Include "No tests" results when there are no tests found.
           :return: A tuple of (success, list(summaries)) where success is True if all tests pass and summaries
                    is a list of passed/failed summary of each test or just str if 'tests' param is str.
@@ -108,7 +125,7 @@ class Test(AbstractCommand):
         prod_name = product_name()
 
         if isinstance(tests, dict):
-            product_tests = tests
+            product_tests = dict(tests)
         else:
             product_tests = {}
             product_tests[prod_name] = tests
@@ -123,6 +140,13 @@ class Test(AbstractCommand):
                 summaries.append("%s: %s" % (name, summary))
 
         for name in sorted(product_tests, key=lambda n: n == prod_name or n):
+            if isinstance(product_tests[name], TestResult):
+                if product_tests[name].output:
+                    product_tests[name] = product_tests[name].output
+                else:
+                    append_summary(product_tests[name].summary or 'Test successful / No output', name)
+                    continue
+
             if not product_tests[name]:
                 success = False
                 append_summary('Test failed / No output', name)
@@ -167,6 +191,8 @@ class Test(AbstractCommand):
               ('num_processes', self.num_processes),
               ('silent', True),
               ('debug', self.debug),
+              ('no_cache', self.no_cache),
+              ('changed', self.changed),
               ('extra_args', tuple(self.extra_args))
             )
 
@@ -200,7 +226,16 @@ class Test(AbstractCommand):
                 else:
                     return 'None'
 
-            repo_results = parallel_call(test_repo, test_args, callback=test_done, show_progress=show_remaining, progress_title='Remaining')
+            repo_results = {}
+
+            for args, result in stream_call(test_repo, test_args):
+                if isinstance(result, BaseException):
+                    result = str(result)
+                else:
+                    test_done(result)
+                repo_results[args] = result
+
+                show_status('Remaining: ' + show_remaining(list(repo_results.keys()), test_args))
 
             for result in list(repo_results.values()):
                 if isinstance(result, tuple):
@@ -230,6 +265,23 @@ class Test(AbstractCommand):
                 else:
                     envs.append(ef)
 
+        if self.changed:
+            if config.test.coverage_map:
+                tests, reason = CoverageMap(self.repo).affected_tests()
+            else:
+                tests, reason = None, '[test] coverage_map is not enabled in workspace.cfg'
+
+            if tests is None:
+                click.echo('Running all tests as {}'.format(reason))
+
+            elif not tests:
+                click.echo('No tests are affected by the changes')
+                return True if self.return_output else {}
+
+            else:
+                log.debug('Running %s', reason)
+                files.extend(os.path.join(self.repo, t) for t in tests)
+
         pytest_args = ''
         if self.match_test or self.num_processes is not None or files or self.extra_args:
             pytest_args = []
@@ -271,6 +323,10 @@ class Test(AbstractCommand):
             if 'style' in envs:
                 envs.remove('style')
             for env in envs:
+                stale_reasons = tox.stale_env_reasons(env)
+                if stale_reasons:
+                    click.echo('{} is stale and will be redeveloped on the next test run as {}'.format(
+                        env, ', '.join(stale_reasons)))
                 self.show_installed_dependencies(tox, env, filter_name=self.show_dependencies)
 
         elif self.install_editable:
@@ -307,10 +363,7 @@ class Test(AbstractCommand):
             for env in envs:
                 env_commands[env] = ' '.join(cmd)
 
-                # Touch envdir
-                envdir = tox.envdir(env)
-                if os.path.exists(envdir):
-                    os.utime(envdir, None)
+                tox.save_env_fingerprint(env)
 
                 # Strip entry version
                 self._strip_version_from_entry_scripts(tox, env)
@@ -318,32 +371,56 @@ class Test(AbstractCommand):
             if self.return_output:
                 return output
 
+        elif self.parallel and len(envs) > 1 and not self.return_output:
+            return self.run_envs_in_parallel(tox, envs, files)
+
         else:
+            tree_hash = None
+            if not self.no_cache and config.test.result_cache_days:
+                tree_hash = working_tree_hash(self.repo)
+
             for env in envs:
                 envdir = tox.envdir(env)
 
-                def requirements_updated():
-                    req_mtime = 0
-                    requirements_files = ['requirements.txt', 'pinned.txt', 'tox.ini']
-                    for req_file in requirements_files:
-                        req_path = os.path.join(self.repo, req_file)
-                        if os.path.exists(req_path):
-                            req_mtime = max(req_mtime, os.stat(req_path).st_mtime)
-                    return req_mtime > os.stat(envdir).st_mtime
-
-                if not os.path.exists(envdir) or requirements_updated():
-                    env_commands.update(
-                        self.commander.run('test', env_or_file=[env], repo=self.repo, redevelop=True, tox_cmd=self.tox_cmd,
-                                           tox_ini=self.tox_ini, tox_commands=self.tox_commands, match_test=self.match_test,
-                                           num_processes=self.num_processes, silent=self.silent,
-                                           debug=self.debug, extra_args=self.extra_args))
+                stale_reasons = tox.stale_env_reasons(env)
+
+                if stale_reasons and not self.tox_cmd and self.sync_env(tox, env, stale_reasons):
+                    stale_reasons = []
+
+                if stale_reasons:
+                    log.debug('Redeveloping %s as %s', env, ', '.join(stale_reasons))
+                    result = self.commander.run('test', env_or_file=[env], repo=self.repo, redevelop=True, tox_cmd=self.tox_cmd,
+                                                tox_ini=self.tox_ini, tox_commands=self.tox_commands,
+                                                match_test=self.match_test, num_processes=self.num_processes,
+                                                silent=self.silent, return_output=self.return_output, debug=self.debug,
+                                                extra_args=self.extra_args)
+                    if self.return_output:
+                        return result
+                    env_commands.update(result)
                     continue
 
                 commands = self.tox_commands.get(env) or tox.commands(env)
                 env_commands[env] = '\n'.join(commands)
 
+                result_key = None
+                dependencies = tree_hash and self.installed_dependencies(tox, env)
+                if dependencies is not None:
+                    result_key = TestResult.key(tree_hash, env, tox.env_fingerprint(env), commands + [pytest_args],
+                                                dependencies=dependencies)
+                    result = TestResult.load(result_key)
+
+                    if result:
+                        if self.return_output:
+                            return result
+
+                        if not self.silent:
+                            click.secho('{}: {} (cached, use --no-cache to run again)'.format(env, result.summary or 'OK'),
+                                        fg='green')
+                        continue
+
                 for command in commands:
                     full_command = os.path.join(envdir, 'bin', command)
+                    record_coverage = False
 
                     command_path = full_command.split()[0]
                     if os.path.exists(command_path):
@@ -352,19 +429,31 @@ class Test(AbstractCommand):
                                 full_command = full_command.replace('{env:PYTESTARGS:}', pytest_args)
                             else:
                                 full_command += ' ' + pytest_args
+
+                            record_coverage = (config.test.coverage_map and not pytest_args and '--cov' in full_command
+                                               and self.supports_cov_context(tox, env))
+                            if record_coverage:
+                                full_command += ' --cov-context=test'
                         activate = '. ' + os.path.join(envdir, 'bin', 'activate')
                         output = run(activate + '; ' + full_command, shell=True, cwd=self.repo, raises=False, silent=self.silent,
-                                     return_output=self.return_output)
-                        if not output:
-                            if self.return_output:
-                                return False
-                            else:
-                                sys.exit(1)
+                                     return_output=2 if self.return_output else False)
+                        if self.return_output:
+                            output, success = output
+                            if not success:
+                                return output or False  # Output for summarize() to show what failed
+                            output = output or True  # Such as flake8 that has no output on success
+                        elif not output:
+                            sys.exit(1)
+
+                        if record_coverage:
+                            CoverageMap(self.repo).record()
 
                         if not self.silent and (len(envs) > 1 or env == 'style'):
                             click.secho(f'{env}: OK', fg='green')
 
                         if self.return_output:
+                            if result_key:
+                                TestResult(env, summary=self.summarize(output)[1], output=output).save(result_key)
                             return output
                     else:
                         log.error('%s does not exist', command_path)
@@ -373,8 +462,130 @@ class Test(AbstractCommand):
                         else:
                             sys.exit(1)
 
+                if result_key:
+                    TestResult(env).save(result_key)
+
         return env_commands
 
+    def run_envs_in_parallel(self, tox, envs, files):
+        """
+        Run the envs at the same time, and show the output of each env prefixed with its name as it completes,
+        followed by a summary of all envs. Envs that share the same envdir are run one at a time as they can't be
+        (re)developed at the same time.
+
+        :param ToxIni tox: Tox config for the envs
+        :param list envs: Envs to run
+        :param list files: Files to pass to pytest
+        :return: Dict of env to commands ran on success. Exits if any env failed.
+        """
+        test_args = dict(repo=self.repo, tox_cmd=self.tox_cmd, tox_ini=self.tox_ini, tox_commands=self.tox_commands,
+                         match_test=self.match_test, num_processes=self.num_processes, extra_args=self.extra_args,
+                         no_cache=self.no_cache, debug=self.debug, commander=self.commander, return_output=True,
+                         silent=True)
+
+        def test_env(env):
+            return self.__class__(env_or_file=[env] + files, **test_args).run()
+
+        env_results = {}
+
+        for env, result in stream_call(test_env, envs, workers=len(envs), group=tox.envdir, group_workers=1):
+            if isinstance(result, BaseException):
+                result = str(result) or repr(result)
+            env_results[env] = result
+
+            if isinstance(result, TestResult):
+                output = result.output or '{} (cached)'.format(result.summary or 'OK')
+            else:
+                output = result if isinstance(result, str) else ''
+
+            if output.strip() and not self.silent:
+                click.echo('\n'.join('{} | {}'.format(env, line) for line in output.rstrip().split('\n')))
+
+        failed = False
+
+        for env in envs:
+            success, summary = self.summarize(env_results[env])
+            failed = failed or not success
+            if not self.silent or not success:
+                click.secho('{}: {}'.format(env, summary), fg='green' if success else 'red')
+
+        if failed:
+            sys.exit(1)
+
+        return dict((env, '\n'.join(self.tox_commands.get(env) or tox.commands(env))) for env in envs)
+
+    def supports_cov_context(self, tox, env):
+        """ True if pytest-cov installed in the env supports --cov-context (2.8 or later) """
+        version = tox.installed_distributions(env).get('pytest-cov')
+        match = version and re.match(r'(\d+)\.(\d+)', version)
+        supported = bool(match) and (int(match.group(1)), int(match.group(2))) >= (2, 8)
+
+        if not supported:
+            log.debug('Not recording coverage map for %s as pytest-cov %s does not support --cov-context', env, version)
+
+        return supported
+
+    def installed_dependencies(self, tox, env):
+        """
+        Versions of the distributions installed in the env for the test result key, where the version of those
+        installed in editable mode from other products (e.g. upstream products in the workspace) is the tree hash of
+        their working tree as their content changes without a version change.
+
+        :return: Dict of normalized name to version / tree hash, or None if the working tree of an editable install
+                 can not be read, and so test results should not be cached.
+        """
+        dependencies = tox.installed_distributions(env)
+
+        for name, path in tox.editable_paths(env).items():
+            if os.path.isdir(path) and repo_path(path) == repo_path(self.repo):
+                continue  # Its working tree is in the key already
+
+            dependencies[name] = os.path.isdir(path) and working_tree_hash(path)
+            if not dependencies[name]:
+                log.debug('Not caching test results as working tree for editable %s could not be read', name)
+                return None
+
+        return dependencies
+
+    def sync_env(self, tox, env, stale_reasons):
+        """
+        Sync the env by installing / uninstalling only the requirements that changed instead of redeveloping with tox.
+
+        :param ToxIni tox: Tox config for the env
+        :param str env: Env to sync
+        :param list stale_reasons: Reasons the env is stale from :meth:`ToxIni.stale_env_reasons`
+        :return: True if the env was synced, or False if it needs to be redeveloped with tox (such as when tox.ini
+                 or python changed, or the requirements can't be synced individually).
+        """
+        syncable = ['{} changed'.format(i) for i in config.bump.requirement_files.split() + SYNCABLE_FINGERPRINT_INPUTS]
+        if not all(reason in syncable for reason in stale_reasons):
+            return False
+
+        delta = tox.requirements_delta(env)
+        if delta is None:
+            return False
+
+        to_install, to_uninstall = delta
+
+        if not self.silent:
+            click.echo('{}: Syncing requirements as {}'.format(env, ', '.join(stale_reasons)))
+
+        if to_uninstall:
+            log.debug('Uninstalling from %s: %s', env, ' '.join(to_uninstall))
+            if not run([tox.bindir(env, 'pip'), 'uninstall', '-y'] + to_uninstall, cwd=self.repo, raises=False,
+                       silent=not self.debug):
+                return False
+
+        if to_install:
+            log.debug('Installing in %s: %s', env, ' '.join(to_install))
+            if not run(tox.install_command(env, to_install), cwd=self.repo, raises=False, silent=self.silent):
+                return False
+
+        tox.save_env_fingerprint(env)
+        self._strip_version_from_entry_scripts(tox, env)
+
+        return True
+
     def _strip_version_from_entry_scripts(self, tox, env):
         """ Strip out version spec "==1.2.3" from entry scripts as they require re-develop when version is changed in develop mode. """
         name = product_name(tox.path)
@@ -521,6 +732,8 @@ else:
                 run([pip, 'install', '--editable', lib_path], silent=not self.debug)
 
     def product_depends_on(self, path, name):
+        import pkg_resources
+
         for req_file in config.bump.requirement_files.split():
             req_path = os.path.join(path, req_file)
             if os.path.exists(req_path):
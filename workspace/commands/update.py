@@ -1,23 +1,40 @@
 from __future__ import absolute_import
+from contextlib import ExitStack
+import hashlib
 import logging
+import os
+import shutil
+import signal
 import sys
+import time
 
 import click
+from utils.process import is_running, silent_run
 
 from workspace.commands import AbstractCommand
 from workspace.commands.helpers import expand_product_groups
-from workspace.scm import checkout_branch, update_repo, repos, product_name, current_branch,\
-    update_branch, parent_branch
-from workspace.utils import parallel_call
+from workspace.config import config
+from workspace.scm import (update_repo, repos, product_name, update_branch, parent_branch, repo_state,
+                           remote_branches_changed, remote_host, ssh_multiplexing, prefetch_repo, query_cache,
+                           workspace_path)
+from workspace.utils import cache_path, daemonize, stream_call
 
 log = logging.getLogger(__name__)
 
+PREFETCH_LOG_FILE_NAME = 'prefetch.log'
+
 
 class Update(AbstractCommand):
     """
     Update current product or all products in workspace
 
+    Products are updated in parallel with a limit per git host, and SSH connections are shared per host. Fetches that
+    failed with a transient error are retried. See [update] config for settings.
+
     :param list products: When updating all products, filter by these products or product groups
+    :param bool background: Keep prefetching all products in the workspace in the background at low priority, so
+                            that updates only need to fast-forward / rebase locally without fetching.
+    :param bool stop: Stop prefetching in the background for the workspace
     """
     alias = 'up'
 
@@ -28,25 +45,186 @@ class Update(AbstractCommand):
     @classmethod
     def arguments(cls):
         _, docs = cls.docs()
-        return [cls.make_args('products', nargs='*', help=docs['products'])]
+        return [
+          cls.make_args('products', nargs='*', help=docs['products']),
+          cls.make_args('-b', '--background', action='store_true', help=docs['background']),
+          cls.make_args('--stop', action='store_true', help=docs['stop'])
+        ]
 
     def run(self):
 
         if self.products:
             self.products = expand_product_groups(self.products)
 
-        select_repos = [repo for repo in repos() if not self.products or self.products and product_name(repo)
-                        in self.products]
+        if self.background or self.stop:
+            self.background_prefetch()
+            return
+
+        select_repos = self.select_repos()
 
         if not select_repos:
             click.echo('No product found')
+            return
+
+        with ExitStack() as stack:
+            if config.update.ssh_multiplexing:
+                stack.enter_context(ssh_multiplexing())
+
+            if len(select_repos) == 1:
+                _update_repo(select_repos[0], raises=self.raises, verbose=0 if self.quiet else 2)
+
+            else:
+                self.update_repos(select_repos)
+
+    def select_repos(self, dir=None):
+        return [repo for repo in repos(dir) if not self.products or self.products and product_name(repo)
+                in self.products]
+
+    def background_prefetch(self):
+        """ Start or stop prefetching the products in the workspace periodically in the background """
+        workspace_dir = workspace_path()
+        pid_file = cache_path('prefetch-{}.pid'.format(hashlib.sha1(workspace_dir.encode('utf-8')).hexdigest()[:16]))
+        pid = _running_pid(pid_file)
+
+        if self.stop:
+            if pid:
+                os.kill(pid, signal.SIGTERM)
+                click.echo('Stopped background prefetch')
+            else:
+                click.echo('Background prefetch is not running')
+            return
+
+        if pid:
+            click.echo('Background prefetch is already running (pid {})'.format(pid))
+            return
+
+        click.echo('Prefetching products in {} every {} minutes in the background. Run "wst update --stop" to stop '
+                   'it.'.format(workspace_dir, config.update.prefetch_interval))
+        os.makedirs(cache_path(), exist_ok=True)
+        daemonize(log_file=cache_path(PREFETCH_LOG_FILE_NAME))
+
+        with open(pid_file, 'w') as fp:
+            fp.write(str(os.getpid()))
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        _lower_priority()
+
+        try:
+            while os.path.isdir(workspace_dir):
+                with query_cache() as cache:
+                    cache.invalidate()  # Pick up changes made in the workspace since the last prefetch
+
+                self.prefetch(self.select_repos(workspace_dir))
+                time.sleep(config.update.prefetch_interval * 60)
+
+        finally:
+            os.unlink(pid_file)
+
+    def prefetch(self, select_repos):
+        """ Fetch the repos in parallel without updating their branches """
+        hosts = dict((repo, remote_host(repo) or 'local') for repo in select_repos)
+        start_time = time.time()
+
+        with ExitStack() as stack:
+            if config.update.ssh_multiplexing:
+                stack.enter_context(ssh_multiplexing())
+
+            results = stream_call(_prefetch_repo, select_repos, workers=config.update.workers, group=hosts.get,
+                                  group_workers=config.update.workers_per_host)
+            failed = [repo for repo, errors in results if errors]
+
+        log.info('Prefetched %s product(s) in %.1f seconds%s', len(select_repos) - len(failed),
+                 time.time() - start_time, ' ({} failed)'.format(len(failed)) if failed else '')
+
+    def update_repos(self, select_repos):
+        """ Update the repos in parallel, skipping those without remote changes, and show stats per git host """
+        start_time = time.time()
+        hosts = dict((repo, remote_host(repo) or 'local') for repo in select_repos)
+        stats = dict((host, dict(updated=0, skipped=0, failed=0, retries=0, seconds=0)) for host in hosts.values())
+        schedule = dict(workers=config.update.workers, group=hosts.get, group_workers=config.update.workers_per_host)
+
+        changed_repos = []
+
+        for repo, changed in stream_call(_remote_changed, select_repos, ordered=True, **schedule):
+            if changed is False:
+                stats[hosts[repo]]['skipped'] += 1
+                stats[hosts[repo]]['seconds'] = time.time() - start_time
+            else:
+                changed_repos.append(repo)
+
+        for repo, retries in stream_call(_update_repo, changed_repos, **schedule):
+            host_stats = stats[hosts[repo]]
+            host_stats['seconds'] = time.time() - start_time
+
+            if retries is False or isinstance(retries, BaseException):  # Error was logged already
+                host_stats['failed'] += 1
+
+            else:
+                host_stats['updated'] += 1
+                host_stats['retries'] += retries
+
+        skipped = len(select_repos) - len(changed_repos)
+        if skipped:
+            click.echo('Skipped {} product(s) as they are already up-to-date'.format(skipped))
 
-        elif len(select_repos) == 1:
-            _update_repo(select_repos[0], raises=self.raises, verbose=0 if self.quiet else 2)
+        self.show_stats(stats)
+
+        if any(host_stats['failed'] for host_stats in stats.values()):
+            sys.exit(1)
+
+    def show_stats(self, stats):
+        """ Show update stats per git host as a table """
+        host_width = max(len(host) for host in list(stats) + ['Host'])
+        row_format = '{:<%d}  {:>7}  {:>7}  {:>6}  {:>7}  {:>7}' % host_width
+
+        click.echo(row_format.format('Host', 'Updated', 'Skipped', 'Failed', 'Retries', 'Time'))
+        for host, host_stats in sorted(stats.items()):
+            click.echo(row_format.format(host, host_stats['updated'], host_stats['skipped'], host_stats['failed'],
+                                         host_stats['retries'], '{:.1f}s'.format(host_stats['seconds'])))
+
+
+def _running_pid(pid_file):
+    """ Returns the pid in the pid file if it is running """
+    try:
+        with open(pid_file) as fp:
+            pid = int(fp.read())
+        if is_running(pid):
+            return pid
 
-        else:
-            if not all(parallel_call(_update_repo, select_repos).values()):
-                sys.exit(1)
+    except Exception:
+        pass
+
+
+def _lower_priority():
+    """ Lower the CPU and IO priority of the current process (and the git processes it starts) """
+    os.nice(10)
+
+    if shutil.which('ionice'):
+        silent_run(['ionice', '-c', '2', '-n', '7', '-p', str(os.getpid())], raises=False)
+
+
+def _prefetch_repo(repo):
+    """ Returns the fetch errors for the repo, if any """
+    try:
+        errors = prefetch_repo(repo, retries=config.update.retries, retry_delay=config.update.retry_delay)
+        for remote, error in errors.items():
+            log.error('%s: Failed to fetch from %s: %s', product_name(repo), remote, error)
+        return errors
+
+    except Exception as e:
+        log.error('%s: %s', product_name(repo), e)
+        return {None: str(e)}
+
+
+def _remote_changed(repo):
+    """ True if the repo has remote changes to update from, or the current branch needs a rebase onto its parent """
+    branch = repo_state(repo).current_branch
+    parent = parent_branch(branch)
+
+    if parent and not silent_run(['git', 'merge-base', '--is-ancestor', parent, branch], cwd=repo,
+                                 return_output=2)[1]:  # Parent has commits that the branch does not
+        return True
+
+    return remote_branches_changed(repo, branch=parent, prefetched_within=config.update.prefetched_within * 60)
 
 
 def _update_repo(repo, raises=False, verbose=1):
@@ -56,20 +234,19 @@ def _update_repo(repo, raises=False, verbose=1):
         if verbose == 1:
             click.echo('Updating ' + name)
 
-        branch = current_branch(repo)
+        branch = repo_state(repo).current_branch
         parent = parent_branch(branch)
-        if parent:
-            checkout_branch(parent, repo)
 
-        update_repo(repo, quiet=verbose != 2)
+        retries = update_repo(repo, quiet=verbose != 2, branch=parent, retries=config.update.retries,
+                              retry_delay=config.update.retry_delay,
+                              prefetched_within=config.update.prefetched_within * 60)  # Without checking out parent
 
         if parent:
             if verbose == 2:
                 click.echo('Rebasing ' + branch)
-            checkout_branch(branch, repo_path=repo)
             update_branch(repo=repo, parent=parent)
 
-        return True
+        return retries
     except Exception as e:
         if raises:
             raise
@@ -31,6 +31,9 @@
   # It should accept a ?q=singleWord param
   search_api_url = https://api.github.com/search/repositories
 
+  # Hours to cache search results for. Cached results are also used when the search API can't be reached.
+  search_cache_hours = 168
+
   # URL to use when checking out a user repo reference (e.g. wst checkout maxzheng/workspace-tools)
   user_repo_url = git@github.com:%s.git
 
@@ -38,6 +41,30 @@
   # will use upstream remote. e.g. maxzheng
   origin_user =
 
+  # Number of products to checkout at the same time (also limited by [update] workers_per_host)
+  workers = 10
+
+  # Clone with a partial clone filter to fetch file contents on demand, e.g. blob:none
+  filter =
+
+  # Clone with history truncated to the given number of commits. History is deepened on demand by commands that
+  # need it, such as log, merge, and publish.
+  depth =
+
+  # Share objects between checkouts of the same product (e.g. forks) in the workspace by cloning with a reference
+  # to a shared object store per product in the workspace's .objects dir (git alternates). This saves clone time
+  # and disk space. Run "wst maintenance" to keep the stores fetched and packed. Do not remove the .objects dir
+  # as the checkouts depend on it. Not used for partial / shallow clones.
+  shared_objects = false
+
+  ###########################################################################################################
+  # Sparse checkout dirs (cone patterns) per product or product group, separated by space. When a product is
+  # checked out, only the dirs (and top level files) are checked out in the working tree. e.g.
+  #   mzheng-repos = src docs
+  ###########################################################################################################
+  [sparse_checkout]
+
+
   ###########################################################################################################
   # Settings for clean command
   ###########################################################################################################
@@ -69,21 +96,118 @@
 
   # Branches to merge separated by space (e.g. 3.2.x 3.3.x master)
   branches =
+
+
+  ###########################################################################################################
+  # Settings for status command
+  ###########################################################################################################
+  [status]
+
+  # Number of products to get status for at the same time
+  workers = 10
+
+  # Seconds to wait for the status of a product before showing it as timed out (e.g. huge untracked dirs or NFS)
+  timeout = 30
+
+
+  ###########################################################################################################
+  # Settings for test command
+  ###########################################################################################################
+  [test]
+
+  # Days to keep passed test results for. Tests are not run again when they passed for the same content
+  # (working tree, including untracked files), test env and its installed dependencies (including the working trees of
+  # products installed in editable mode), and test args. Set to 0 to always run tests.
+  result_cache_days = 7
+
+  # Record which tests cover each line in full test runs of envs that run pytest with coverage (--cov), so that
+  # "wst test --changed" can run only the tests affected by changes. This adds --cov-context=test to those runs,
+  # which makes them slower and the .coverage files larger, and requires pytest-cov 2.8 or later in the env.
+  coverage_map = false
+
+
+  ###########################################################################################################
+  # Settings for update command
+  ###########################################################################################################
+  [update]
+
+  # Number of products to update at the same time
+  workers = 10
+
+  # Number of products to update at the same time from the same git host (e.g. github.com) to avoid
+  # connection storms and rate limits
+  workers_per_host = 4
+
+  # Number of times to retry fetching from a remote that failed with a transient error, such as a dropped
+  # connection or rate limit. Retries are backed off exponentially starting from retry_delay seconds.
+  retries = 2
+  retry_delay = 1
+
+  # Share one SSH connection per host between the git commands of an update (SSH ControlMaster)
+  ssh_multiplexing = true
+
+  # Minutes between fetches of all products when prefetching in the background with "wst update --background"
+  prefetch_interval = 10
+
+  # Products that were prefetched within the given minutes are updated by fast-forwarding / rebasing locally,
+  # without fetching from their remotes. Set to 0 to always fetch.
+  prefetched_within = 15
 """
 from __future__ import absolute_import
 
 import logging
 import os
 
-from remoteconfig import RemoteConfig
+from localconfig import LocalConfig
 
 
 CONFIG_FILE = 'workspace.cfg'
 USER_CONFIG_FILE = os.path.join('~', '.config', CONFIG_FILE)
+DEFAULT_CONFIG = __doc__.replace('\n  ', '\n')
 
 log = logging.getLogger()
-config = RemoteConfig(USER_CONFIG_FILE, cache_duration=60)
-config.read(__doc__.replace('\n  ', '\n'))
+
+
+class WorkspaceConfig(LocalConfig):
+    """
+    Same as :class:`remoteconfig.RemoteConfig`, except remoteconfig (and requests that it uses) is only imported when
+    reading from a URL source as most commands never need it.
+    """
+
+    def __init__(self, last_source=None, cache_duration=None, **localconfig_kwargs):
+        """
+          :param file/str last_source: Last config source, file or URL.
+          :param int cache_duration: For URL source only. Optionally cache the URL content for the given duration (seconds)
+          :param dict localconfig_kwargs: Additional keyword args to be passed to :meth:`LocalConfig.__init__`
+        """
+        self._cache_duration = cache_duration
+
+        super(WorkspaceConfig, self).__init__(last_source, **localconfig_kwargs)
+
+    def read(self, sources, cache_duration=None):
+        if cache_duration is not None:
+            self._cache_duration = cache_duration
+
+        return super(WorkspaceConfig, self).read(sources)
+
+    def reload(self):
+        """
+        Re-read the config from the defaults and the user config, such as after the user config file has changed.
+        Reading the user config again on top of the current config would keep the keys / sections removed from it.
+        """
+        self.__init__(self._last_source, cache_duration=self._cache_duration)
+        self.read(DEFAULT_CONFIG)
+
+    def _read(self, source):
+        if source.startswith('http://') or source.startswith('https://'):
+            from remoteconfig.utils import url_content
+            source = url_content(source, cache_duration=self._cache_duration, from_cache_on_error=True)
+
+        return super(WorkspaceConfig, self)._read(source)
+
+
+config = WorkspaceConfig(USER_CONFIG_FILE, cache_duration=60)
+config.read(DEFAULT_CONFIG)
 
 
 def product_groups():
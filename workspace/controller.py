@@ -1,28 +1,48 @@
 from __future__ import absolute_import
 import argparse
+import hashlib
+from importlib import import_module
+import json
 import logging
-import pkg_resources
+import os
 import sys
 import textwrap
 
-from workspace.commands.bump import Bump
-from workspace.commands.checkout import Checkout
-from workspace.commands.clean import Clean
-from workspace.commands.commit import Commit
-from workspace.commands.diff import Diff
-from workspace.commands.log import Log
-from workspace.commands.merge import Merge
-from workspace.commands.publish import Publish
-from workspace.commands.push import Push
-from workspace.commands.update import Update
-from workspace.commands.status import Status
-from workspace.commands.setup import Setup
-from workspace.commands.test import Test
-from workspace.utils import log_exception
+from workspace.utils import cache_path, log_exception, package_version
 
 
 log = logging.getLogger(__name__)
 
+#: Map of command name to import path of the command class. Commands are only imported when used.
+COMMANDS = {
+    'bump': 'workspace.commands.bump:Bump',
+    'checkout': 'workspace.commands.checkout:Checkout',
+    'clean': 'workspace.commands.clean:Clean',
+    'commit': 'workspace.commands.commit:Commit',
+    'daemon': 'workspace.commands.daemon:Daemon',
+    'diff': 'workspace.commands.diff:Diff',
+    'index': 'workspace.commands.index:Index',
+    'log': 'workspace.commands.log:Log',
+    'maintenance': 'workspace.commands.maintenance:Maintenance',
+    'merge': 'workspace.commands.merge:Merge',
+    'publish': 'workspace.commands.publish:Publish',
+    'push': 'workspace.commands.push:Push',
+    'setup': 'workspace.commands.setup:Setup',
+    'status': 'workspace.commands.status:Status',
+    'test': 'workspace.commands.test:Test',
+    'update': 'workspace.commands.update:Update',
+}
+
+#: Map of command alias to command name. This must match the alias set on the command classes in :data:`COMMANDS`,
+#: which is checked when the commands metadata is built (see :meth:`Commander.commands_metadata`).
+COMMAND_ALIASES = {
+    'ci': 'commit',
+    'co': 'checkout',
+    'di': 'diff',
+    'st': 'status',
+    'up': 'update',
+}
+
 
 class Commander(object):
     """
@@ -43,16 +63,35 @@ class Commander(object):
     @classmethod
     def commands(cls):
         """
-          Map of command name to command classes.
-          Override commands to replace any command name with another class to customize the command.
+          Map of command name to command classes, or import paths of the classes in "module:Class" format.
+          Import paths are only imported when the command is used, so running one command does not pay for the imports
+          of all the others.
+          Override commands to replace any command name with another class (or import path) to customize the command.
         """
-        cs = [Bump, Checkout, Clean, Commit, Diff, Log, Merge, Publish, Push, Setup, Status, Test, Update]
-        return dict((c.name(), c) for c in cs)
+        return dict(COMMANDS)
+
+    @classmethod
+    def aliases(cls):
+        """ Map of command alias to command name, which includes aliases of command classes from :meth:`commands` """
+        aliases = dict(COMMAND_ALIASES)
+
+        for name, command in cls.commands().items():
+            if not isinstance(command, str) and command.alias:
+                aliases[command.alias] = name
+
+        return aliases
 
     @classmethod
     def command(cls, name):
-        """ Get command class for name """
-        return cls.commands().get(name)
+        """ Get command class for name or alias. Returns None if there is no such command. """
+        commands = cls.commands()
+        command = commands.get(name) or commands.get(cls.aliases().get(name))
+
+        if isinstance(command, str):
+            module, _, class_name = command.partition(':')
+            command = getattr(import_module(module), class_name)
+
+        return command
 
     @classmethod
     def main(cls):
@@ -64,7 +103,7 @@ class Commander(object):
           Sets up logging, parser, and creates the necessary command sequences to run, and runs
           the command given by the user.
         """
-        self.setup_parsers()
+        self.setup_parsers(self._command_from_argv(sys.argv[1:]))
 
         args, extra_args = self.parser.parse_known_args()
 
@@ -72,7 +111,7 @@ class Commander(object):
             self.parser.print_help()
             sys.exit()
 
-        if args.command not in [c.name() for c in list(self.commands().values()) if 'extra_args' in c.docs()[1]] and extra_args:
+        if extra_args and 'extra_args' not in self.command(args.command).docs()[1]:
             log.error('Unrecognized arguments: %s', ' '.join(extra_args))
             sys.exit(1)
 
@@ -94,9 +133,14 @@ class Commander(object):
         if not name:
             return self._run()
 
-        if name in self.commands():
+        command = self.command(name)
+
+        if command:
+            from workspace.scm import query_cache
+
             kwargs['commander'] = self
-            return self.command(name)(**kwargs).run()
+            with query_cache():
+                return command(**kwargs).run()
         else:
             log.error('Command "%s" is not registered. Override Commander.commands() to add.', name)
             sys.exit(1)
@@ -111,19 +155,75 @@ class Commander(object):
                                               formatter_class=argparse.RawDescriptionHelpFormatter)
         self.parser.register('action', 'parsers', AliasedSubParsersAction)
 
-        versions = []
-        for pkg in [_f for _f in [getattr(self, 'package_name', None), 'workspace-tools'] if _f]:
-            try:
-                versions.append('%s %s' % (pkg, pkg_resources.get_distribution(pkg).version))
-            except Exception:
-                pass
-
-        self.parser.add_argument('-v', '--version', action='version', version='\n'.join(versions))
+        packages = [_f for _f in [getattr(self, 'package_name', None), 'workspace-tools'] if _f]
+        self.parser.add_argument('-v', '--version', action=VersionAction, packages=packages)
         self.parser.add_argument('--debug', action='store_true', help='Turn on debug mode')
 
-    def setup_parsers(self):
+    def _command_from_argv(self, argv):
+        """
+          Peek at the command line args to find the command to run without setting up any parsers.
+
+          :param list argv: Command line args without the program name
+          :return: Name of the command if found, otherwise None (such as when -h or --version is used before the command)
+        """
+        for arg in argv:
+            if arg == '--debug':
+                continue
+
+            if not arg.startswith('-') and self.command(arg):
+                return self.aliases().get(arg, arg)
+
+            break
+
+    def commands_metadata(self):
+        """
+          Map of command name to dict of metadata (help and aliases) for all commands that is used to set up the main
+          parser's help without importing every command. It is cached in a file keyed by package version and commands.
+        """
+        packages = [_f for _f in [getattr(self, 'package_name', None), 'workspace-tools'] if _f]
+        commands = sorted((name, str(command)) for name, command in self.commands().items())
+        key = json.dumps([type(self).__module__, type(self).__name__, [package_version(p) for p in packages], commands])
+        metadata_file = cache_path('commands-%s.json' % hashlib.sha1(key.encode()).hexdigest()[:16])
+
+        try:
+            with open(metadata_file) as fp:
+                return json.load(fp)
+        except Exception:
+            pass
+
+        metadata = {}
+        for name, import_path in self.commands().items():
+            command = self.command(name)
+            doc, _ = command.docs()
+            metadata[name] = {
+                'help': list(filter(None, doc.split('\n')))[0].strip(),
+                'aliases': [command.alias] if command.alias else []
+            }
+
+            if import_path == COMMANDS.get(name):
+                aliases = [a for a, n in COMMAND_ALIASES.items() if n == name]
+                assert aliases == metadata[name]['aliases'], \
+                    'COMMAND_ALIASES has {} for {} command, but its class has {}'.format(aliases, name, command.alias)
+
+        try:
+            os.makedirs(os.path.dirname(metadata_file), exist_ok=True)
+            temp_file = '%s.%d' % (metadata_file, os.getpid())
+            with open(temp_file, 'w') as fp:
+                json.dump(metadata, fp)
+            os.rename(temp_file, metadata_file)
+        except Exception as e:
+            log.debug('Could not cache commands metadata: %s', e)
+
+        return metadata
+
+    def setup_parsers(self, name=None):
         """
-          Sets up parsers for all commands
+          Sets up parsers for the given command only, or all commands if not given.
+
+          When setting up all commands, only the help of each command is set up (from :meth:`commands_metadata`) as
+          that is all the main parser needs for -h / --version, and the command args are parsed when it is given.
+
+          :param str name: Name of command to set up parser for.
         """
 
         self._setup_parser()
@@ -131,29 +231,47 @@ class Commander(object):
         self.subparsers = self.parser.add_subparsers(title='sub-commands', help='List of sub-commands', dest='command')
         self.subparsers.remove_parser = lambda *args, **kwargs: _remove_parser(self.subparsers, *args, **kwargs)
 
-        for name, command in sorted(self.commands().items()):
-            doc, _ = command.docs()
-            help = list(filter(None, doc.split('\n')))[0]
-            aliases = [command.alias] if command.alias else None
+        if not name:
+            for name, metadata in sorted(self.commands_metadata().items()):
+                self.subparsers.add_parser(name, aliases=metadata['aliases'], help=metadata['help'])
+            return
+
+        command = self.command(name)
+        doc, _ = command.docs()
+        help = list(filter(None, doc.split('\n')))[0]
+        aliases = [command.alias] if command.alias else None
+
+        parser = self.subparsers.add_parser(name, aliases=aliases, description=textwrap.dedent(doc), help=help,
+                                            formatter_class=argparse.RawDescriptionHelpFormatter)
+
+        cmd_args = command.arguments()
+
+        if isinstance(cmd_args, tuple):
+            normal_args, chain_args = cmd_args
+        else:
+            normal_args = cmd_args
+            chain_args = []
+
+        for args, kwargs in normal_args:
+            parser.add_argument(*args, **kwargs)
+
+        if chain_args:
+            group = parser.add_argument_group('chaining options')
+            for args, kwargs in chain_args:
+                group.add_argument(*args, **kwargs)
 
-            parser = self.subparsers.add_parser(name, aliases=aliases, description=textwrap.dedent(doc), help=help,
-                                                formatter_class=argparse.RawDescriptionHelpFormatter)
 
-            cmd_args = command.arguments()
+class VersionAction(argparse._VersionAction):
+    """ Same as argparse's version action, but only looks up the versions of the packages when invoked. """
 
-            if isinstance(cmd_args, tuple):
-                normal_args, chain_args = cmd_args
-            else:
-                normal_args = cmd_args
-                chain_args = []
+    def __init__(self, packages, **kwargs):
+        super(VersionAction, self).__init__(**kwargs)
+        self.packages = packages
 
-            for args, kwargs in normal_args:
-                parser.add_argument(*args, **kwargs)
+    def __call__(self, parser, namespace, values, option_string=None):
+        self.version = '\n'.join('%s %s' % (pkg, package_version(pkg)) for pkg in self.packages if package_version(pkg))
 
-            if chain_args:
-                group = parser.add_argument_group('chaining options')
-                for args, kwargs in chain_args:
-                    group.add_argument(*args, **kwargs)
+        super(VersionAction, self).__call__(parser, namespace, values, option_string=option_string)
 
 
 # Copied from https://gist.github.com/sampsyo/471779
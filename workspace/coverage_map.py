@@ -0,0 +1,236 @@
+"""
+Map of the lines in a repo to the tests that cover them, so that only the tests affected by changes are run (e.g.
+wst test --changed).
+
+The map is recorded from the coverage data (.coverage) of a full run of an env that runs pytest with --cov, which is
+run with --cov-context=test to record the tests that covered each line. It is kept in the cache dir with the commit and
+working tree that it was recorded for, and the changes since then are found by diffing the trees. The objects of the
+recorded tree are kept in an object dir next to the map, so none are written to the repo. The coverage data is read
+directly from its SQLite database, so coverage does not need to be installed with workspace-tools.
+"""
+from __future__ import absolute_import
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+
+from utils.process import silent_run
+
+from workspace.scm import objects_env, parent_branch, repo_state, working_tree_hash
+from workspace.utils import cache_path
+
+log = logging.getLogger(__name__)
+
+MAP_VERSION = 1
+COVERAGE_DATA_FILE = '.coverage'
+DOC_EXTENSIONS = ('.rst', '.md')  # Changes to these files do not affect tests
+MAX_SELECTED_TESTS = 200  # Select test files instead of test functions when there are more tests than this
+HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@')
+TEST_FILE_RE = re.compile(r'(^|/)(test_[^/]*|[^/]*_test)\.py$')
+
+
+class CoverageMap(object):
+    """ Map of lines to the tests that cover them for a repo """
+
+    def __init__(self, repo):
+        """
+        :param str repo: Path to the repo
+        """
+        self.repo = os.path.abspath(repo)
+        self.map_file = cache_path('coverage-map-{}.json'.format(hashlib.sha1(self.repo.encode('utf-8')).hexdigest()[:16]))
+        self.object_dir = self.map_file[:-len('.json')] + '-objects'  # Objects of the recorded tree
+
+    def record(self, data_file=None):
+        """
+        Record the map from coverage data with test contexts (pytest --cov-context=test) for the current working tree.
+
+        :param str data_file: Coverage data file. Defaults to .coverage in the repo.
+        :return: True if the map was recorded
+        """
+        data_file = data_file or os.path.join(self.repo, COVERAGE_DATA_FILE)
+
+        try:
+            file_lines = read_coverage_contexts(data_file, self.repo)
+        except (sqlite3.Error, IOError, OSError) as e:
+            log.debug('Could not read coverage data from %s: %s', data_file, e)
+            return False
+
+        if not any(test for lines in file_lines.values() for tests in lines.values() for test in tests):
+            log.debug('No test contexts found in %s - was it run with --cov-context=test?', data_file)
+            return False
+
+        shutil.rmtree(self.object_dir, ignore_errors=True)  # Objects of the previously recorded tree are not needed
+        tree = working_tree_hash(self.repo, object_dir=self.object_dir)
+        if not tree:
+            return False
+
+        tests = sorted(set(test for lines in file_lines.values() for tests in lines.values() for test in tests))
+        test_index = dict((test, i) for i, test in enumerate(tests))
+        cov_map = {
+            'version': MAP_VERSION,
+            'commit': repo_state(self.repo).head,
+            'tree': tree,
+            'tests': tests,
+            'files': dict((path, dict((str(line), sorted(test_index[t] for t in line_tests))
+                                      for line, line_tests in lines.items()))
+                          for path, lines in file_lines.items())
+        }
+
+        try:
+            os.makedirs(os.path.dirname(self.map_file), exist_ok=True)
+
+            with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(self.map_file), delete=False) as fp:
+                json.dump(cov_map, fp)
+            os.rename(fp.name, self.map_file)
+
+        except (IOError, OSError) as e:
+            log.debug('Could not save coverage map: %s', e)
+            return False
+
+        return True
+
+    def affected_tests(self):
+        """
+        Find the tests affected by the changes to the working tree since the map was recorded. The map is only used if
+        it was recorded at HEAD or the parent branch (see :func:`workspace.scm.parent_branch`).
+
+        :return: Tuple of (list of test ids / files relative to the repo, reason). The list is None if all tests should
+                 be run, such as when the map is stale or non-Python files (e.g. requirements.txt, tox.ini) changed,
+                 with the reason why.
+        """
+        cov_map = self._load()
+        if not cov_map:
+            return None, 'there is no coverage map from a full test run with coverage'
+
+        state = repo_state(self.repo)
+        parent = state.current_branch and parent_branch(state.current_branch)
+        if cov_map['commit'] not in (state.head, parent and state.sha(parent)):
+            return None, 'coverage map was recorded at a commit other than HEAD{}'.format(
+                ' or ' + parent if parent else '')
+
+        with tempfile.TemporaryDirectory() as object_dir:  # Objects of the current tree are not kept
+            tree = working_tree_hash(self.repo, object_dir=object_dir, alternates=[self.object_dir])
+            if not tree:
+                return None, 'working tree could not be read'
+
+            diff, success = silent_run(['git', 'diff', '-U0', '--no-color', '--no-ext-diff', '--no-renames',
+                                        cov_map['tree'], tree], cwd=self.repo, return_output=2,
+                                       env=objects_env(self.repo, object_dir, [self.object_dir]))
+        if not success:
+            return None, 'working tree that the coverage map was recorded for is not available'
+
+        tests = cov_map['tests']
+        selected = set()
+        changed_files = parse_diff(diff)
+
+        for path, lines in sorted(changed_files.items()):
+            if not path.endswith('.py'):
+                if path.endswith(DOC_EXTENSIONS):
+                    continue
+                return None, '{} changed'.format(path)
+
+            file_tests = cov_map['files'].get(path)
+
+            if TEST_FILE_RE.search(path):
+                if os.path.exists(os.path.join(self.repo, path)):
+                    selected.add(path)  # Whole file as its tests may have been added / renamed
+
+            elif file_tests is None:
+                if os.path.exists(os.path.join(self.repo, path)):
+                    return None, '{} is not in the coverage map'.format(path)
+
+            else:
+                line_tests = set(tests[t] for line in lines for t in file_tests.get(str(line), []))
+                if '' in line_tests:  # Changed code that runs on import, so all tests that use the file are affected
+                    line_tests = set(tests[t] for ts in file_tests.values() for t in ts)
+                selected.update(line_tests)
+
+        selected.discard('')
+        selected = set(t for t in selected if os.path.exists(os.path.join(self.repo, t.split('::')[0])))
+
+        if len(selected) > MAX_SELECTED_TESTS or any(re.search(r'\s', t) for t in selected):
+            selected = set(t.split('::')[0] for t in selected)
+
+        return sorted(selected), '{} tests affected by changes in {} files'.format(len(selected), len(changed_files))
+
+    def _load(self):
+        try:
+            with open(self.map_file) as fp:
+                cov_map = json.load(fp)
+
+        except (IOError, OSError, ValueError):
+            return None
+
+        if cov_map.get('version') == MAP_VERSION:
+            return cov_map
+
+
+def read_coverage_contexts(data_file, root):
+    """
+    Read the lines covered by each test context from the coverage SQLite data file.
+
+    :param str data_file: Path to .coverage file
+    :param str root: Only include files in this dir, with their paths relative to it.
+    :return: Dict of file path to dict of line number to set of test ids (pytest node id). Lines that were run
+             outside of tests (e.g. on import during collection) have an empty test id.
+    :raise sqlite3.Error: If the data file can not be read
+    """
+    if not os.path.exists(data_file):
+        raise IOError('{} does not exist'.format(data_file))
+
+    con = sqlite3.connect('file:{}?mode=ro'.format(data_file), uri=True)
+
+    try:
+        files = dict(con.execute('SELECT id, path FROM file'))
+        contexts = dict((id, context.rsplit('|', 1)[0]) for id, context in con.execute('SELECT id, context FROM context'))
+
+        covered = []
+        for file_id, context_id, numbits in con.execute('SELECT file_id, context_id, numbits FROM line_bits'):
+            covered.extend((file_id, context_id, line) for line in numbits_to_lines(numbits))
+        for file_id, context_id, from_line, to_line in con.execute('SELECT file_id, context_id, fromno, tono FROM arc'):
+            covered.extend((file_id, context_id, line) for line in (from_line, to_line) if line > 0)
+
+    finally:
+        con.close()
+
+    file_lines = {}
+    for file_id, context_id, line in covered:
+        path = os.path.relpath(files[file_id], root)
+        if not path.startswith('..'):
+            file_lines.setdefault(path, {}).setdefault(line, set()).add(contexts[context_id])
+
+    return file_lines
+
+
+def numbits_to_lines(numbits):
+    """ Convert coverage's numbits (bitmap where bit N is set for line N) to a list of line numbers """
+    return [byte_i * 8 + bit_i for byte_i, byte in enumerate(numbits) for bit_i in range(8) if byte & (1 << bit_i)]
+
+
+def parse_diff(diff):
+    """
+    Parse `git diff -U0` output for the changed lines.
+
+    :return: Dict of changed file path to set of changed line numbers in the old version. Line numbers around
+             added lines are included as the code around them is affected.
+    """
+    changed = {}
+    path = None
+
+    for line in diff.split('\n'):
+        if line.startswith('diff --git a/'):
+            paths = line[len('diff --git a/'):]  # "<path> b/<path>" as there are no renames
+            path = paths[:(len(paths) - 3) // 2]
+            changed[path] = set()
+
+        elif path and line.startswith('@@'):
+            match = HUNK_RE.match(line)
+            if match:
+                start, count = int(match.group(1)), int(match.group(2) if match.group(2) is not None else 1)
+                changed[path].update(range(start, start + count) if count else (start, start + 1))
+
+    return changed
@@ -0,0 +1,175 @@
+"""
+Index of the repos in a workspace that is kept in the cache dir, so that repos and their basic info (remotes, branch,
+HEAD, last fetch time) can be looked up without scanning the workspace or running git.
+
+Entries are refreshed incrementally: the workspace dir is only listed again when its mtime changes, and a repo is only
+read again when the mtime of its dir or its HEAD, index, FETCH_HEAD, packed-refs, or current branch ref changes.
+"""
+from __future__ import absolute_import
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from workspace.utils import cache_path
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+#: Files in the git dir (and common dir for worktrees) that indicate the repo info has changed
+WORKTREE_GIT_FILES = ('HEAD', 'index')
+COMMON_GIT_FILES = ('FETCH_HEAD', 'packed-refs')
+
+
+class WorkspaceIndex(object):
+    """ Index of the repos in a workspace dir """
+
+    def __init__(self, workspace_dir):
+        """
+        :param str workspace_dir: Workspace dir that contains the repos
+        """
+        self.workspace_dir = os.path.abspath(workspace_dir)
+        self.index_file = cache_path('index-{}.json'.format(
+            hashlib.sha1(self.workspace_dir.encode('utf-8')).hexdigest()[:16]))
+        self._index = None
+
+    def repos(self):
+        """ Returns a sorted list of repo paths in the workspace """
+        self.refresh(repo_info=False)
+        return [entry['path'] for _, entry in sorted(self._index['repos'].items())]
+
+    def entries(self):
+        """ Returns a dict of repo name to its index entry after refreshing the index """
+        self.refresh()
+        return self._index['repos']
+
+    def refresh(self, rebuild=False, repo_info=True):
+        """
+        Refresh the index for any changes in the workspace and save it if changed.
+
+        :param bool rebuild: Rebuild the index from scratch instead
+        :param bool repo_info: Refresh repo info (branch, HEAD, etc) too. Otherwise, only repos added / removed are
+                               refreshed, which is enough to list the repos.
+        """
+        index = None if rebuild else self._load()
+        index_changed = False
+
+        if not index:
+            index = {'version': INDEX_VERSION, 'mtime': None, 'repos': {}, 'dirs': {}}
+
+        try:
+            workspace_mtime = os.stat(self.workspace_dir).st_mtime
+        except OSError:
+            workspace_mtime = None
+
+        if workspace_mtime != index['mtime'] or workspace_mtime is None:
+            names = os.listdir(self.workspace_dir) if workspace_mtime else []
+            index['mtime'] = workspace_mtime
+            index_changed = True
+        else:
+            names = list(index['repos']) + list(index['dirs'])
+
+        repos = {}
+        dirs = {}
+
+        for name in names:
+            path = os.path.join(self.workspace_dir, name)
+
+            try:
+                dir_mtime = os.stat(path).st_mtime
+            except OSError:
+                index_changed = True
+                continue
+
+            entry = index['repos'].get(name)
+
+            if (entry and entry['dir_mtime'] == dir_mtime and
+                    (not repo_info or entry['mtimes'] == _git_mtimes(path, entry['branch']))):
+                repos[name] = entry
+
+            elif not entry and index['dirs'].get(name) == dir_mtime:
+                dirs[name] = dir_mtime
+
+            elif os.path.isdir(path):
+                index_changed = True
+
+                if os.path.exists(os.path.join(path, '.git')):
+                    repos[name] = _repo_entry(path, dir_mtime)
+                else:
+                    dirs[name] = dir_mtime
+
+        if index_changed or repos != index['repos'] or dirs != index['dirs']:
+            index['repos'] = repos
+            index['dirs'] = dirs
+            self._save(index)
+
+        self._index = index
+
+    def _load(self):
+        try:
+            with open(self.index_file) as fp:
+                index = json.load(fp)
+
+            if index.get('version') == INDEX_VERSION:
+                return index
+
+        except (IOError, OSError, ValueError):
+            pass
+
+    def _save(self, index):
+        try:
+            index_dir = os.path.dirname(self.index_file)
+            os.makedirs(index_dir, exist_ok=True)
+
+            with tempfile.NamedTemporaryFile('w', dir=index_dir, delete=False) as fp:
+                json.dump(index, fp)
+            os.rename(fp.name, self.index_file)
+
+        except (IOError, OSError) as e:
+            log.debug('Could not save workspace index: %s', e)
+
+
+def _repo_entry(path, dir_mtime):
+    """ Returns the index entry for the repo """
+    from workspace.scm import RepoState, default_remote, git_config, git_dir, upstream_remote
+
+    state = RepoState(path)
+    remotes = sorted(subsection for section, subsection in git_config(path) if section == 'remote' and subsection)
+    fetch_head = os.path.join(git_dir(path, common=True) or '', 'FETCH_HEAD')
+
+    return {
+        'path': path,
+        'remotes': remotes,
+        'default_remote': remotes and default_remote(remotes=remotes),
+        'upstream_remote': remotes and upstream_remote(remotes=remotes),
+        'branch': state.current_branch,
+        'head': state.head,
+        'fetched': os.stat(fetch_head).st_mtime if os.path.exists(fetch_head) else None,
+        'dir_mtime': dir_mtime,
+        'mtimes': _git_mtimes(path, state.current_branch)
+    }
+
+
+def _git_mtimes(path, branch):
+    """ Returns a dict of git file to its mtime (or None if it does not exist) for checking if the repo has changed """
+    from workspace.scm import git_dir
+
+    worktree_dir = common_dir = os.path.join(path, '.git')
+    if not os.path.isdir(worktree_dir):  # Worktree
+        worktree_dir = git_dir(path) or ''
+        common_dir = git_dir(path, common=True) or ''
+    files = [os.path.join(worktree_dir, name) for name in WORKTREE_GIT_FILES]
+    files.extend(os.path.join(common_dir, name) for name in COMMON_GIT_FILES)
+    if branch and not branch.startswith('('):  # Not detached
+        files.append(os.path.join(common_dir, 'refs', 'heads', branch))
+
+    mtimes = {}
+    for git_file in files:
+        try:
+            mtimes[os.path.relpath(git_file, path)] = os.stat(git_file).st_mtime
+        except OSError:
+            mtimes[os.path.relpath(git_file, path)] = None
+
+    return mtimes
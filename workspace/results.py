@@ -0,0 +1,94 @@
+"""
+Store of passed test results in the cache dir, keyed by the content that was tested: the working tree (including
+untracked files), the test env fingerprint, the distributions installed in the env (with the working trees of other
+products that are installed in editable mode), and the test commands / args. A test run that was already done for the
+same content (e.g. after amending only the commit message, or switching back to a tested branch) is not run again.
+
+Results are kept for [test] result_cache_days.
+"""
+from __future__ import absolute_import
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from workspace.config import config
+from workspace.utils import cache_path
+
+log = logging.getLogger(__name__)
+
+RESULTS_DIR_NAME = 'test-results'
+
+
+class TestResult(object):
+    """ Result of a passed test run for an env """
+
+    __test__ = False  # Not a test class for pytest
+
+    def __init__(self, env, summary=None, output=None, time=None):
+        """
+        :param str env: Env that was tested
+        :param str summary: Test summary, such as "10 passed in 1.20 seconds"
+        :param str output: Test output if it was captured
+        :param float time: Time that the test was run
+        """
+        self.env = env
+        self.summary = summary
+        self.output = output
+        self.time = time
+
+    @classmethod
+    def key(cls, tree_hash, env, env_fingerprint, commands, dependencies=None):
+        """
+        Key to store the result by.
+
+        :param str tree_hash: Tree hash of the working tree from :func:`workspace.scm.working_tree_hash`
+        :param str env: Env to test
+        :param dict env_fingerprint: Fingerprint of the env from :meth:`ToxIni.env_fingerprint`
+        :param list commands: Test commands with the args to run them with (e.g. pytest args)
+        :param dict dependencies: Map of distribution name installed in the env to its version, or the tree hash of
+                                  its working tree if it is installed in editable mode from another product.
+        """
+        key = json.dumps([tree_hash, env, env_fingerprint, commands] + ([dependencies] if dependencies else []),
+                         sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def load(cls, key):
+        """ Returns the stored result for the key, or None if there is none or it has expired """
+        max_age = (config.test.result_cache_days or 0) * 86400
+
+        try:
+            with open(cache_path(RESULTS_DIR_NAME, key + '.json')) as fp:
+                result = cls(**json.load(fp))
+
+        except (IOError, OSError, ValueError, TypeError):
+            return None
+
+        if not result.time or result.time < time.time() - max_age:
+            return None
+
+        return result
+
+    def save(self, key):
+        """ Store the result for the key, and remove expired results """
+        results_dir = cache_path(RESULTS_DIR_NAME)
+        self.time = self.time or time.time()
+
+        try:
+            os.makedirs(results_dir, exist_ok=True)
+
+            with tempfile.NamedTemporaryFile('w', dir=results_dir, delete=False) as fp:
+                json.dump(self.__dict__, fp)
+            os.rename(fp.name, os.path.join(results_dir, key + '.json'))
+
+            expires = time.time() - (config.test.result_cache_days or 0) * 86400
+            for name in os.listdir(results_dir):
+                result_file = os.path.join(results_dir, name)
+                if os.stat(result_file).st_mtime < expires:
+                    os.unlink(result_file)
+
+        except (IOError, OSError) as e:
+            log.debug('Could not save test result: %s', e)
@@ -1,29 +1,217 @@
 from __future__ import absolute_import
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+import inspect
+import json
 import logging
 import os
+import random
 import re
+import shlex
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 
 import click
-import requests
 from utils.process import run, silent_run
 
 from workspace.config import config
-from workspace.utils import parent_path_with_dir, parent_path_with_file, shortest_id
+from workspace.utils import parent_path_with, parent_path_with_dir, parent_path_with_file, shortest_id
 
 
 log = logging.getLogger(__name__)
 
-REMOTE_BRANCH_RE = re.compile(r'^(\*)? *(\((?:HEAD detached at|no branch, rebasing) )?([^ )]+)\)? +\w+ +(?:\[(.+)/([^:\] ]+).*])?')
 DEFAULT_REMOTE = 'origin'
 UPSTREAM_REMOTE = 'upstream'
 USER_REPO_REFERENCE_RE = re.compile('^[\w-]+/[\w-]+$')
+SEARCH_NAME_RE = re.compile(r'^[\w-]+$')  # Single word product name to search for, such as requests
+GIT_SHA_RE = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+PREFETCH_MARKER_FILE = 'wst-prefetched'
+OBJECT_STORE_DIR = '.objects'  # Dir in the workspace for the shared object stores
+OBJECT_STORE_LOCK_TIMEOUT = 600  # Seconds to wait for another checkout / maintenance to finish updating a store
+RELEASE_INDEX_FILE = 'wst-releases.json'  # In the git dir to record releases by version
+RELEASE_TAG_RE = re.compile(r'^\d+(\.\d+)*$')  # Version tags written by tag_release, such as 1.0.2
+SHALLOW_DEEPEN_DEPTH = 100  # Number of commits to deepen a shallow repo by when looking for a merge base
+SHALLOW_LOG_DEPTH = 100  # Number of commits that a shallow repo is deepened to for commit_logs without a limit
+TRANSIENT_FETCH_ERROR_RE = re.compile(r'connection (reset|closed|refused|timed out)|timed out|early EOF|'
+                                      r'unexpected disconnect|hung up unexpectedly|rate limit|too many|'
+                                      r'temporary failure|HTTP (429|50\d)|error: (429|50\d)', re.IGNORECASE)
 
 
 class SCMError(Exception):
     """ SCM command failed """
 
 
+class QueryCache(object):
+    """
+    Memoizes scm queries, such as :func:`repo_path` and :func:`repo_state`, by repo and query args. Entries for a repo
+    are invalidated when it is changed by the helpers in this module. See :func:`query_cache` to enable it.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.pid = os.getpid()
+        self.generation = 0  # Incremented by invalidate() so results queried before it are not cached
+        self._lock = threading.Lock()
+
+    def get(self, key, query):
+        """
+        Returns the cached result for the key, or runs the query and caches its result.
+
+        :param tuple key: Name of the query, repo/path, and any query args.
+        :param callable query: Function that returns the query result
+        """
+        with self._lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+
+            self.misses += 1
+            generation = self.generation
+
+        result = query()  # Without the lock so that queries for other repos run at the same time
+
+        with self._lock:
+            if generation == self.generation:  # Not invalidated while querying
+                result = self.entries.setdefault(key, result)  # First result wins if queried at the same time
+
+        return result
+
+    def invalidate(self, repo=None):
+        """ Invalidate entries for the repo (and paths inside it), or all entries if repo is not given. """
+        with self._lock:
+            self.generation += 1
+
+            if repo:
+                for key in list(self.entries):
+                    if key[1] == repo or key[1].startswith(repo + os.sep):
+                        del self.entries[key]
+            else:
+                self.entries.clear()
+
+
+_query_cache = None
+
+
+@contextmanager
+def query_cache():
+    """
+    Enable memoization of scm queries within the block. Nested blocks share the cache of the outermost one, which logs
+    the hit / miss counts at debug level when done.
+    """
+    global _query_cache
+
+    if _query_cache and _query_cache.pid == os.getpid():
+        yield _query_cache
+        return
+
+    _query_cache = QueryCache()
+
+    try:
+        yield _query_cache
+
+    finally:
+        log.debug('SCM query cache: %s hits, %s misses', _query_cache.hits, _query_cache.misses)
+        _query_cache = None
+
+
+_warm_repo_states = None
+
+
+def keep_repo_states(states=None):
+    """
+    Keep the branches / remotes of repos read by :func:`repo_state` in this process (and processes forked from it)
+    between commands, such as in the wst daemon. A kept state is reused until its repo's HEAD, index, refs, or config
+    changes (see :func:`repo_stamp`), and its working tree status is always read again as edits do not change them.
+
+    :param dict states: Map of repo to (stamp, :class:`RepoState`) to start with
+    :return: The map of kept states, which is updated as repo states are read
+    """
+    global _warm_repo_states
+
+    _warm_repo_states = {} if states is None else states
+
+    return _warm_repo_states
+
+
+def repo_stamp(repo):
+    """
+    Returns the mtimes of the repo's HEAD, index, packed-refs, config, and ref dirs, which change whenever its branches,
+    remotes, or index change (refs are updated by renaming a lock file in their dir).
+    """
+    dot_git, common_dir = git_dir(repo), git_dir(repo, common=True)
+    if not dot_git:
+        return None
+
+    paths = [os.path.join(dot_git, 'HEAD'), os.path.join(dot_git, 'index'), os.path.join(common_dir, 'packed-refs'),
+             os.path.join(common_dir, 'config')]
+    paths.extend(sorted(root for root, _, _ in os.walk(os.path.join(common_dir, 'refs'))))
+
+    stamp = []
+    for path in paths:
+        try:
+            stamp.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            stamp.append((path, None))
+
+    return tuple(stamp)
+
+
+def _warm_repo_state(repo):
+    """ Returns the kept state of the repo if it is unchanged, otherwise a new state that is kept """
+    if _warm_repo_states is None:
+        return RepoState(repo)
+
+    stamp = repo_stamp(repo)  # Before the state is read, so any change while reading makes it stale next time
+    kept_stamp, state = _warm_repo_states.get(repo, (None, None))
+
+    if state and stamp and kept_stamp == stamp:
+        state._status = None  # Edits in the working tree do not change the stamp
+        return state
+
+    state = RepoState(repo)
+    _warm_repo_states[repo] = (stamp, state)
+
+    return state
+
+
+def _cached_query(key, query):
+    """ Returns the result of the query, which is cached by key when the query cache is enabled """
+    cache = _query_cache
+    return cache.get(key, query) if cache else query()
+
+
+def invalidates_query_cache(repo_arg=None):
+    """
+    Decorator for functions that change a repo to invalidate its cached queries afterwards.
+
+    :param str repo_arg: Name of the function arg for the path to the repo. Defaults to the current repo.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+
+            finally:
+                if _query_cache:
+                    path = signature.bind(*args, **kwargs).arguments.get(repo_arg) if repo_arg else None
+                    _query_cache.invalidate(parent_path_with_dir('.git', path=path))
+
+        return wrapper
+
+    return decorator
+
+
 def workspace_path():
     """ Guess the workspace path based on if we are in a repo or not. """
     repo_path = is_repo()
@@ -39,6 +227,8 @@ def commit_logs(limit=None, repo=None, diff=False, show_revision=None, extra_arg
         if not limit:
             limit = 1
 
+    ensure_history(repo, commits=limit or SHALLOW_LOG_DEPTH)  # Without fetching all history of a shallow repo
+
     cmd = ['git', 'log', '--decorate']
     if show_revision:
         cmd.extend(['-U', show_revision])
@@ -52,6 +242,7 @@ def commit_logs(limit=None, repo=None, diff=False, show_revision=None, extra_arg
     return run(cmd, return_output=not to_pager, shell=to_pager, cwd=repo)
 
 
+@invalidates_query_cache()
 def add_files(files=None):
     if files:
         files = ' '.join(files)
@@ -68,8 +259,131 @@ def repo_check():
         sys.exit(1)
 
 
+class Commit(namedtuple('Commit', 'sha parents author email date subject body refs')):
+    """
+    A commit from :func:`iter_commits`
+
+    :ivar str sha: Commit SHA
+    :ivar tuple parents: SHAs of the parent commits
+    :ivar str author: Author name
+    :ivar str email: Author email
+    :ivar datetime date: Author date (timezone aware)
+    :ivar str subject: First line of the commit message
+    :ivar str body: Rest of the commit message
+    :ivar list refs: Refs pointing at the commit, such as ['HEAD -> master', 'tag: 1.0.0', 'origin/master']
+    """
+    __slots__ = ()
+
+    @property
+    def message(self):
+        """ Full commit message """
+        return '{}\n\n{}'.format(self.subject, self.body) if self.body else self.subject
+
+
+#: Format of the commit fields in `git log` output for :func:`iter_commits`. Fields are separated by NUL, and so are
+#: the commits with -z.
+COMMIT_FORMAT = '%x00'.join(['%H', '%P', '%an', '%ae', '%ad', '%s', '%b', '%D'])
+#: Author date format (`git log --date=format:`) as understood by :meth:`datetime.strptime` on all Python versions
+COMMIT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S %z'
+
+
+def iter_commits(revision=None, repo=None, extra_args=None):
+    """
+    Yields :class:`Commit` for the commits in the history of the revision, newest first, as `git log` outputs them.
+
+    Commits are read from a pipe as the caller iterates, so no more of the log is read than needed and `git log` is
+    stopped when the caller stops iterating. The history of a shallow repo is deepened when the caller iterates past
+    what is available, which is when the history reaches a commit whose parents were cut off by the shallow clone, or
+    a revision in the range (such as the lower boundary of <sha>..HEAD) is not available yet.
+
+    :param str revision: Revision (or range) to show history for. Defaults to the current branch.
+    :param str repo: Path to repo. Defaults to current.
+    :param list extra_args: Extra args for `git log`, such as paths.
+    """
+    seen = set()
+    deepen_depth = SHALLOW_DEEPEN_DEPTH
+
+    while True:
+        cmd = (['git', 'log', '-z', '--format=' + COMMIT_FORMAT, '--date=format:' + COMMIT_DATE_FORMAT]
+               + ([revision] if revision else []) + (extra_args or []))
+
+        try:
+            for commit in _read_commits(cmd, repo):
+                if commit.sha not in seen:  # Otherwise, it was yielded before the history was deepened
+                    seen.add(commit.sha)
+                    yield commit
+
+        except SCMError:
+            if not (is_shallow(repo) and _missing_revisions(revision, repo)):
+                raise
+
+        else:
+            if not (is_shallow(repo) and _reaches_shallow_boundary(revision, repo)):
+                break
+
+        deepen(repo, deepen_depth if deepen_depth <= SHALLOW_DEEPEN_DEPTH * 8 else None)
+        deepen_depth *= 2
+
+
+def _missing_revisions(revision, repo=None):
+    """ True if any revision in the range (e.g. <sha>..HEAD) is not in the repo """
+    revisions = [r for r in re.split(r'\.{2,3}', (revision or 'HEAD').lstrip('^')) if r]
+    return not all(silent_run(['git', 'rev-parse', '--verify', '--quiet', r + '^{commit}'], cwd=repo,
+                              return_output=2)[1] for r in revisions)
+
+
+def _reaches_shallow_boundary(revision, repo=None):
+    """ True if the history of the revision (or range) includes a commit whose parents were cut off by a shallow clone """
+    try:
+        with open(os.path.join(git_dir(repo, common=True), 'shallow')) as fp:
+            shallow_commits = set(fp.read().split())
+
+    except (IOError, OSError, TypeError):
+        return False
+
+    output, success = silent_run(['git', 'rev-list', revision or 'HEAD'], cwd=repo, return_output=2)
+    return not success or bool(shallow_commits & set(output.split()))
+
+
+def _read_commits(cmd, repo=None):
+    """ Yields :class:`Commit` from the NUL-delimited `git log` output of the command """
+    field_count = len(Commit._fields)
+    log.debug('Running: %s %s', ' '.join(cmd), '[{}]'.format(repo) if repo else '')
+    process = subprocess.Popen(cmd, cwd=repo, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    try:
+        fields = []
+        remainder = b''
+
+        for chunk in iter(lambda: process.stdout.read(65536), b''):
+            values = (remainder + chunk).split(b'\0')
+            remainder = values.pop()
+
+            for value in values:
+                fields.append(value.decode('utf-8', 'replace'))
+
+                if len(fields) == field_count:
+                    sha, parents, author, email, date, subject, body, refs = fields
+                    yield Commit(sha.lstrip('\n'), tuple(parents.split()), author, email,
+                                 datetime.strptime(date, COMMIT_DATE_FORMAT), subject, body.strip(),
+                                 refs.split(', ') if refs else [])
+                    fields = []
+
+        if process.wait():
+            error = process.stderr.read().decode('utf-8', 'replace').strip()
+            if 'does not have any commits yet' not in error:
+                raise SCMError('Failed to read commit log: ' + error)
+
+    finally:
+        if process.poll() is None:  # Caller stopped iterating
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
 def extract_commit_msgs(output, is_git=True):
-    """ Returns a list of commit msgs from the given output. """
+    """ Returns a list of commit msgs from the given output. See :func:`iter_commits` for structured commits. """
     msgs = []
 
     if output:
@@ -102,7 +416,21 @@ def is_repo(path=None):
 
 def repo_path(path=None):
     """ Return the git repo path with .git by looking at current dir and its parent dirs. """
-    return parent_path_with_dir('.git', path=path)
+    return _cached_query(('repo_path', os.path.abspath(path or os.getcwd())),
+                         lambda: parent_path_with_dir('.git', path=path))
+
+
+def repo_state(path=None):
+    """
+    Returns the :class:`RepoState` of the given or current repo. When the query cache is enabled, the state is shared
+    until the repo is changed by the helpers in this module. See :func:`keep_repo_states` to keep it between commands.
+    """
+    repo = repo_path(path)
+
+    if not repo:
+        return RepoState(path)
+
+    return _cached_query(('repo_state', repo), lambda: _warm_repo_state(repo))
 
 
 def is_project(path=None):
@@ -121,22 +449,21 @@ def product_repos():
 
 
 def repos(dir=None):
-    """ Returns a list of repos either for the given directory or current directory or in sub-directories. """
-    repos = []
+    """
+    Returns a list of repos either for the given directory or current directory or in sub-directories.
+    Sub-directories are looked up from the workspace index (see :class:`workspace.index.WorkspaceIndex`).
+    """
+    from workspace.index import WorkspaceIndex
+
     cwd = dir or os.getcwd()
 
     if is_repo(cwd):
-        repos.append(repo_path(cwd))
-        return repos
+        return [repo_path(cwd)]
 
-    for dir in os.listdir(cwd):
-        path = os.path.join(cwd, dir)
-        if os.path.isdir(path) and is_repo(path):
-            repos.append(path)
-
-    return repos
+    return WorkspaceIndex(cwd).repos()
 
 
+@invalidates_query_cache('repo_path')
 def checkout_branch(branch, repo_path=None):
     """
     Checks out the branch in the given or current repo. Raises on error.
@@ -156,13 +483,15 @@ def checkout_branch(branch, repo_path=None):
     silent_run(cmd, cwd=repo_path)
 
     if name:
-        upstream_branch = '{}/{}'.format(upstream_remote(), name)
-        if 'remotes/{}'.format(upstream_branch) in all_branches(remotes=True):
-            silent_run('git branch --set-upstream-to {}'.format(upstream_branch))
+        state = repo_state(repo_path)
+        upstream_branch = '{}/{}'.format(state.upstream_remote, name)
+        if state.has_remote_branch(upstream_branch):
+            silent_run(['git', 'branch', '--set-upstream-to', upstream_branch], cwd=repo_path)
         else:
             click.echo('FYI Can not change upstream tracking branch to {} as it does not exist'.format(upstream_branch))
 
 
+@invalidates_query_cache()
 def create_branch(branch, from_branch=None):
     """ Creates a branch from the current branch. Raises on error """
     cmd = ['git', 'checkout', '-b', branch]
@@ -171,10 +500,13 @@ def create_branch(branch, from_branch=None):
     silent_run(cmd)
 
 
+@invalidates_query_cache('repo')
 def update_branch(repo=None, parent='master'):
+    ensure_history(repo, merge_base=(parent, 'HEAD'))
     silent_run('git rebase {}'.format(parent), cwd=repo)
 
 
+@invalidates_query_cache()
 def remove_branch(branch, raises=False, remote=False, force=False):
     """ Removes branch """
     run(['git', 'branch', '-D' if force else '-d', branch], raises=raises)
@@ -183,10 +515,12 @@ def remove_branch(branch, raises=False, remote=False, force=False):
         silent_run(['git', 'push', default_remote(), '--delete', branch], raises=raises)
 
 
+@invalidates_query_cache()
 def rename_branch(branch, new_branch):
     silent_run(['git', 'branch', '-m', branch, new_branch])
 
 
+@invalidates_query_cache()
 def merge_branch(branch, commit=None, squash=False, strategy=None):
     cmd = ['git', 'merge', branch]
     if squash:
@@ -195,48 +529,586 @@ def merge_branch(branch, commit=None, squash=False, strategy=None):
         cmd.append('--strategy=' + strategy)
     if commit:
         cmd.append(commit)
+    ensure_history(merge_base=(branch, 'HEAD'))
     silent_run(cmd)
 
 
 def diff_branch(right_branch, left_branch='master', path=None):
+    ensure_history(path, merge_base=(left_branch, right_branch))
     cmd = 'git log %s..%s' % (left_branch, right_branch)
 
     return run(cmd, cwd=path, return_output=True)
 
 
-def all_remotes(repo=None):
-    """ Return all remotes with default remote as the 1st """
-    remotes = _all_remotes(repo=repo)
-    if len(remotes) > 1:
-        default = default_remote(repo=repo, remotes=remotes)
-        return [default] + sorted(set(remotes) - set([default]))
+def is_shallow(path=None):
+    """ True if the repo is a shallow clone (history is truncated) """
+    try:
+        return os.path.getsize(os.path.join(git_dir(path, common=True) or '', 'shallow')) > 0
+    except OSError:
+        return False
+
+
+@invalidates_query_cache('path')
+def deepen(path=None, depth=None):
+    """
+    Fetch more history for a shallow repo from its upstream remote.
+
+    :param str path: Path to repo. Defaults to current.
+    :param int depth: Number of commits to deepen the history by. Defaults to all history (unshallow).
+    :raise SCMError: If the fetch failed
+    """
+    log.info('Fetching %s history of shallow repo %s', '{} more commits of'.format(depth) if depth else 'all',
+             product_name(repo_path(path)))
+    _run_or_raise(['git', 'fetch', '--deepen={}'.format(depth) if depth else '--unshallow', upstream_remote(path)],
+                  'Failed to fetch more history', cwd=path)
+
+
+def ensure_history(path=None, commits=None, merge_base=None):
+    """
+    Deepen the history of a shallow repo on demand so that history based commands (log, merge, rebase, etc) give the
+    right results. This does nothing for a repo with full history.
+
+    :param str path: Path to repo. Defaults to current.
+    :param int commits: Number of commits needed in the history of HEAD
+    :param tuple merge_base: Pair of revisions (e.g. branches to merge) that need their merge base in the history
+    :note: If neither commits nor merge_base is given, all history is fetched.
+    """
+    if not is_shallow(path):
+        return
+
+    if commits:
+        available = int(silent_run(['git', 'rev-list', '--count', 'HEAD'], cwd=path, return_output=True) or 0)
+        if available < commits:
+            deepen(path, commits - available)
+
+    elif merge_base:
+        depth = SHALLOW_DEEPEN_DEPTH
+        while not silent_run(['git', 'merge-base'] + list(merge_base), cwd=path, return_output=2)[1]:
+            if not is_shallow(path):
+                break
+
+            deepen(path, depth if depth <= SHALLOW_DEEPEN_DEPTH * 8 else None)
+            depth *= 2
+
     else:
-        return remotes
+        deepen(path)
+
+
+def working_tree_hash(path=None, object_dir=None, alternates=None):
+    """
+    Returns the git tree hash of the working tree, including modified and untracked (but not ignored) files, without
+    changing the index, so it is the same for the same content regardless of what is committed / staged.
+
+    The blobs / trees that the repo does not have are written to a temporary object dir (or the given one) instead of
+    the repo's object dir, so no loose objects are left in the repo. See :func:`objects_env`.
+
+    :param str path: Path to repo. Defaults to current.
+    :param str object_dir: Dir to keep the new objects in, such as to diff the tree later. Defaults to a temporary dir
+                           that is removed after the tree is hashed.
+    :param list alternates: Other object dirs to read objects from, besides the repo's.
+    :return: Tree hash, or None if it is not a repo or the tree could not be written.
+    """
+    dot_git = git_dir(path)
+    if not dot_git:
+        return None
+
+    index_file = os.path.join(dot_git, 'index')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_index = os.path.join(temp_dir, 'index')
+        if os.path.exists(index_file):
+            shutil.copyfile(index_file, temp_index)  # Reuse stat info so that unchanged files aren't hashed again
+        env = dict(objects_env(path, object_dir or os.path.join(temp_dir, 'objects'), alternates),
+                   GIT_INDEX_FILE=temp_index)
+
+        if not silent_run(['git', 'add', '--all'], cwd=repo_path(path), env=env):
+            return None
+
+        tree_hash, success = silent_run(['git', 'write-tree'], cwd=repo_path(path), env=env, return_output=2)
+
+    return tree_hash.strip() if success else None
+
+
+def objects_env(path, object_dir, alternates=None):
+    """
+    Returns the environment for git commands to write new objects to the object dir (created if needed) and read
+    existing objects from the repo's object dir (and the alternates), such as to diff trees from
+    :func:`working_tree_hash`.
+
+    :param str path: Path to repo
+    :param str object_dir: Dir to write new objects to
+    :param list alternates: Other object dirs to read objects from, besides the repo's.
+    """
+    os.makedirs(object_dir, exist_ok=True)
+    repo_objects = os.path.join(git_dir(path, common=True), 'objects')
+
+    return dict(os.environ, GIT_OBJECT_DIRECTORY=object_dir,
+                GIT_ALTERNATE_OBJECT_DIRECTORIES=os.pathsep.join([repo_objects] + (alternates or [])))
+
+
+class RepoState(object):
+    """
+    Snapshot of a repo's branches, remotes, and working tree status.
+
+    Branches / remote branches are read directly from the ref files (see :func:`read_refs`) or with one
+    `git for-each-ref` call for unusual layouts, remotes from the repo's git config file, and working tree status with
+    one `git status --porcelain=v2 --branch` call. Each is only read when one of its
+    attributes is first accessed, so create a new instance to get the latest state after making changes to the repo.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param str path: Path to the repo. Defaults to current repo.
+        """
+        self.path = path
+        self._refs = None
+        self._status = None
+        self._remotes = None
+        self._config = None
+
+    def _load_refs(self):
+        if self._refs is None:
+            refs = self._read_refs() or self._git_refs()
+            head, refs, tracking = refs
+
+            current = None
+            if head and head.startswith('ref: refs/heads/') and head[len('ref: '):] in refs:
+                current = head[len('ref: refs/heads/'):]
+
+            branches = []
+            remote_branches = []
+            shas = {}
+
+            for ref, value in sorted(refs.items()):
+                if ref.startswith('refs/heads/'):
+                    name = ref[len('refs/heads/'):]
+                    branches.append(name)
+                    shas[name] = value
+
+                elif ref.startswith('refs/remotes/'):
+                    name = ref[len('refs/remotes/'):]
+                    if value.startswith('ref: refs/remotes/'):
+                        name = '{} -> {}'.format(name, value[len('ref: refs/remotes/'):])
+                    else:
+                        shas['remotes/' + name] = value
+                    remote_branches.append(name)
+
+            self._refs = current, branches, tracking, remote_branches, shas, head
+
+        return self._refs
+
+    def _read_refs(self):
+        """ Read refs from files along with tracking branches from config, or return None if they can't be read. """
+        refs = read_refs(self.path)
+
+        if refs:
+            head, refs = refs
+            tracking = {}
+
+            for (section, branch), options in self._git_config().items():
+                remote, merge = options.get('remote'), options.get('merge', '')
+                if section == 'branch' and remote and remote != '.' and merge.startswith('refs/heads/'):
+                    tracking[branch] = '{}/{}'.format(remote, merge[len('refs/heads/'):])
+
+            return head, refs, tracking
+
+    def _git_refs(self):
+        """ Read refs and tracking branches with git, where HEAD is only known if it points to a branch. """
+        output = silent_run(['git', 'for-each-ref', '--format=%(HEAD)%00%(refname)%00%(upstream)%00%(symref)%00%(objectname)',
+                             'refs/heads', 'refs/remotes'], cwd=self.path, return_output=True)
+        head = None
+        refs = {}
+        tracking = {}
+
+        for line in output.split('\n'):
+            if line.count('\0') != 4:
+                continue
+
+            is_head, ref, upstream, symref, sha = line.split('\0')
+
+            refs[ref] = 'ref: ' + symref if symref else sha
+            if is_head == '*':
+                head = 'ref: ' + ref
+            if ref.startswith('refs/heads/') and upstream.startswith('refs/remotes/'):
+                tracking[ref[len('refs/heads/'):]] = upstream[len('refs/remotes/'):]
+
+        return head, refs, tracking
+
+    def _git_config(self):
+        if self._config is None:
+            self._config = git_config(self.path)
+        return self._config
+
+    def _load_status(self):
+        if self._status is None:
+            output = silent_run(['git', 'status', '--porcelain=v2', '--branch'], cwd=self.path, return_output=True)
+
+            status = {'head': None, 'branch': None, 'upstream': None, 'ahead': 0, 'behind': 0,
+                      'staged': 0, 'modified': 0, 'untracked': 0, 'conflicts': 0}
+
+            for line in output.split('\n'):
+                if line.startswith('# branch.oid '):
+                    oid = line.split()[-1]
+                    status['head'] = None if oid == '(initial)' else oid
+
+                elif line.startswith('# branch.head '):
+                    head = line.split()[-1]
+                    status['branch'] = None if head == '(detached)' else head
+
+                elif line.startswith('# branch.upstream '):
+                    status['upstream'] = line.split()[-1]
+
+                elif line.startswith('# branch.ab '):
+                    ahead, behind = line.split()[-2:]
+                    status['ahead'], status['behind'] = int(ahead), abs(int(behind))
+
+                elif line.startswith('1 ') or line.startswith('2 '):
+                    index_status, worktree_status = line[2], line[3]
+                    if index_status != '.':
+                        status['staged'] += 1
+                    if worktree_status != '.':
+                        status['modified'] += 1
+
+                elif line.startswith('u '):
+                    status['conflicts'] += 1
+
+                elif line.startswith('? '):
+                    status['untracked'] += 1
+
+            self._status = status
+
+        return self._status
+
+    @property
+    def remotes(self):
+        """ All remotes with default remote as the 1st """
+        if self._remotes is None:
+            remotes = sorted(subsection for section, subsection in self._git_config() if section == 'remote' and subsection)
+
+            required_remotes = {
+                DEFAULT_REMOTE: 'Your fork of the upstream repo',
+                UPSTREAM_REMOTE: 'The upstream repo'
+            }
+            if len(remotes) >= 2 and not set(required_remotes).issubset(set(remotes)):
+                click.echo('Current remotes: {}'.format(' '.join(remotes)))
+                click.echo('Only the following remotes are required -- please set them up accordingly:')
+                for remote in required_remotes:
+                    click.echo('  {}: {}'.format(remote, required_remotes[remote]))
+                exit(1)
+
+            if len(remotes) > 1:
+                remotes = [DEFAULT_REMOTE] + sorted(set(remotes) - set([DEFAULT_REMOTE]))
+
+            self._remotes = remotes
+
+        return self._remotes
+
+    def remote_url(self, remote):
+        """ URL of the remote, with relative paths made absolute, or None if it is not set """
+        url = self._git_config().get(('remote', remote), {}).get('url')
+
+        if url and os.path.exists(os.path.join(self.path or os.getcwd(), url)):
+            url = os.path.abspath(os.path.join(self.path or os.getcwd(), url))
+
+        return url
+
+    @property
+    def default_remote(self):
+        """ Default remote to take action against, such as push """
+        if self.remotes:
+            return DEFAULT_REMOTE if len(self.remotes) > 1 else self.remotes[0]
+
+    @property
+    def upstream_remote(self):
+        """ Upstream remote to track against """
+        if self.remotes:
+            return UPSTREAM_REMOTE if len(self.remotes) > 1 else self.remotes[0]
+
+    @property
+    def current_branch(self):
+        """ Current branch, or "(HEAD detached at <sha>)" when HEAD is detached, or None if there are no branches. """
+        current, branches = self._load_refs()[:2]
+
+        if current:
+            return current
+
+        detached_head = self._detached_head()
+        if detached_head:
+            return '(HEAD detached at {})'.format(detached_head[:7])
+
+        return branches[0] if branches else None
+
+    @property
+    def detached(self):
+        """ True if HEAD is detached """
+        return bool(self._detached_head())
+
+    def _detached_head(self):
+        """ Commit sha of HEAD if it is detached, otherwise None """
+        current, _, _, _, _, head = self._load_refs()
+
+        if current:
+            return None
+
+        if head:
+            return None if head.startswith('ref:') else head
+
+        if self.head and not self._load_status()['branch']:
+            return self.head
+
+    def branches(self, remotes=False, verbose=False):
+        """
+        List of branches with the current branch as the 1st
+
+        :param bool remotes: Include remote branches in "remotes/<remote>/<branch>" format
+        :param bool verbose: Decorate branches: "<branch>^<remote>" when the branch tracks a remote other than its
+                             rightful one (upstream for parent branches, origin for child branches), or "<sha>*" when
+                             HEAD is detached.
+        """
+        current, local_branches, tracking, remote_branches = self._load_refs()[:4]
+        branches = []
+
+        detached_head = self._detached_head()
+        if detached_head:
+            branches.append(detached_head[:7] + '*' if verbose else self.current_branch)
+
+        all_remotes = self.remotes if verbose else []
+
+        for branch in local_branches:
+            name = branch
+
+            if verbose and branch in tracking:
+                remote = self._remote_of(tracking[branch])
+                if remote and all_remotes:
+                    # Rightful/tracking remote differs based on parent vs child branch:
+                    #   Parent branch = upstream remote
+                    #   Child branch = origin remote
+                    rightful_remote = (remote == self.upstream_remote and '@' not in branch or
+                                       remote == self.default_remote and '@' in branch)
+                    if not rightful_remote:
+                        name = '{}^{}'.format(branch, shortest_id(remote, list(all_remotes)))
+
+            if branch == current:
+                branches.insert(0, name)
+            else:
+                branches.append(name)
+
+        if remotes:
+            branches.extend('remotes/' + b for b in remote_branches)
+
+        return branches
+
+    def _remote_of(self, remote_branch):
+        """ Returns the remote of the remote branch (remote/branch) """
+        for remote in sorted(self.remotes, key=len, reverse=True):
+            if remote_branch.startswith(remote + '/'):
+                return remote
+
+        return remote_branch.split('/')[0]
+
+    def has_remote_branch(self, remote_branch):
+        """ True if the remote branch (remote/branch) exists """
+        return 'remotes/' + remote_branch in self._load_refs()[4]
+
+    def tracking_branch(self, branch=None):
+        """
+        Remote tracking branch (remote/branch) for the given or current branch, or None if it isn't tracking a remote.
+        """
+        current, _, tracking = self._load_refs()[:3]
+        return tracking.get(branch or current)
+
+    def sha(self, branch):
+        """ Commit sha of the branch or remote branch (remotes/<remote>/<branch>), or None if it does not exist """
+        return self._load_refs()[4].get(branch)
+
+    @property
+    def head(self):
+        """ Commit sha of HEAD, or None if there are no commits. """
+        current, _, _, _, shas, head = self._load_refs()
+
+        if current:
+            return shas[current]
+
+        if head:
+            return None if head.startswith('ref:') else head
+
+        return self._load_status()['head']
+
+    @property
+    def upstream(self):
+        """ Upstream (remote tracking) branch of the current branch """
+        return self._load_status()['upstream']
+
+    @property
+    def ahead(self):
+        """ Number of commits the current branch is ahead of its upstream """
+        return self._load_status()['ahead']
+
+    @property
+    def behind(self):
+        """ Number of commits the current branch is behind its upstream """
+        return self._load_status()['behind']
+
+    @property
+    def staged(self):
+        """ Number of files with staged changes """
+        return self._load_status()['staged']
+
+    @property
+    def modified(self):
+        """ Number of files with unstaged changes """
+        return self._load_status()['modified']
+
+    @property
+    def untracked(self):
+        """ Number of untracked files / dirs """
+        return self._load_status()['untracked']
+
+    @property
+    def conflicts(self):
+        """ Number of files with merge conflicts """
+        return self._load_status()['conflicts']
+
+    @property
+    def dirty(self):
+        """ True if there are any changes in the working tree, including untracked files """
+        return bool(self.staged or self.modified or self.untracked or self.conflicts)
+
+
+def git_dir(path=None, common=False):
+    """
+    Returns the .git dir of the given or current repo, or None if it is not a repo.
+
+    :param str path: Path to repo or a dir in it
+    :param bool common: For worktrees, return the common dir shared by all worktrees (where config and refs are),
+                        instead of the worktree's own dir (where HEAD and index are).
+    """
+    repo = parent_path_with(lambda p: os.path.exists(os.path.join(p, '.git')), path=path)
+    if not repo:
+        return None
+
+    dot_git = os.path.join(repo, '.git')
+
+    if os.path.isfile(dot_git):  # Worktree / submodule
+        with open(dot_git) as fp:
+            content = fp.read().strip()
+        if not content.startswith('gitdir:'):
+            return None
+        dot_git = os.path.normpath(os.path.join(repo, content[len('gitdir:'):].strip()))
+
+        commondir_file = os.path.join(dot_git, 'commondir')
+        if common and os.path.exists(commondir_file):
+            with open(commondir_file) as fp:
+                dot_git = os.path.normpath(os.path.join(dot_git, fp.read().strip()))
+
+    return dot_git
+
+
+def read_refs(path=None):
+    """
+    Reads HEAD, branches, and remote branches directly from the files in the .git dir of the given or current repo, which
+    is a lot faster than running git for repos that are checked out in the usual way.
+
+    :param str path: Path to repo or a dir in it
+    :return: Tuple of HEAD ("ref: <ref>" or commit sha) and dict of ref name to commit sha (or "ref: <ref>" for
+             symbolic refs), or None if the refs can not be read from files (e.g. unusual layouts like reftable),
+             in which case git should be used instead.
+    """
+    if 'GIT_DIR' in os.environ:
+        return None
+
+    worktree_dir = git_dir(path)
+    common_dir = git_dir(path, common=True)
+
+    if (not worktree_dir or not os.path.isdir(os.path.join(common_dir, 'refs')) or
+            os.path.exists(os.path.join(common_dir, 'reftable'))):
+        return None
+
+    try:
+        with open(os.path.join(worktree_dir, 'HEAD')) as fp:
+            head = fp.read().strip()
+
+        if not (head.startswith('ref: refs/') or GIT_SHA_RE.match(head)):
+            return None
+
+        refs = {}
+        packed_refs_file = os.path.join(common_dir, 'packed-refs')
+
+        if os.path.exists(packed_refs_file):
+            with open(packed_refs_file) as fp:
+                for line in fp:
+                    if line.startswith(('#', '^')):
+                        continue
+                    sha, _, ref = line.strip().partition(' ')
+                    if ref.startswith(('refs/heads/', 'refs/remotes/')):
+                        refs[ref] = sha
+
+        for refs_dir in ('refs/heads', 'refs/remotes'):
+            for dirpath, _, files in os.walk(os.path.join(common_dir, refs_dir)):
+                for name in files:
+                    if name.endswith('.lock'):
+                        continue
+
+                    ref_file = os.path.join(dirpath, name)
+                    with open(ref_file) as fp:
+                        value = fp.read().strip()
+
+                    if value:
+                        refs[os.path.relpath(ref_file, common_dir).replace(os.sep, '/')] = value
+
+    except (IOError, OSError, UnicodeDecodeError) as e:
+        log.debug('Could not read refs from %s: %s', common_dir, e)
+        return None
+
+    return head, refs
+
+
+GIT_CONFIG_SECTION_RE = re.compile(r'^\s*\[\s*([\w.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*(.*)$')
+GIT_CONFIG_KEY_RE = re.compile(r'^\s*([\w-]+)\s*(?:=\s*(.*?))?\s*$')
+
+
+def git_config(path=None):
+    """
+    Returns a dict of (section, subsection) to dict of key to value from the repo's config file. Section names and keys
+    are lowercased, and subsection is None if there is none. Includes, inline comments, and value escapes are not
+    supported, so use `git config` for anything other than simple values, like remote names.
+
+    :param str path: Path to repo or a dir in it
+    """
+    config_file = os.path.join(git_dir(path, common=True) or '', 'config')
+    sections = {}
+
+    if not os.path.exists(config_file):
+        return sections
+
+    section = None
+
+    with open(config_file) as fp:
+        for line in fp:
+            if line.lstrip().startswith(('#', ';')):
+                continue
 
+            match = GIT_CONFIG_SECTION_RE.match(line)
 
-def _all_remotes(repo=None):
-    """ Returns all remotes. """
-    remotes_output = silent_run('git remote', cwd=repo, return_output=True)
-    remotes = []
+            if match:
+                name, subsection, line = match.groups()
+                if '.' in name and subsection is None:  # Legacy [section.subsection] format
+                    name, subsection = name.split('.', 1)
+                section = sections.setdefault((name.lower(), subsection), {})
 
-    if remotes_output:
-        for remote in remotes_output.split('\n'):
-            if remote:
-                remote = remote.strip()
-                remotes.append(remote)
+            match = section is not None and GIT_CONFIG_KEY_RE.match(line)
 
-    required_remotes = {
-        DEFAULT_REMOTE: 'Your fork of the upstream repo',
-        'upstream': 'The upstream repo'
-    }
-    if len(remotes) >= 2 and not set(required_remotes).issubset(set(remotes)):
-        click.echo('Current remotes: {}'.format(' '.join(remotes)))
-        click.echo('Only the following remotes are required -- please set them up accordingly:')
-        for remote in required_remotes:
-            click.echo('  {}: {}'.format(remote, required_remotes[remote]))
-        exit(1)
+            if match:
+                key, value = match.groups()
+                value = value.strip('"') if value is not None else 'true'
+                section[key.lower()] = value
 
-    return remotes
+    return sections
+
+
+def all_remotes(repo=None):
+    """ Return all remotes with default remote as the 1st """
+    return repo_state(repo).remotes
 
 
 def default_remote(repo=None, remotes=None):
@@ -258,61 +1130,68 @@ def upstream_remote(repo=None, remotes=None):
             return remotes[0]
 
 
-def remote_tracking_branch(repo=None):
-    remote_output = silent_run('git rev-parse --abbrev-ref --symbolic-full-name @{u}', cwd=repo, return_output=True)
+def remote_host(repo=None):
+    """ Returns the host of the default remote's URL (e.g. github.com), or None if there is no remote or it is local """
+    remotes = all_remotes(repo)
+    if remotes:
+        return url_host(git_config(repo).get(('remote', default_remote(remotes=remotes)), {}).get('url'))
+
 
-    if 'no upstream' in remote_output:
+def url_host(url):
+    """ Returns the host of the git URL (ssh://, https://, or scp-like user@host:path), or None for local paths """
+    if not url:
         return None
-    else:
-        return remote_output
 
+    if '://' in url:
+        from urllib.parse import urlsplit
+        return urlsplit(url).hostname
 
-def all_branches(repo=None, remotes=False, verbose=False):
-    """ Returns all branches. The first element is the current branch. """
-    cmd = ['git', 'branch']
-    if remotes:
-        cmd.append('--all')
-    if verbose:
-        cmd.append('-vv')
-
-    branch_output = silent_run(cmd, cwd=repo, return_output=True)
-    branches = []
-    remotes = all_remotes(repo=repo)
-    up_remote = remotes and upstream_remote(repo=repo, remotes=remotes)
-    def_remote = remotes and default_remote(repo=repo, remotes=remotes)
-
-    if branch_output:
-        for branch in branch_output.split('\n'):
-            branch = branch.strip()
-            if branch:
-                if verbose:
-                    star, detached, local_branch, remote, branch = REMOTE_BRANCH_RE.search(branch).groups()
-                    if remote and remotes:
-                        # Rightful/tracking remote differs based on parent vs child branch:
-                        #   Parent branch = upstream remote
-                        #   Child branch = origin remote
-                        rightful_remote = (remote == up_remote and '@' not in local_branch or
-                                           remote == def_remote and '@' in local_branch)
-                        branch = local_branch if rightful_remote else '{}^{}'.format(local_branch, shortest_id(remote, remotes))
-
-                    elif detached:
-                        branch = local_branch + '*'
+    match = re.match(r'^(?:[^@/]+@)?(\[[^\]/]+\]|[^:/]+):', url)  # No slash before the colon (otherwise a path)
+    if match:
+        return match.group(1).strip('[]')
 
-                    else:
-                        branch = local_branch
 
-                    if star:
-                        branches.insert(0, branch)
-                    else:
-                        branches.append(branch)
+@contextmanager
+def ssh_multiplexing():
+    """
+    Share one SSH connection per host between the git commands run within the context, such as fetches for many repos
+    from the same git host, by using an SSH ControlMaster with its control socket in a temp dir. The master connections
+    are closed on exit.
 
-                else:
-                    if branch.startswith('*'):
-                        branches.insert(0, branch.strip('* '))
-                    else:
-                        branches.append(branch)
+    It is skipped if GIT_SSH_COMMAND / GIT_SSH or core.sshCommand is set as the SSH command is customized already.
+    """
+    if (os.environ.get('GIT_SSH_COMMAND') or os.environ.get('GIT_SSH')
+            or silent_run('git config --get core.sshCommand', return_output=2)[1]):
+        yield
+        return
+
+    control_dir = tempfile.mkdtemp(prefix='wst-ssh-')
+    os.environ['GIT_SSH_COMMAND'] = ('ssh -o ControlMaster=auto -o ControlPath={} -o ControlPersist=60'
+                                     .format(shlex.quote(os.path.join(control_dir, '%C'))))
+
+    try:
+        yield
+
+    finally:
+        del os.environ['GIT_SSH_COMMAND']
 
-    return branches
+        for name in os.listdir(control_dir):
+            try:
+                silent_run(['ssh', '-O', 'exit', '-o', 'ControlPath=' + os.path.join(control_dir, name), 'wst'])
+            except Exception as e:
+                log.debug('Could not close SSH master connection: %s', e)
+
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+
+def remote_tracking_branch(repo=None):
+    """ Remote tracking branch (remote/branch) of the current branch, or None if there is none. """
+    return repo_state(repo).tracking_branch()
+
+
+def all_branches(repo=None, remotes=False, verbose=False):
+    """ Returns all branches. The first element is the current branch. See :meth:`RepoState.branches` """
+    return repo_state(repo).branches(remotes=remotes, verbose=verbose)
 
 
 def master_branch(repo=None):
@@ -323,8 +1202,7 @@ def master_branch(repo=None):
 
 
 def current_branch(repo=None):
-    branches = all_branches(repo)
-    return branches[0] if branches else None
+    return repo_state(repo).current_branch
 
 
 def parent_branch(branch):
@@ -334,46 +1212,296 @@ def parent_branch(branch):
         return parent
 
 
-def update_repo(path=None, quiet=False):
-    """ Updates given or current repo to HEAD """
-    if not remote_tracking_branch(repo=path):
+@invalidates_query_cache('path')
+def update_repo(path=None, quiet=False, branch=None, retries=0, retry_delay=1, prefetched_within=None):
+    """
+    Updates the current or given branch of the given or current repo from its remotes.
+
+    All remotes are fetched with one `git fetch --multiple` call, and then the branch is fast-forwarded locally to its
+    remote branch on each remote (if it exists), so there is no network round trip after the fetch.
+
+    :param str path: Path to repo. Defaults to current.
+    :param bool quiet: Don't print progress
+    :param str branch: Branch to update. Defaults to the current branch. Other branches are updated without checking
+                       them out.
+    :param int retries: Number of times to fetch again from remotes that failed with a transient error, such as a
+                        dropped connection or rate limit.
+    :param float retry_delay: Seconds to wait before the first retry. It is doubled (with jitter) for each retry after.
+    :param float prefetched_within: Skip the fetch if the repo was prefetched (see :func:`prefetch_repo`) within the
+                                    given seconds, so the branch is only fast-forwarded locally.
+    :return: Number of retries made
+    :raise SCMError: If fetch or fast-forward failed for any remote
+    """
+    state = repo_state(path)
+    current = state.current_branch
+    branch = branch or current
+
+    if not state.tracking_branch(branch):
         if not quiet:
             click.echo('Did not update as remote tracking is not setup for branch')
-        return
-
-    branch = current_branch(repo=path)
+        return 0
 
     if not quiet:
         click.echo('Updating ' + branch)
 
-    remotes = all_remotes(repo=path)
+    remotes = state.remotes
+
+    if prefetched_within and _prefetched_since(time.time() - prefetched_within, path):
+        fetch_errors, retried = {}, 0
+    else:
+        fetch_errors, retried = fetch_repo(path, retries=retries, retry_delay=retry_delay)
+
     failed_remotes = []
 
     for remote in remotes:
         if len(remotes) > 1 and not quiet:
             click.echo('    ... from ' + remote)
-        output, success = silent_run('git pull --ff-only --tags {} {}'.format(remote, branch), cwd=path, return_output=2)
-        if not success:
-            error_match = re.search(r'(?:fatal|ERROR): (.+)', output)
-            error = error_match.group(1) if error_match else output
+
+        error = fetch_errors.get(remote) or _fast_forward(branch, remote, current, path=path)
+        if error:
             click.echo('    ...   ' + error.strip(' .'))
             failed_remotes.append(remote)
 
     if failed_remotes:
         raise SCMError('Failed to pull from remote(s): {}'.format(', '.join(failed_remotes)))
 
+    return retried
+
+
+def remote_branches_changed(path=None, branch=None, prefetched_within=None):
+    """
+    Checks if the remote branches or tags have moved since the last fetch, or the branch has not been updated to them,
+    by comparing the branches and tags advertised by `git ls-remote` with the local remote tracking branches and tags.
+    This is a lot cheaper than a fetch as no objects are negotiated or transferred.
+
+    Only the remote branches tracked by local branches (and the given branch) are compared as the others are not
+    updated. The advertisement of a remote URL is only listed once when the query cache is enabled (see
+    :func:`query_cache`), so repos that share a remote do not list it again.
+
+    :param str path: Path to repo. Defaults to current.
+    :param str branch: Branch that would be updated. Defaults to the current branch.
+    :param float prefetched_within: Only compare with the local remote tracking branches if the repo was prefetched
+                                    within the given seconds.
+    :return: True if there are changes to update or it could not be checked, otherwise False.
+    """
+    state = RepoState(path)
+    branch = branch or state.current_branch
+    prefetched = prefetched_within and _prefetched_since(time.time() - prefetched_within, path)
+
+    if not state.tracking_branch(branch):
+        return True
+
+    tracked = [state.tracking_branch(b) for b in state.branches()]
+    tags = None
+
+    for remote in state.remotes:
+        if not prefetched:  # Otherwise, remote tracking branches are recent enough
+            advertised = _remote_refs(remote, state.remote_url(remote), path)
+            if advertised is None:
+                return True
+
+            names = set([branch] + [t[len(remote) + 1:] for t in tracked if t and state._remote_of(t) == remote])
+            for name in names:
+                sha = advertised.get('refs/heads/' + name)
+                if sha and state.sha('remotes/{}/{}'.format(remote, name)) != sha:
+                    return True
+
+            if tags is None:
+                tags = _local_tags(path)
+            for ref, sha in advertised.items():
+                if ref.startswith('refs/tags/') and tags.get(ref) != sha:
+                    return True
+
+        remote_sha = state.sha('remotes/{}/{}'.format(remote, branch))
+        if (remote_sha and remote_sha != state.sha(branch) and
+                not silent_run(['git', 'merge-base', '--is-ancestor', remote_sha, branch], cwd=path,
+                               return_output=2)[1]):  # Local branch is not ahead of the remote branch
+            return True
+
+    return False
+
+
+def _remote_refs(remote, url, path=None):
+    """
+    Returns a dict of ref to sha for the branches and tags (not peeled) advertised by the remote, or None if they could
+    not be listed. The result is cached by the remote's URL.
+    """
+    def ls_remote():
+        output, success = silent_run(['git', 'ls-remote', '--heads', '--tags', remote], cwd=path, return_output=2)
+        if not success:
+            return None
+
+        refs = {}
+        for line in output.split('\n'):
+            if '\t' in line and not line.endswith('^{}'):
+                sha, ref = line.split('\t')
+                refs[ref] = sha.strip()
+
+        return refs
+
+    return _cached_query(('ls-remote', url), ls_remote) if url else ls_remote()
+
+
+def _local_tags(path=None):
+    """ Returns a dict of tag ref to sha (not peeled) of the tags in the repo """
+    output = silent_run(['git', 'for-each-ref', '--format=%(objectname) %(refname)', 'refs/tags'], cwd=path,
+                        return_output=True)
+    return dict(reversed(line.split(' ', 1)) for line in output.split('\n') if ' ' in line)
+
+
+def fetch_repo(path=None, retries=0, retry_delay=1):
+    """
+    Fetch branches and tags from all remotes of the repo, and retry remotes that failed with a transient error.
+
+    :param str path: Path to repo. Defaults to current.
+    :param int retries: Number of times to fetch again from remotes that failed with a transient error, such as a
+                        dropped connection or rate limit.
+    :param float retry_delay: Seconds to wait before the first retry. It is doubled (with jitter) for each retry after.
+    :return: Tuple of (dict of remote to error message for the remotes that failed to fetch, number of retries made)
+    """
+    remotes = repo_state(path).remotes
+    fetch_errors = fetch_remotes(remotes, path=path)
+    retried = 0
+
+    while retried < retries:
+        retry_remotes = [remote for remote in remotes
+                         if remote in fetch_errors and TRANSIENT_FETCH_ERROR_RE.search(fetch_errors[remote])]
+        if not retry_remotes:
+            break
+
+        delay = retry_delay * 2 ** retried * random.uniform(1, 1.5)
+        retried += 1
+        log.debug('Retrying fetch from %s in %.1f seconds: %s', ', '.join(retry_remotes), delay,
+                  fetch_errors[retry_remotes[0]])
+        time.sleep(delay)
+
+        for remote in retry_remotes:
+            del fetch_errors[remote]
+        fetch_errors.update(fetch_remotes(retry_remotes, path=path))
+
+    return fetch_errors, retried
+
+
+@invalidates_query_cache('path')
+def prefetch_repo(path=None, retries=0, retry_delay=1):
+    """
+    Fetch all remotes of the repo without touching its branches or working tree, so that a later update only needs to
+    fast-forward / rebase locally (see `prefetched_within` for :func:`update_repo`). The time of the last successful
+    prefetch is kept in a marker file in the git dir.
+
+    :param str path: Path to repo. Defaults to current.
+    :param int retries: Number of times to retry remotes that failed with a transient error.
+    :param float retry_delay: Seconds to wait before the first retry.
+    :return: Dict of remote to error message for the remotes that failed to fetch
+    """
+    start_time = time.time()
+    fetch_errors, _ = fetch_repo(path, retries=retries, retry_delay=retry_delay)
+
+    if not fetch_errors:
+        marker_file = os.path.join(git_dir(path, common=True), PREFETCH_MARKER_FILE)
+        with open(marker_file, 'w'):
+            pass
+        os.utime(marker_file, (start_time, start_time))  # Remote changes after the fetch started are not included
+
+    return fetch_errors
+
 
+def _prefetched_since(since, path=None):
+    """ True if the repo was prefetched successfully since the given time """
+    try:
+        return os.stat(os.path.join(git_dir(path, common=True) or '', PREFETCH_MARKER_FILE)).st_mtime >= since
+    except OSError:
+        return False
+
+
+def fetch_remotes(remotes, path=None, tags=True):
+    """
+    Fetch branches and tags from the remotes with one `git fetch --multiple` call, in parallel.
+
+    :param list remotes: Remotes to fetch
+    :param str path: Path to repo. Defaults to current.
+    :param bool tags: Fetch all tags too
+    :return: Dict of remote to error message for the remotes that failed to fetch
+    """
+    output, success = silent_run(['git', 'fetch', '--multiple', '--tags' if tags else '--no-tags',
+                                  '--jobs={}'.format(len(remotes))] + remotes, cwd=path, return_output=2)
+    if success:
+        return {}
+
+    errors = {}
+    remote_errors = []
+
+    for line in output.split('\n'):
+        failed_match = re.search(r"could not fetch '?([^' ]+)'?", line, flags=re.I)  # "Could not" in older git
+        error_match = re.match(r'(?:fatal|error|ERROR|ssh|kex_exchange_identification): (.+)', line)
+
+        if failed_match:  # Comes after the output (errors) for the remote
+            errors[failed_match.group(1)] = remote_errors[0] if remote_errors else line
+            remote_errors = []
+
+        elif error_match:
+            remote_errors.append(error_match.group(1))
+
+    if not errors and len(remotes) > 1:  # Failed remotes can't be told from the output, so fetch them one at a time
+        for remote in remotes:
+            errors.update(fetch_remotes([remote], path=path, tags=tags))
+
+    elif not errors:
+        error = remote_errors[0] if remote_errors else output
+        errors = dict((remote, error) for remote in remotes)
+
+    return errors
+
+
+def _fast_forward(branch, remote, current=None, path=None):
+    """
+    Fast-forward the branch to its remote branch on the remote locally.
+
+    :param str branch: Branch to fast-forward
+    :param str remote: Remote of the remote branch
+    :param str current: Current branch. It is fast-forwarded with a merge to update the working tree, while other
+                        branches are updated by changing their ref only.
+    :param str path: Path to repo. Defaults to current.
+    :return: Error message on failure, otherwise None
+    """
+    state = RepoState(path)  # Refs changed by fetch / previous fast-forward
+    local_sha = state.sha(branch)
+    remote_sha = state.sha('remotes/{}/{}'.format(remote, branch))
+
+    if not remote_sha:
+        return "couldn't find remote ref " + branch
+
+    if local_sha == remote_sha:
+        return None
+
+    if branch == current:
+        output, success = silent_run(['git', 'merge', '--ff-only', '--quiet', 'refs/remotes/{}/{}'.format(remote, branch)],
+                                     cwd=path, return_output=2)
+        if not success:
+            error_match = re.search(r'(?:fatal|error|ERROR): (.+)', output)
+            return error_match.group(1) if error_match else output
+
+    elif silent_run(['git', 'merge-base', '--is-ancestor', local_sha, remote_sha], cwd=path, return_output=2)[1]:
+        silent_run(['git', 'update-ref', '-m', 'update: fast-forward to {}/{}'.format(remote, branch),
+                    'refs/heads/' + branch, remote_sha, local_sha], cwd=path)
+
+    elif not silent_run(['git', 'merge-base', '--is-ancestor', remote_sha, local_sha], cwd=path, return_output=2)[1]:
+        return 'Not possible to fast-forward, aborting'
+
+
+@invalidates_query_cache('path')
 def update_tags(remote, path=None):
     silent_run('git fetch --tags {}'.format(remote), cwd=path)
 
 
+@invalidates_query_cache('path')
 def push_repo(path=None, force=False, remote=None, branch=None):
     push_opts = []
 
     if force:
         push_opts.append('--force')
 
-    if not remote_tracking_branch(repo=path):
+    if not repo_state(path).tracking_branch():
         push_opts.append('--set-upstream ' + remote)
     elif remote:
         push_opts.append(remote)
@@ -384,6 +1512,105 @@ def push_repo(path=None, force=False, remote=None, branch=None):
     silent_run('git push ' + ' '.join(push_opts), cwd=path)
 
 
+@invalidates_query_cache('path')
+def tag_release(version, commit='HEAD', msg=None, path=None):
+    """
+    Records the release of the version at the commit with an annotated tag and in the release index.
+
+    :param str version: Version that was released
+    :param str commit: Commit of the release
+    :param str msg: Message for the tag. Defaults to the version.
+    :param str path: Path to repo. Defaults to current.
+    """
+    silent_run(['git', 'tag', '-a', version, '-m', msg or version, commit], cwd=path)
+    sha = silent_run(['git', 'rev-parse', commit], cwd=path, return_output=True).strip()
+    _record_release(version, sha, path)
+
+
+def push_tag(tag, remotes=None, path=None):
+    """ Push the tag to the remotes, or the default remote. Returns a list of remotes that failed. """
+    failed = []
+
+    for remote in remotes or [default_remote(path)]:
+        output, success = silent_run(['git', 'push', remote, 'refs/tags/' + tag], cwd=path, return_output=2)
+        if not success:
+            log.warning('Failed to push tag %s to %s: %s', tag, remote, output.strip())
+            failed.append(remote)
+
+    return failed
+
+
+def last_release(path=None, revision=None, msg_prefix=None):
+    """
+    Finds the latest release in the history of the revision from (in order): the release tags merged into the revision,
+    the release index, or the last commit whose message starts with the prefix. A release found by message is recorded
+    in the release index so that the history is only searched once.
+
+    Only tags in the format that :func:`tag_release` writes are releases, which are annotated tags named after the
+    version (and with the message prefix followed by the version when given), so that other tags that look like
+    versions, such as those from upstream merges, are not mistaken for releases.
+
+    :param str path: Path to repo. Defaults to current.
+    :param str revision: Revision whose history to look in. Defaults to the current branch.
+    :param str msg_prefix: Prefix of the commit / tag message that records a release and is followed by the version,
+                           such as "Publish version "
+    :return: Tuple of (version, commit sha) or (None, None) if there is no release
+    """
+    output, success = silent_run(['git', 'for-each-ref', '--merged', revision or 'HEAD', '--sort=-v:refname',
+                                  '--format=%(refname:strip=2)%00%(*objectname)%00%(contents:subject)', 'refs/tags'],
+                                 cwd=path, return_output=2)
+    for line in output.splitlines() if success else []:
+        if line.count('\0') != 2:
+            continue
+
+        tag, commit, subject = line.split('\0')
+        if RELEASE_TAG_RE.match(tag) and commit and (not msg_prefix or subject == msg_prefix + tag):
+            return tag, commit
+
+    for version, sha in sorted(release_index(path).items(), key=lambda r: _version_key(r[0]), reverse=True):
+        if silent_run(['git', 'merge-base', '--is-ancestor', sha, revision or 'HEAD'], cwd=path, return_output=2)[1]:
+            return version, sha
+
+    if msg_prefix:
+        for commit in iter_commits(revision, repo=path,
+                                   extra_args=['--fixed-strings', '--grep', msg_prefix]):
+            if commit.message.startswith(msg_prefix):
+                version = commit.subject[len(msg_prefix):].strip()
+                _record_release(version, commit.sha, path)
+                return version, commit.sha
+
+    return None, None
+
+
+def release_index(path=None):
+    """ Returns a dict of version to commit sha from the release index of the repo """
+    try:
+        with open(os.path.join(git_dir(path, common=True), RELEASE_INDEX_FILE)) as fp:
+            return json.load(fp)
+
+    except (IOError, OSError, TypeError, ValueError):
+        return {}
+
+
+def _record_release(version, sha, path=None):
+    releases = release_index(path)
+    releases[version] = sha
+
+    try:
+        index_file = os.path.join(git_dir(path, common=True), RELEASE_INDEX_FILE)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(index_file), delete=False) as fp:
+            json.dump(releases, fp, indent=2, sort_keys=True)
+        os.rename(fp.name, index_file)
+
+    except (IOError, OSError) as e:
+        log.debug('Could not save release index: %s', e)
+
+
+def _version_key(version):
+    """ Sort key for versions, such as 1.10.0 being newer than 1.9.0 """
+    return [(0, int(part), '') if part.isdigit() else (-1, 0, part) for part in re.split(r'[.-]', version)]
+
+
 def stat_repo(path=None, return_output=False, with_color=False):
     if with_color:
         cmd = 'git -c color.status=always status'
@@ -406,12 +1633,14 @@ def diff_repo(path=None, branch=None, context=None, return_output=False, name_on
     return run(cmd, cwd=path, return_output=return_output)
 
 
+@invalidates_query_cache()
 def commit_changes(msg):
     """ Commits any modified or new files with given message. Raises on error """
     silent_run(['git', 'commit', '-am', msg])
     click.echo('Committed change.')
 
 
+@invalidates_query_cache()
 def local_commit(msg=None, amend=False, empty=False):
     cmd = ['git', 'commit']
     if amend:
@@ -423,52 +1652,205 @@ def local_commit(msg=None, amend=False, empty=False):
     run(cmd)
 
 
-def checkout_product(product_url, checkout_path):
-    """ Checks out the product from url. Raises on error """
-    product_url = product_url.strip('/')
+@invalidates_query_cache('checkout_path')
+def checkout_product(product_url, checkout_path, quiet=False, filter=None, depth=None, sparse_dirs=None,
+                     shared_objects=False):
+    """
+    Checks out the product from url, or updates it if it is checked out already.
+
+    :param str product_url: Git repo URL, user/repo reference, or a single word to search for the repo
+    :param str checkout_path: Path to checkout to
+    :param bool quiet: Don't print progress
+    :param str filter: Partial clone filter to fetch objects on demand, such as blob:none
+    :param int depth: Shallow clone with history truncated to the given number of commits (on all branches). See
+                      :func:`ensure_history` to deepen it later.
+    :param list sparse_dirs: Only checkout these dirs (and top level files) using a cone mode sparse checkout
+    :param bool shared_objects: Borrow objects from the shared object store for the product in the workspace (see
+                                :func:`update_object_store`) instead of downloading and storing all of them again.
+                                It is not used for partial or shallow clones.
+    :raise SCMError: If the repo could not be found, cloned, or updated
+    """
+    product_url = product_url.rstrip('/')
 
     prod_name = product_name(product_url)
 
     if os.path.exists(checkout_path):
         log.debug('%s is already checked out.', prod_name)
         checkout_branch('master', checkout_path)
-        return update_repo(checkout_path)
+        return update_repo(checkout_path, quiet=quiet)
 
-    if re.match('[\w-]+$', product_url):
-        try:
-            logging.getLogger('requests').setLevel(logging.WARN)
-            response = requests.get(config.checkout.search_api_url, params={'q': product_url}, timeout=10)
-            response.raise_for_status()
-            results = response.json()['items']
-            if not results:
-                log.error('No repo matching "%s" found.', product_url)
-                sys.exit(1)
-            product_url = results[0]['ssh_url']
-            click.echo('Using repo url ' + product_url)
+    if SEARCH_NAME_RE.match(product_url):
+        from workspace.search import search_repos
+
+        urls, errors = search_repos([product_url])
+        if errors:
+            raise SCMError(errors[product_url])
 
-        except Exception as e:
-            log.error('Could not find repo for %s using %s due to error: ', product_url,
-                      config.checkout.search_api_url, e)
-            sys.exit(1)
+        product_url = urls[product_url]
+        if not quiet:
+            click.echo('Using repo url ' + product_url)
 
     elif USER_REPO_REFERENCE_RE.match(product_url):
         product_url = config.checkout.user_repo_url % product_url
 
     is_origin = not config.checkout.origin_user or config.checkout.origin_user + '/' in product_url
     remote_name = DEFAULT_REMOTE if is_origin else UPSTREAM_REMOTE
-
-    silent_run(['git', 'clone', product_url, checkout_path, '--origin', remote_name])
-
+    origin_url = None
     if not is_origin:
         origin_url = re.sub(r'(\.com[:/])(\w+)(/)', r'\1{}\3'.format(config.checkout.origin_user), product_url)
-        silent_run(['git', 'remote', 'add', DEFAULT_REMOTE, origin_url], cwd=checkout_path)
+
+    cmd = ['git', 'clone', product_url, checkout_path, '--origin', remote_name]
+    if shared_objects and not (filter or depth):
+        store_path = object_store_path(product_url, os.path.dirname(os.path.abspath(checkout_path)))
+        try:
+            update_object_store(store_path, [product_url] + ([origin_url] if origin_url else []))
+            cmd.extend(['--reference-if-able', store_path])
+        except SCMError as e:
+            log.warning('Cloning %s without the shared object store as it could not be updated: %s', prod_name, e)
+    if filter:
+        cmd.append('--filter=' + filter)
+    if depth:
+        cmd.extend(['--depth={}'.format(depth), '--no-single-branch'])
+    if sparse_dirs:
+        cmd.append('--sparse')
+
+    _run_or_raise(cmd, 'Failed to clone ' + product_url)
+
+    if sparse_dirs:
+        _run_or_raise(['git', 'sparse-checkout', 'set', '--cone'] + list(sparse_dirs), 'Failed to set sparse checkout',
+                      cwd=checkout_path)
+
+    if origin_url:
+        _run_or_raise(['git', 'remote', 'add', DEFAULT_REMOTE, origin_url], 'Failed to add origin remote',
+                      cwd=checkout_path)
+
+
+def object_store_path(product_url, workspace_dir=None):
+    """ Path to the shared object store in the workspace for the product and its forks """
+    return os.path.join(workspace_dir or workspace_path(), OBJECT_STORE_DIR, product_name(product_url) + '.git')
+
+
+def object_stores(workspace_dir=None):
+    """ Returns a sorted list of paths to the shared object stores in the workspace """
+    stores_dir = os.path.join(workspace_dir or workspace_path(), OBJECT_STORE_DIR)
+    if not os.path.isdir(stores_dir):
+        return []
+
+    return [os.path.join(stores_dir, name) for name in sorted(os.listdir(stores_dir)) if name.endswith('.git')]
+
+
+def uses_object_store(repo, store_path):
+    """ True if the repo borrows objects from the object store (git alternates) """
+    alternates_file = os.path.join(git_dir(repo, common=True) or '', 'objects', 'info', 'alternates')
+    store_objects = os.path.realpath(os.path.join(store_path, 'objects'))
+
+    try:
+        with open(alternates_file) as fp:
+            return any(os.path.realpath(os.path.join(os.path.dirname(alternates_file), '..', line.strip())) ==
+                       store_objects for line in fp if line.strip())
+    except (IOError, OSError):
+        return False
+
+
+def update_object_store(store_path, urls=None):
+    """
+    Create the shared object store if it does not exist, and fetch branches into it from the given repo URLs (added as
+    remotes of the store) and its existing remotes.
+
+    Checkouts borrow objects from the store with git alternates, so the store must never drop objects: branches of
+    each URL are kept under its own remote namespace and are never pruned, and auto gc / pruning are disabled in the
+    store. Use :func:`repack_object_store` to repack it safely.
+
+    :param str store_path: Path to the object store (bare repo)
+    :param list urls: Repo URLs to fetch from in addition to the existing remotes
+    :raise SCMError: If the store could not be created or fetched, or it is locked by another update for too long
+    """
+    with _object_store_lock(store_path):
+        _update_object_store(store_path, urls)
+
+
+@contextmanager
+def _object_store_lock(store_path):
+    """
+    Lock the object store for updating, as parallel checkouts of the same product (or forks) share it. The lock is a
+    dir next to the store as creating a dir is atomic.
+    """
+    lock_path = store_path + '.lock'
+    start_time = time.time()
+
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+
+    while True:
+        try:
+            os.mkdir(lock_path)
+            break
+        except OSError:
+            if not os.path.isdir(lock_path):
+                raise
+            if time.time() - start_time > OBJECT_STORE_LOCK_TIMEOUT:
+                raise SCMError('Timed out waiting for another update of the object store to finish. If none is '
+                               'running, remove {} and try again.'.format(lock_path))
+            time.sleep(0.1)
+
+    try:
+        yield
+    finally:
+        os.rmdir(lock_path)
+
+
+def _update_object_store(store_path, urls=None):
+    """ Create / fetch the object store while it is locked. See :func:`update_object_store` """
+    if not os.path.isdir(store_path):
+        _run_or_raise(['git', 'init', '--bare', '--quiet', store_path], 'Failed to create object store')
+        for key, value in [('gc.auto', '0'), ('gc.pruneExpire', 'never'), ('core.logAllRefUpdates', 'false')]:
+            _run_or_raise(['git', 'config', key, value], 'Failed to configure object store', cwd=store_path)
+
+    output = silent_run(['git', 'config', '--get-regexp', r'^remote\..*\.url$'], cwd=store_path, return_output=True)
+    remotes = dict((key[len('remote.'):-len('.url')], url)
+                   for key, url in (line.split(' ', 1) for line in output.split('\n') if ' ' in line))
+
+    for url in urls or []:
+        url = os.path.abspath(url) if os.path.exists(url) else url
+        name = re.sub(r'[^\w.-]+', '-', url).strip('-.')
+        if name not in remotes:
+            _run_or_raise(['git', 'remote', 'add', '--no-tags', name, url], 'Failed to add remote ' + url,
+                          cwd=store_path)
+            remotes[name] = url
+
+    if remotes:
+        errors = fetch_remotes(sorted(remotes), path=store_path, tags=False)
+        if errors:
+            raise SCMError('Failed to fetch into object store from {}'.format(
+                ', '.join('{} ({})'.format(remote, error) for remote, error in sorted(errors.items()))))
+
+
+def repack_object_store(store_path):
+    """
+    Repack the objects in the shared object store into one pack, keeping unreachable objects as checkouts may still
+    reference them.
+
+    :raise SCMError: If repack failed
+    """
+    _run_or_raise(['git', 'repack', '-a', '-d', '--keep-unreachable', '--quiet'], 'Failed to repack object store',
+                  cwd=store_path)
+
+
+def _run_or_raise(cmd, error, cwd=None):
+    """ Run the git command silently and raise :class:`SCMError` with the error and git's error if it failed """
+    output, success = silent_run(cmd, cwd=cwd, return_output=2)
+
+    if not success:
+        errors = [line.split(': ', 1)[1] for line in output.split('\n') if re.match(r'(fatal|error|ERROR): ', line)]
+        raise SCMError('{}: {}'.format(error, errors[0] if errors else output.strip()))
 
 
+@invalidates_query_cache('repo_path')
 def checkout_files(files, repo_path=None):
     """ Checks out the given list of files. Raises on error. """
     silent_run(['git', 'checkout'] + files, cwd=repo_path)
 
 
+@invalidates_query_cache()
 def hard_reset(to_commit):
     run(['git', 'reset', '--hard', to_commit])
 
@@ -0,0 +1,129 @@
+"""
+Search for repos by name (e.g. wst checkout requests) using the [checkout] search_api_url, such as Github's search API.
+
+Results are cached in the cache dir for [checkout] search_cache_hours, and cached results are used regardless of their
+age when the search API can't be reached (e.g. offline). Requests share one session so that connections to the API
+are kept alive and reused, with a connection pool as large as the number of searches run at the same time.
+"""
+from __future__ import absolute_import
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from workspace.config import config
+from workspace.utils import cache_path, stream_call
+
+log = logging.getLogger(__name__)
+
+SEARCH_CACHE_FILE_NAME = 'repo-search.json'
+SEARCH_WORKERS = 10  # Max searches run at the same time, and connections kept in the session's pool
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """
+    Returns the requests session shared by the search threads. Only its connection pool is shared as the API does not
+    set cookies and they are rejected, so the session's cookie jar is unused.
+    """
+    global _session
+
+    with _session_lock:
+        if not _session:
+            from http.cookiejar import DefaultCookiePolicy
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            logging.getLogger('requests').setLevel(logging.WARN)
+            logging.getLogger('urllib3').setLevel(logging.WARN)
+            _session = requests.Session()
+            _session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+            adapter = HTTPAdapter(pool_maxsize=SEARCH_WORKERS)  # Otherwise, connections over the default 10 are dropped
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+
+    return _session
+
+
+def search_repos(names):
+    """
+    Find the repo URL (ssh) for each name, from the cache or the search API. Names that are not cached (or expired)
+    are searched at the same time.
+
+    :param list names: Names to search for
+    :return: Tuple of (dict of name to repo URL, dict of name to error message for names that could not be found)
+    """
+    cache = _load_cache()
+    expires = time.time() - config.checkout.search_cache_hours * 3600
+    urls = {}
+    errors = {}
+    searched = False
+
+    search_names = []
+    for name in names:
+        if name in cache and cache[name]['time'] > expires:
+            urls[name] = cache[name]['url']
+        elif name not in search_names:
+            search_names.append(name)
+
+    for name, url in stream_call(_search_repo, search_names, workers=SEARCH_WORKERS):
+        if isinstance(url, Exception):
+            if name in cache:
+                log.warning('Using cached repo URL for %s as search failed: %s', name, url)
+                urls[name] = cache[name]['url']
+            else:
+                errors[name] = 'Could not find repo for {} using {} due to error: {}'.format(
+                    name, config.checkout.search_api_url, url)
+
+        elif isinstance(url, BaseException):
+            raise url
+
+        elif url:
+            urls[name] = url
+            cache[name] = {'url': url, 'time': time.time()}
+            searched = True
+
+        else:
+            errors[name] = 'No repo matching "{}" found.'.format(name)
+
+    if searched:
+        _save_cache(cache)
+
+    return urls, errors
+
+
+def _search_repo(name):
+    """ Returns the repo URL of the best match for the name from the search API, or None if there is no match """
+    response = session().get(config.checkout.search_api_url, params={'q': name}, timeout=10)
+    response.raise_for_status()
+    results = response.json()['items']
+
+    if results:
+        return results[0]['ssh_url']
+
+
+def _load_cache():
+    try:
+        with open(cache_path(SEARCH_CACHE_FILE_NAME)) as fp:
+            return json.load(fp)
+
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    try:
+        cache_file = cache_path(SEARCH_CACHE_FILE_NAME)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(cache_file), delete=False) as fp:
+            json.dump(cache, fp)
+        os.rename(fp.name, cache_file)
+
+    except (IOError, OSError) as e:
+        log.debug('Could not save repo search cache: %s', e)
@@ -1,9 +1,13 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
 import logging
 import os
-import signal
+import queue
 import sys
 import tempfile
+import threading
+import time
 from utils.process import run
 
 
@@ -25,6 +29,32 @@ def shortest_id(name, names):
     return name[0:i+1]
 
 
+def cache_path(*names):
+    """
+    Path to a file / directory in the workspace-tools user cache dir (~/.cache/workspace-tools or under $XDG_CACHE_HOME)
+
+    :param names: Names to join with the cache dir
+    """
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join('~', '.cache')
+    return os.path.join(os.path.expanduser(cache_dir), 'workspace-tools', *names)
+
+
+def package_version(name):
+    """ Returns the version of the installed package, or None if it is not installed. """
+    try:
+        from importlib.metadata import version
+    except ImportError:  # Python < 3.8
+        from pkg_resources import get_distribution
+
+        def version(name):
+            return get_distribution(name).version
+
+    try:
+        return version(name)
+    except Exception:
+        return None
+
+
 def prompt_with_editor(instruction):
     """ Prompt user with instruction in $EDITOR and return the response """
 
@@ -106,9 +136,127 @@ def log_exception(title=None, exit=False, call=None, stack=False):
             sys.exit(1)
 
 
+def stream_call(call, args, workers=10, timeout=None, ordered=False, processes=False, group=None, group_workers=None):
+    """
+    Call a callable concurrently for each arg and yield the results as the calls complete.
+
+    Calls run in threads as they mostly wait on subprocesses, such as git or tox. Calls that have not started are
+    cancelled when the generator is closed or interrupted by CTRL+C, and running subprocesses get the CTRL+C from the
+    terminal directly.
+
+    :param callable call: Callable to call
+    :param list(iterable|non-iterable) args: List of args to call. One call per args.
+    :param int workers: Max number of calls to run at the same time.
+    :param float timeout: Max seconds for each call. A call that takes longer is abandoned and its result is a
+                          :class:`TimeoutError`. It keeps running in the background and holds on to its worker
+                          (and group) slot until it finishes, so no more than `workers` calls ever run at the
+                          same time.
+    :param bool ordered: Yield the results in the order of the args instead. Results are still yielded as soon as
+                         the calls for the args before them have completed.
+    :param bool processes: Run the calls in worker processes instead, such as for CPU bound calls. Call and args
+                           must be picklable.
+    :param callable group: Callable that returns the group of an arg, such as the git host of a repo. Calls are
+                           scheduled so that no more than `group_workers` calls run at the same time for a group.
+    :param int group_workers: Max number of calls to run at the same time per group.
+    :return: Generator of (args, result) in the order of completion (or args if ordered). Result is the exception if
+             the call raised one.
+    """
+    args = list(args)
+    results = queue.Queue()
+    cancelled = threading.Event()
+    pool = None
+    futures = []
+
+    if processes:
+        pool = ProcessPoolExecutor(workers)
+
+    def call_with(index):
+        if cancelled.is_set():
+            return
+
+        try:
+            call_args = _to_tuple(args[index])
+            if pool:
+                future = pool.submit(call, *call_args)
+                futures.append(future)
+                result = future.result()
+            else:
+                result = call(*call_args)
+        except BaseException as e:  # Such as SystemExit from click / sys.exit
+            result = e
+
+        results.put((index, result))
+
+    groups = [group(arg) if group else None for arg in args]
+    group_running = Counter()
+    pending = list(range(len(args)))  # Indexes of calls that have not started
+    started = {}  # Map of index to start time for running calls
+    timed_out = set()  # Indexes of calls that timed out but are still running
+    finished = {}  # Map of index to result for completed calls that have not been yielded
+    yielded = 0
+
+    def finish(index, result, still_running=False):
+        del started[index]
+        finished[index] = result
+
+        if still_running:
+            timed_out.add(index)
+        else:
+            group_running[groups[index]] -= 1
+
+    try:
+        while yielded < len(args):
+            for index in list(pending):
+                if len(started) + len(timed_out) >= workers:
+                    break
+
+                if group_workers and group_running[groups[index]] >= group_workers:
+                    continue
+
+                pending.remove(index)
+                group_running[groups[index]] += 1
+                started[index] = time.time()
+                threading.Thread(target=call_with, args=(index,), daemon=True).start()
+
+            try:
+                wait = max(0, min(started.values()) + timeout - time.time()) if timeout and started else None
+                index, result = results.get(timeout=wait)
+                if index in timed_out:  # Result is ignored, but its slot is now free
+                    timed_out.remove(index)
+                    group_running[groups[index]] -= 1
+                else:
+                    finish(index, result)
+
+            except queue.Empty:
+                for index, start_time in sorted(started.items()):
+                    if time.time() - start_time >= timeout:
+                        finish(index, TimeoutError('Timed out after {} seconds'.format(timeout)), still_running=True)
+
+            if ordered:
+                while yielded in finished:
+                    yield args[yielded], finished.pop(yielded)
+                    yielded += 1
+
+            else:
+                for index in list(finished):
+                    yield args[index], finished.pop(index)
+                    yielded += 1
+
+    finally:
+        cancelled.set()
+        if pool:
+            for future in futures:  # shutdown(cancel_futures=True) requires Python 3.9
+                future.cancel()
+            pool.shutdown(wait=False)
+
+
+def _to_tuple(arg):
+    return arg if isinstance(arg, (list, tuple, set)) else [arg]
+
+
 def parallel_call(call, args, callback=None, workers=10, show_progress=None, progress_title='Progress'):
     """
-    Call a callable in parallel for each arg
+    Call a callable in parallel for each arg. See :func:`stream_call` to get the results as they complete.
 
     :param callable call: Callable to call
     :param list(iterable|non-iterable) args: List of args to call. One call per args.
@@ -118,48 +266,56 @@ def parallel_call(call, args, callback=None, workers=10, show_progress=None, pro
                               If callable, it should accept two lists: completed args and all args and return progress string.
     :return dict: Map of args to their results on completion
     """
-    from multiprocessing import Pool, TimeoutError
-
-    signal.signal(signal.SIGTERM, lambda *args: sys.exit(1))
-    pool = Pool(workers, lambda: signal.signal(signal.SIGINT, signal.SIG_IGN))
-
-    def to_tuple(a):
-        return a if isinstance(a, (list, tuple, set)) else [a]
+    args = list(args)
+    results = {}
 
     try:
-        async_results = [(arg, pool.apply_async(call, to_tuple(arg), callback=callback)) for arg in args]
-
-        results = {}
-        while len(results) != len(async_results):
-            for arg, result in async_results:
-                if arg not in results:
-                    try:
-                        # This allows processes to be interrupted by CTRL+C
-                        results[arg] = result.get(1)
-                    except TimeoutError:
-                        pass
-                    except Exception as e:
-                        results[arg] = str(e)
+        for arg, result in stream_call(call, args, workers=workers):
+            if isinstance(result, BaseException):
+                results[arg] = str(result)
+            else:
+                results[arg] = result
+                if callback:
+                    callback(result)
 
             if show_progress:
                 if callable(show_progress):
                     progress = show_progress(list(results.keys()), args)
                 else:
-                    progress = '%.2f%% completed' % (len(results) * 100.0 / len(async_results))
+                    progress = '%.2f%% completed' % (len(results) * 100.0 / len(args))
                 show_status('%s: %s' % (progress_title, progress))
 
-        pool.close()
-        pool.join()
-
         return results
 
     except KeyboardInterrupt:
-        os.killpg(os.getpid(), signal.SIGTERM)  # Kills any child processes from subprocesses.
-        pool.terminate()
-        pool.join()
         sys.exit()
 
 
+def daemonize(log_file=os.devnull):
+    """
+    Detach the current process from the terminal to run in the background. Only the daemon process returns, and the
+    current process exits with :class:`SystemExit` so that it can clean up like any other command (e.g. when run by
+    the "wst daemon" worker).
+
+    :param str log_file: File to redirect stdout / stderr to
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    if os.fork():
+        sys.exit(0)
+
+    os.setsid()
+
+    if os.fork():
+        os._exit(0)
+
+    with open(os.devnull) as null, open(log_file, 'a') as log_fp:
+        os.dup2(null.fileno(), sys.stdin.fileno())
+        os.dup2(log_fp.fileno(), sys.stdout.fileno())
+        os.dup2(log_fp.fileno(), sys.stderr.fileno())
+
+
 def show_status(message):
     """
       :param str message: Status message to show. If not, then status bar will be cleared.